@@ -0,0 +1,205 @@
+"""
+GLM-4V 调用保护：令牌桶限流（每秒请求数 + 并发数）与熔断器
+状态保存在 SQLite 文件中，多个 Streamlit 进程 / worker 共享同一份限额；
+截止日前后大量同时识别时，超出限额的请求排队等待，上游持续失败时快速失败转手动填写
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+GUARD_DB_PATH = os.path.join("data", "api_guard.db")
+
+
+class RateLimitTimeout(RuntimeError):
+    """在等待时间内没有拿到调用名额"""
+
+
+class CircuitOpenError(RuntimeError):
+    """熔断器处于打开状态，请求被直接拒绝"""
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=10, isolation_level=None)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS token_bucket (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS inflight_slot (slot_id TEXT PRIMARY KEY, name TEXT NOT NULL, expires REAL NOT NULL)"
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS circuit_breaker ("
+        "name TEXT PRIMARY KEY, state TEXT NOT NULL, failures INTEGER NOT NULL, "
+        "opened_at REAL NOT NULL, probe_until REAL NOT NULL)"
+    )
+    return conn
+
+
+@contextmanager
+def _transaction(db_path: str) -> Iterator[sqlite3.Connection]:
+    """BEGIN IMMEDIATE 事务：跨进程互斥地读改写限流状态"""
+    conn = _connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+
+class TokenBucketLimiter:
+    """
+    跨进程令牌桶：每秒补充 rate 个令牌，最多积累 burst 个；
+    同时限制进行中的请求数不超过 max_concurrent。
+    进行中的名额带过期时间，持有名额的进程崩溃后名额会自动释放。
+    """
+
+    def __init__(
+        self,
+        name: str = "glm4v",
+        rate: float = 5.0,
+        burst: float = 10.0,
+        max_concurrent: int = 8,
+        slot_ttl: float = 120.0,
+        db_path: str = GUARD_DB_PATH,
+    ):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.slot_ttl = slot_ttl
+        self.db_path = db_path
+
+    def try_acquire(self) -> tuple[Optional[str], float]:
+        """尝试拿一个名额；成功返回 (slot_id, 0)，否则返回 (None, 建议等待秒数)"""
+        now = time.time()
+        with _transaction(self.db_path) as conn:
+            row = conn.execute("SELECT tokens, updated FROM token_bucket WHERE name = ?", (self.name,)).fetchone()
+            tokens = self.burst if row is None else min(self.burst, row[0] + (now - row[1]) * self.rate)
+            conn.execute("DELETE FROM inflight_slot WHERE name = ? AND expires < ?", (self.name, now))
+            in_flight = conn.execute("SELECT COUNT(*) FROM inflight_slot WHERE name = ?", (self.name,)).fetchone()[0]
+
+            slot_id = None
+            wait = 0.0
+            if tokens >= 1 and in_flight < self.max_concurrent:
+                tokens -= 1
+                slot_id = uuid.uuid4().hex
+                conn.execute(
+                    "INSERT INTO inflight_slot (slot_id, name, expires) VALUES (?, ?, ?)",
+                    (slot_id, self.name, now + self.slot_ttl),
+                )
+            elif tokens < 1:
+                wait = (1 - tokens) / self.rate if self.rate > 0 else 1.0
+            else:
+                wait = 0.1
+            conn.execute(
+                "INSERT OR REPLACE INTO token_bucket (name, tokens, updated) VALUES (?, ?, ?)",
+                (self.name, tokens, now),
+            )
+        return slot_id, wait
+
+    def acquire(self, timeout: float = 10.0) -> str:
+        """阻塞直到拿到名额，超时抛出 RateLimitTimeout"""
+        deadline = time.monotonic() + timeout
+        while True:
+            slot_id, wait = self.try_acquire()
+            if slot_id:
+                return slot_id
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise RateLimitTimeout("GLM-4V 调用排队超时，请稍后重试或手动填写")
+            time.sleep(min(max(wait, 0.02), 0.5, remaining))
+
+    def release(self, slot_id: str) -> None:
+        with _transaction(self.db_path) as conn:
+            conn.execute("DELETE FROM inflight_slot WHERE slot_id = ?", (slot_id,))
+
+    @contextmanager
+    def slot(self, timeout: float = 10.0) -> Iterator[str]:
+        slot_id = self.acquire(timeout)
+        try:
+            yield slot_id
+        finally:
+            self.release(slot_id)
+
+
+class CircuitBreaker:
+    """
+    跨进程熔断器：连续失败 failure_threshold 次后打开，打开期间请求直接失败；
+    冷却 cooldown_seconds 后放行一个探测请求（half_open），成功则关闭，失败则重新打开。
+    """
+
+    def __init__(
+        self,
+        name: str = "glm4v",
+        failure_threshold: int = 5,
+        cooldown_seconds: float = 30.0,
+        probe_timeout: float = 60.0,
+        db_path: str = GUARD_DB_PATH,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.probe_timeout = probe_timeout
+        self.db_path = db_path
+
+    def _load(self, conn: sqlite3.Connection) -> tuple[str, int, float, float]:
+        row = conn.execute(
+            "SELECT state, failures, opened_at, probe_until FROM circuit_breaker WHERE name = ?", (self.name,)
+        ).fetchone()
+        return row if row else ("closed", 0, 0.0, 0.0)
+
+    def _save(self, conn: sqlite3.Connection, state: str, failures: int, opened_at: float, probe_until: float) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO circuit_breaker (name, state, failures, opened_at, probe_until) VALUES (?, ?, ?, ?, ?)",
+            (self.name, state, failures, opened_at, probe_until),
+        )
+
+    def state(self) -> str:
+        conn = _connect(self.db_path)
+        try:
+            return self._load(conn)[0]
+        finally:
+            conn.close()
+
+    def before_call(self) -> None:
+        """调用前检查：打开状态下抛出 CircuitOpenError；冷却结束后只放行一个探测请求"""
+        now = time.time()
+        with _transaction(self.db_path) as conn:
+            state, failures, opened_at, probe_until = self._load(conn)
+            if state == "closed":
+                return
+            if now - opened_at < self.cooldown_seconds:
+                raise CircuitOpenError("GLM-4V 服务暂时不可用（熔断中），请手动填写信息")
+            if state == "half_open" and now < probe_until:
+                raise CircuitOpenError("GLM-4V 服务正在恢复探测中，请手动填写信息")
+            self._save(conn, "half_open", failures, opened_at, now + self.probe_timeout)
+
+    def record_success(self) -> None:
+        with _transaction(self.db_path) as conn:
+            state, failures, _, _ = self._load(conn)
+            if state != "closed" or failures:
+                self._save(conn, "closed", 0, 0.0, 0.0)
+
+    def record_failure(self) -> None:
+        now = time.time()
+        with _transaction(self.db_path) as conn:
+            state, failures, opened_at, _ = self._load(conn)
+            failures += 1
+            if state == "half_open" or failures >= self.failure_threshold:
+                self._save(conn, "open", failures, now, 0.0)
+            else:
+                self._save(conn, state, failures, opened_at, 0.0)
+
+    def reset(self) -> None:
+        with _transaction(self.db_path) as conn:
+            self._save(conn, "closed", 0, 0.0, 0.0)
@@ -4,9 +4,9 @@ Main Streamlit app: registration, login, upload, certificate submission.
 from __future__ import annotations
 
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import tempfile
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Tuple
 
 import streamlit as st
 import pandas as pd
@@ -14,36 +14,39 @@ from sqlmodel import select
 
 from auth_system import register_user, authenticate_user, infer_role_by_length, change_password, admin_reset_password
 from database import Certificate, User, get_session, init_db, SystemConfig
-from file_upload import save_upload
+from file_upload import save_upload_stream
 from file_validator import is_allowed_extension
-from pdf_converter import save_first_page_image
-from image_processor import image_to_base64, resize_image, rotate_image, load_image
+from pdf_converter import get_page_count, page_image_path, save_first_page_image
+from image_processor import image_to_base64, open_image, resize_image, rotate_image
 from user_import import import_users_from_excel, generate_report
-from form_handler import save_draft, submit_certificate, is_before_deadline, get_submission_deadline, load_cert_for_edit, batch_submit
+from form_handler import save_draft, save_page_drafts, submit_certificate, is_before_deadline, get_submission_deadline, load_cert_for_edit, batch_submit
 from admin_panel import set_deadline
+from extraction_metrics import prometheus_text, purge_metrics, summarize
 
 # 尝试导入GLM-4V相关模块
 try:
-    from info_extractor import extract_info
+    from info_extractor import extract_info, empty_result, router as extraction_router
+    from extraction_cache import file_sha256
+    from extraction_jobs import (
+        POLL_INTERVAL_SECONDS as JOB_POLL_SECONDS,
+        page_jobs,
+        poll_job,
+        start_page_extraction,
+        start_speculative_extraction,
+    )
+    from glm4v_api import DERIVATIVES_ENABLED, IMAGE_MAX_SIDE, derivative_store
     GLM4V_AVAILABLE = True
 except ImportError:
     GLM4V_AVAILABLE = False
-    # 如果没有GLM-4V模块，使用演示模式
-    def extract_info(image_path: str, api_key=None):
-        return {
-            "student_name": "",
-            "student_id": "",
-            "department": "",
-            "competition_name": "示例竞赛",
-            "award_category": "",
-            "award_level": "一等奖",
-            "competition_type": "",
-            "organizer": "示例主办方",
-            "award_date": datetime.utcnow().strftime("%Y-%m"),
-            "advisor": "",
-            "extraction_method": "demo",
-            "extraction_confidence": 0.0,
-        }
+    DERIVATIVES_ENABLED = False
+    IMAGE_MAX_SIDE = None
+    JOB_POLL_SECONDS = 1.0
+    extraction_router = None
+    from extraction_backends import DemoBackend, ExtractionRequest
+
+    # 如果没有GLM-4V模块，使用演示后端
+    def extract_info(image_path: str, api_key=None, source_path=None):
+        return DemoBackend().extract(ExtractionRequest(image_path, api_key=api_key, source_path=source_path))
 
 
 st.set_page_config(page_title="竞赛证书智能识别与管理", layout="wide")
@@ -51,6 +54,20 @@ st.set_page_config(page_title="竞赛证书智能识别与管理", layout="wide"
 ACCENT = "#7ac28a"  # 淡绿色主题
 BG_COLOR = "#f0f9f4"  # 非常淡的绿色背景（偏白）
 
+# 识别进度中展示的字段名称
+FIELD_LABELS = {
+    "student_id": "学号",
+    "student_name": "学生姓名",
+    "department": "所在学院",
+    "competition_name": "竞赛项目",
+    "award_category": "获奖类别",
+    "award_level": "获奖等级",
+    "competition_type": "竞赛类型",
+    "organizer": "主办单位",
+    "award_date": "获奖时间",
+    "advisor": "指导教师",
+}
+
 
 def inject_css():
     st.markdown(
@@ -335,9 +352,82 @@ def show_login():
                     st.error(f"❌ {msg}")
 
 
-def extract_certificate_fields(file_path: str) -> Dict[str, Any]:
+def preview_image(image_path: str) -> Tuple[Any, Optional[int]]:
+    """
+    页面预览图（宽 500px）与送模型图片的 Base64 长度。
+    优先读取派生图缓存（页面重跑只读一个小文件），缓存不可用时解码原图缩放。
+    """
+    if DERIVATIVES_ENABLED:
+        meta = derivative_store.ensure(image_path)
+        api = meta["renditions"].get("api")
+        return derivative_store.path(image_path, "preview"), (api["bytes"] + 2) // 3 * 4 if api else None
+    img = resize_image(rotate_image(open_image(image_path, max_width=500), 0), 500)
+    return img, len(image_to_base64(img))
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_job_progress(job_id: int) -> None:
+    """识别任务进行中时定时刷新的片段：展示已识别出的字段，任务结束后整页重跑，把结果预填到表单"""
+    job = poll_job(job_id)
+    if job is None or job["status"] in ("done", "failed"):
+        st.rerun()
+    st.info("⏳ 正在后台识别证书信息，完成后自动填入下方表单。您也可以先手动填写信息。")
+    if job["result"]:
+        lines = [f"- **{FIELD_LABELS.get(k, k)}**：{v}" for k, v in job["result"].items() if k in FIELD_LABELS]
+        st.markdown("已识别：\n" + "\n".join(lines))
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_page_jobs(user: User, pdf_path: str, content_hash: str, page_count: int) -> None:
+    """
+    按页识别的进度片段：定时查询各页任务，全部结束后每页保存一条草稿。
+    本次会话中发起的识别结束后自动保存；之前会话留下的结果（页面重新加载过）由用户确认后再保存，
+    避免覆盖已经在草稿中修改过的内容。
+    """
+    page_key = (user.user_id, content_hash)
+    preparing = st.session_state.get("page_extractions", {}).get(page_key)
+    if preparing is not None and not preparing.done():
+        st.progress(0.0, text="正在渲染页面...")
+        return
+    if preparing is not None and preparing.exception() is not None:
+        st.error(f"❌ 按页识别提交失败: {preparing.exception()}")
+        return
+    jobs = {page_number: poll_job(job_id) for page_number, job_id in page_jobs(user.user_id, content_hash).items()}
+    finished = {n: job for n, job in jobs.items() if job is not None and job["status"] in ("done", "failed")}
+    if len(finished) < len(jobs):
+        st.progress(len(finished) / page_count, text=f"正在按页识别，已完成 {len(finished)}/{page_count} 页")
+        return
+
+    saved = st.session_state.setdefault("page_drafts_saved", {})
+    if page_key not in saved:
+        if preparing is None and not st.button("📑 用已完成的按页识别结果生成草稿", type="secondary"):
+            st.info(f"📑 该PDF的 {len(finished)} 页已按页识别完成。")
+            return
+        file_name = os.path.basename(pdf_path)
+        page_results = {}
+        for page_number, job in finished.items():
+            page_result = job["result"] or {**empty_result(file_name), "_error": job["error"] or "识别失败"}
+            if user.role == "student":
+                page_result["student_id"] = page_result.get("student_id") or user.account_id
+                page_result["student_name"] = page_result.get("student_name") or user.name
+            elif user.role == "teacher":
+                page_result["advisor"] = page_result.get("advisor") or user.name
+            page_results[page_number] = page_result
+        cert_ids = save_page_drafts(user.user_id, user.role, pdf_path, page_results)
+        saved[page_key] = (len(cert_ids), sorted(n for n, r in page_results.items() if r.get("_error")))
+    draft_count, failed_pages = saved[page_key]
+    st.success(f"✅ 已生成 {draft_count} 条草稿，请在「我的草稿」中逐条核验后提交")
+    if failed_pages:
+        st.warning(f"⚠️ 第 {', '.join(map(str, failed_pages))} 页识别失败，请在草稿中手动填写")
+
+
+def extract_certificate_fields(file_path: str, user_id: int | None = None, content_hash: str | None = None) -> Dict[str, Any]:
     """
     使用GLM-4V API提取证书信息
+    传入 user_id 时以后台任务方式识别：任务在上传后已提前提交（见 start_speculative_extraction），
+    这里只查询一次任务状态，不等待；任务未结束时由 show_job_progress 片段定时查询，结束后整页重跑收取结果。
+    刷新或重跑页面会复用同一任务，不会重复调用API
+    content_hash 为上传时已算好的文件哈希，缺省时重新计算
     如果API调用失败，返回空字段供用户手动填写
     """
     file_name = os.path.basename(file_path)
@@ -346,10 +436,9 @@ def extract_certificate_fields(file_path: str) -> Dict[str, Any]:
     ext = os.path.splitext(file_path)[1].lower()
     image_path = file_path
     
-    # 如果是PDF，尝试使用转换后的预览图片
+    # 如果是PDF，使用第一页的渲染图（上传时识别任务或预览已生成）
     if ext == ".pdf":
-        # PDF已在上传时转换为PNG预览
-        preview_png_path = file_path + ".preview.png"
+        preview_png_path = page_image_path(file_path, 0)
         if os.path.exists(preview_png_path):
             image_path = preview_png_path
         else:
@@ -392,12 +481,28 @@ def extract_certificate_fields(file_path: str) -> Dict[str, Any]:
     # 尝试使用GLM-4V API提取
     try:
         with st.spinner("正在使用GLM-4V识别证书信息..."):
-            extracted = extract_info(image_path)
+            if GLM4V_AVAILABLE and user_id is not None:
+                job_id = start_speculative_extraction(user_id, file_path, content_hash or file_sha256(file_path)).result()
+                job = poll_job(job_id)
+                if job is None:
+                    raise RuntimeError("后台识别任务不存在")
+                if job["status"] not in ("done", "failed"):
+                    # 流式识别时字段逐个到达，片段中先展示已识别的内容
+                    show_job_progress(job_id)
+                    return {**empty_result(file_name), "extraction_method": "pending"}
+                if job["result"] is None:
+                    raise RuntimeError(job["error"] or "后台识别任务失败")
+                extracted = job["result"]
+            else:
+                extracted = extract_info(image_path, source_path=file_path)
             extracted["file_name"] = file_name
             if extracted.get("_error"):
                 st.warning(f"信息提取失败: {extracted['_error']}。请手动填写信息。")
             else:
                 st.success("信息提取成功！请核验并补充缺失字段。")
+            if extracted.get("_mismatch"):
+                names = "、".join(FIELD_LABELS.get(k, k) for k in extracted["_mismatch"])
+                st.warning(f"⚠️ 证书上的{names}与您的账号信息不一致，请仔细核对。")
             return extracted
     except Exception as e:  # noqa: BLE001
         st.warning(f"信息提取失败: {e}。请手动填写信息。")
@@ -496,7 +601,7 @@ def certificate_form(role: str, defaults: Dict[str, Any]) -> Dict[str, Any]:
         # 识别信息提示
         extraction_method = defaults.get("extraction_method", "demo")
         extraction_confidence = defaults.get("extraction_confidence", 0.0)
-        if extraction_method not in ["demo", "none", "failed"]:
+        if extraction_method not in ["demo", "none", "failed", "pending"]:
             st.markdown(
                 f"""
                 <div class="info-box">
@@ -573,14 +678,24 @@ def show_upload_and_form(user: User):
         st.info("💡 提示：请先上传证书文件以开始识别流程")
         return
 
-    file_bytes = uploaded.getvalue()
-    ok, path, msg = save_upload(user.user_id, uploaded.name, file_bytes)
-    if not ok:
-        st.error(f"❌ {msg}")
-        return
+    # 页面每次重跑 file_uploader 都返回同一个上传对象：按 file_id 复用已保存的文件和内容哈希，不再重新写盘和计算哈希
+    saved_uploads = st.session_state.setdefault("saved_uploads", {})
+    upload_key = (user.user_id, uploaded.file_id)
+    if upload_key in saved_uploads and os.path.exists(saved_uploads[upload_key][0]):
+        path, content_hash = saved_uploads[upload_key]
+    else:
+        # 分块写入磁盘并同时计算哈希，不再复制整个文件；声明大小超限或内容与扩展名不符时直接拒绝
+        ok, path, content_hash, msg = save_upload_stream(user.user_id, uploaded.name, uploaded, size=uploaded.size)
+        if not ok:
+            st.error(f"❌ {msg}")
+            return
+        saved_uploads[upload_key] = (path, content_hash)
     
     st.success(f"✅ 文件上传成功：{uploaded.name}")
 
+    # 文件一落盘就在后台开始识别，与下面的 PDF 渲染和预览同时进行
+    speculative = start_speculative_extraction(user.user_id, path, content_hash) if GLM4V_AVAILABLE else None
+
     # 预览区域
     st.markdown("### 🖼️ 第二步：证书预览")
     ext = os.path.splitext(uploaded.name)[1].lower()
@@ -588,9 +703,17 @@ def show_upload_and_form(user: User):
     pdf_conversion_failed = False
     
     if ext == ".pdf":
-        png_path = path + ".preview.png"
+        png_path = page_image_path(path, 0)
         try:
-            preview_path = save_first_page_image(path, png_path)
+            if speculative is not None:
+                # 后台识别任务会渲染第一页：等它完成（已完成时立即返回）后直接使用它的渲染图，同一页不渲染两次
+                try:
+                    speculative.result()
+                except Exception:  # noqa: BLE001
+                    pass
+            if not os.path.exists(png_path):
+                save_first_page_image(path, png_path, max_side=IMAGE_MAX_SIDE)
+            preview_path = png_path
         except Exception as exc:  # noqa: BLE001
             pdf_conversion_failed = True
             error_msg = str(exc)
@@ -635,25 +758,42 @@ def show_upload_and_form(user: User):
     # 只有非PDF文件或PDF转换成功时才显示预览
     if not pdf_conversion_failed and is_allowed_extension(preview_path) and os.path.exists(preview_path):
         try:
-            img = load_image(preview_path)
-            img = rotate_image(img, 0)
-            # 缩小预览图片，使其能在一个屏幕内完整显示（缩小到350px）
-            img = resize_image(img, 500)
+            # 缩小预览图片，使其能在一个屏幕内完整显示
+            img, base64_length = preview_image(preview_path)
             
             # 使用卡片容器展示预览
             with st.container():
                 st.image(img, caption="证书预览", width=500)
                 col_info1, col_info2 = st.columns(2)
                 with col_info1:
-                    st.caption(f"📏 文件大小: {len(file_bytes) / 1024:.1f} KB")
+                    st.caption(f"📏 文件大小: {uploaded.size / 1024:.1f} KB")
                 with col_info2:
-                    st.caption(f"🔢 Base64 长度: {len(image_to_base64(img))} 字符")
+                    if base64_length is not None:
+                        st.caption(f"🔢 Base64 长度: {base64_length} 字符")
         except Exception as exc:  # noqa: BLE001
             st.warning(f"⚠️ 预览失败: {exc}")
     elif ext == ".pdf" and pdf_conversion_failed:
         # PDF转换失败时，提示用户可以继续填写表单
         st.info("💡 虽然PDF预览失败，但您仍可以继续填写证书信息并提交。")
 
+    # 多页 PDF（每页一张证书）：每页一个后台识别任务，全部结束后每页生成一条草稿
+    if ext == ".pdf" and not pdf_conversion_failed and GLM4V_AVAILABLE:
+        try:
+            page_count = get_page_count(path)
+        except Exception:  # noqa: BLE001
+            page_count = 1
+        if page_count > 1:
+            st.info(f"📑 该PDF共 {page_count} 页。如果每页是一张证书，可以按页批量识别，每页生成一条草稿。")
+            page_key = (user.user_id, content_hash)
+            started = st.session_state.setdefault("page_extractions", {})
+            existing_jobs = page_jobs(user.user_id, content_hash)
+            if page_key not in started and not existing_jobs:
+                if st.button(f"📑 按页批量识别（共 {page_count} 页）", type="secondary"):
+                    # 渲染和识别都在后台进行，页面不等待；重新加载后任务仍在队列中
+                    started[page_key] = start_page_extraction(user.user_id, path, content_hash)
+            if page_key in started or existing_jobs:
+                show_page_jobs(user, path, content_hash, page_count)
+
     # 信息提取（如果PDF转换失败，跳过图片识别，使用空字段）
     st.markdown("### 🤖 第三步：智能识别信息")
     if ext == ".pdf" and pdf_conversion_failed:
@@ -674,7 +814,7 @@ def show_upload_and_form(user: User):
             "file_name": os.path.basename(path),
         }
     else:
-        extracted = extract_certificate_fields(path)
+        extracted = extract_certificate_fields(path, user.user_id, content_hash)
     st.session_state.extracted = extracted
 
     defaults = {
@@ -703,7 +843,6 @@ def show_upload_and_form(user: User):
     deadline = get_submission_deadline()
     if deadline:
         try:
-            from datetime import datetime
             deadline_dt = datetime.fromisoformat(deadline)
             now = datetime.utcnow()
             if now > deadline_dt:
@@ -763,21 +902,19 @@ def show_edit_draft(user: User, draft_data: Dict[str, Any]):
         st.markdown("### 🖼️ 证书预览")
         ext = os.path.splitext(file_path)[1].lower()
         preview_path = file_path
-        if ext == ".pdf":
-            png_path = file_path + ".preview.png"
-            if os.path.exists(png_path):
-                preview_path = png_path
-        
         pdf_preview_available = False
         if ext == ".pdf":
-            png_path = file_path + ".preview.png"
+            png_path = page_image_path(file_path, 0)
+            legacy_png_path = file_path + ".preview.png"  # 早期版本上传时生成的预览图
+            if not os.path.exists(png_path) and os.path.exists(legacy_png_path):
+                png_path = legacy_png_path
             if os.path.exists(png_path):
                 preview_path = png_path
                 pdf_preview_available = True
             else:
                 # 尝试转换PDF
                 try:
-                    preview_path = save_first_page_image(file_path, png_path)
+                    preview_path = save_first_page_image(file_path, png_path, max_side=IMAGE_MAX_SIDE)
                     pdf_preview_available = True
                 except Exception as exc:  # noqa: BLE001
                     error_msg = str(exc)
@@ -790,9 +927,7 @@ def show_edit_draft(user: User, draft_data: Dict[str, Any]):
         if pdf_preview_available or ext != ".pdf":
             if is_allowed_extension(preview_path) and os.path.exists(preview_path):
                 try:
-                    img = load_image(preview_path)
-                    img = rotate_image(img, 0)
-                    img = resize_image(img, 500)
+                    img, _ = preview_image(preview_path)
                     st.image(img, caption="证书预览", width=500)
                 except Exception as exc:  # noqa: BLE001
                     st.warning(f"⚠️ 预览失败: {exc}")
@@ -825,7 +960,6 @@ def show_edit_draft(user: User, draft_data: Dict[str, Any]):
     deadline = get_submission_deadline()
     if deadline:
         try:
-            from datetime import datetime
             deadline_dt = datetime.fromisoformat(deadline)
             now = datetime.utcnow()
             if now > deadline_dt:
@@ -927,7 +1061,8 @@ def show_my_drafts(user: User):
     st.write(f"共 {len(drafts)} 条草稿")
     
     for draft in drafts:
-        with st.expander(f"📄 {draft.competition_name or '未命名'} - {draft.created_at.strftime('%Y-%m-%d %H:%M')}"):
+        page_label = f" （第 {draft.page_number} 页）" if draft.page_number else ""
+        with st.expander(f"📄 {draft.competition_name or '未命名'}{page_label} - {draft.created_at.strftime('%Y-%m-%d %H:%M')}"):
             col1, col2 = st.columns(2)
             with col1:
                 st.write(f"**学生姓名：** {draft.student_name}")
@@ -1107,7 +1242,6 @@ def show_admin_tools(user: User):
         deadline = get_submission_deadline()
         if deadline:
             try:
-                from datetime import datetime
                 deadline_dt = datetime.fromisoformat(deadline)
                 st.info(f"当前截止时间：{deadline_dt.strftime('%Y-%m-%d %H:%M:%S')}")
             except Exception:
@@ -1128,7 +1262,6 @@ def show_admin_tools(user: User):
             if st.button("设置截止时间", width='stretch'):
                 if new_deadline:
                     try:
-                        from datetime import datetime
                         datetime.fromisoformat(new_deadline)  # 验证格式
                         if set_deadline(new_deadline, user.user_id):
                             st.success("✅ 截止时间设置成功")
@@ -1147,7 +1280,6 @@ def show_admin_tools(user: User):
         with col_exp1:
             if st.button("导出CSV", width='stretch'):
                 from data_export import export_to_csv
-                from datetime import datetime
                 filename = f"certificates_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
                 try:
                     export_to_csv(filename)
@@ -1164,7 +1296,6 @@ def show_admin_tools(user: User):
         with col_exp2:
             if st.button("导出Excel", width='stretch'):
                 from data_export import export_to_excel
-                from datetime import datetime
                 filename = f"certificates_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
                 try:
                     export_to_excel(filename)
@@ -1181,7 +1312,7 @@ def show_admin_tools(user: User):
 
     st.markdown("### 📊 数据查看")
     
-    tabs = st.tabs(["👥 用户列表", "📋 提交记录", "📈 统计信息"])
+    tabs = st.tabs(["👥 用户列表", "📋 提交记录", "📈 统计信息", "⏱️ 识别性能"])
     
     with tabs[0]:
         st.markdown("#### 所有注册用户")
@@ -1328,6 +1459,73 @@ def show_admin_tools(user: User):
         else:
             st.info("暂无统计数据")
 
+    with tabs[3]:
+        st.markdown("#### ⏱️ 识别链路性能")
+        window = st.selectbox(
+            "统计范围",
+            [1, 24, 24 * 7, 0],
+            index=1,
+            format_func=lambda h: "全部" if h == 0 else (f"最近 {h} 小时" if h < 48 else f"最近 {h // 24} 天"),
+            key="metrics_window",
+        )
+        since = datetime.utcnow() - timedelta(hours=window) if window else None
+        summary = summarize(since)
+        if not summary["calls"]:
+            st.info("暂无识别调用记录")
+        else:
+            col_m1, col_m2, col_m3, col_m4 = st.columns(4)
+            with col_m1:
+                st.metric("API 调用次数", summary["calls"])
+            with col_m2:
+                st.metric("失败次数", summary["errors"])
+            with col_m3:
+                st.metric("输入 tokens", summary["tokens"]["prompt_tokens"])
+            with col_m4:
+                st.metric("输出 tokens", summary["tokens"]["completion_tokens"])
+
+            stage_names = {
+                "decode": "图片解码",
+                "resize": "缩放",
+                "encode": "编码",
+                "base64": "Base64",
+                "network": "网络请求",
+                "stream": "流式读取",
+                "parse": "解析响应",
+                "repair": "修复调用",
+                "total": "合计",
+            }
+            stages_df = pd.DataFrame(summary["stages"]).rename(
+                columns={"stage": "阶段", "count": "次数", "p50_ms": "p50 (ms)", "p95_ms": "p95 (ms)", "p99_ms": "p99 (ms)", "avg_bytes": "平均字节数"}
+            )
+            stages_df["阶段"] = stages_df["阶段"].map(lambda s: stage_names.get(s, s))
+            st.dataframe(stages_df, width='stretch', hide_index=True)
+
+        if extraction_router is not None:
+            st.markdown("##### 识别后端（本进程最近调用）")
+            backends_df = pd.DataFrame(extraction_router.stats()).rename(
+                columns={
+                    "backend": "后端",
+                    "cost": "相对成本",
+                    "healthy": "满足 SLO",
+                    "calls": "调用次数",
+                    "success_rate": "成功率",
+                    "p50_seconds": "p50 (秒)",
+                    "p95_seconds": "p95 (秒)",
+                }
+            )
+            st.dataframe(backends_df, width='stretch', hide_index=True)
+            st.caption(f"延迟 SLO：{extraction_router.latency_slo:g} 秒；不满足 SLO 的后端只在其他后端失败时使用")
+
+        with st.expander("Prometheus 文本格式"):
+            metrics_text = prometheus_text(since)
+            st.code(metrics_text, language="text")
+            st.download_button("下载指标", metrics_text, file_name="extraction_metrics.prom", mime="text/plain")
+
+        retention_days = st.number_input("清理多少天之前的指标记录", min_value=1, value=30, step=1, key="metrics_retention")
+        if st.button("🧹 清理历史指标", key="purge_metrics"):
+            removed = purge_metrics(retention_days)
+            st.success(f"已删除 {removed} 条指标记录")
+
 
 def main():
     # 确保数据库表已创建
@@ -1389,7 +1587,6 @@ def main():
     deadline = get_submission_deadline()
     if deadline:
         try:
-            from datetime import datetime
             deadline_dt = datetime.fromisoformat(deadline)
             now = datetime.utcnow()
             if now > deadline_dt:
@@ -0,0 +1,66 @@
+"""
+识别链路压测脚本：并发调用 extract_with_glm4v，统计吞吐量与延迟分位数
+不经过结果缓存，每次都真实发出请求。建议配合 mock_glm4v_server.py 离线运行：
+
+    python mock_glm4v_server.py --port 8765 --burst-every 20 --burst-length 2
+    set GLM4V_API_URL=http://127.0.0.1:8765/api/paas/v4/chat/completions
+    python bench_extraction.py --requests 200 --concurrency 16
+"""
+from __future__ import annotations
+
+import argparse
+import glob
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+from extraction_metrics import percentile
+from glm4v_api import GLM4V_API_URL, extract_with_glm4v, load_api_key
+
+
+def _timed_call(image_path: str, api_key: str) -> Tuple[float, bool, str]:
+    start = time.perf_counter()
+    try:
+        extract_with_glm4v(image_path, api_key=api_key)
+        return time.perf_counter() - start, True, ""
+    except Exception as exc:  # noqa: BLE001
+        return time.perf_counter() - start, False, str(exc)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GLM-4V 识别链路压测")
+    parser.add_argument("--requests", type=int, default=50, help="请求总数")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发数")
+    parser.add_argument("--images", default="sample_certificates/*.png,sample_certificates/*.jpg,test_files/*.png", help="图片通配符，逗号分隔")
+    args = parser.parse_args()
+
+    images = sorted({p for pattern in args.images.split(",") for p in glob.glob(pattern.strip())})
+    if not images:
+        print("未找到图片")
+        return
+    api_key = load_api_key() or "mock-key"
+    print(f"目标：{GLM4V_API_URL}")
+    print(f"图片 {len(images)} 张，请求 {args.requests} 次，并发 {args.concurrency}")
+
+    tasks = [images[i % len(images)] for i in range(args.requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(lambda p: _timed_call(p, api_key), tasks))
+    elapsed = time.perf_counter() - start
+
+    latencies = [r[0] for r in results if r[1]]
+    errors = [r[2] for r in results if not r[1]]
+    print(f"总耗时 {elapsed:.2f}s，吞吐量 {len(results) / elapsed:.2f} 次/秒")
+    print(f"成功 {len(latencies)}，失败 {len(errors)}")
+    if latencies:
+        print(
+            "延迟 p50={:.3f}s p95={:.3f}s p99={:.3f}s max={:.3f}s".format(
+                percentile(latencies, 50), percentile(latencies, 95), percentile(latencies, 99), max(latencies)
+            )
+        )
+    for message in sorted(set(errors))[:5]:
+        print(f"  错误示例：{message}")
+
+
+if __name__ == "__main__":
+    main()
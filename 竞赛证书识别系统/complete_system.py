@@ -1,11 +1,12 @@
 """
 完整系统主程序（命令行辅助脚本）
-功能：初始化数据库、设置截止时间、导出数据示例、启动 Streamlit 界面
+功能：初始化数据库、设置截止时间、导出数据示例、启动 Streamlit 界面、运行后台识别 worker
 """
 from __future__ import annotations
 import argparse
 import os
 import subprocess
+import sys
 from datetime import datetime
 
 from database import init_db
@@ -18,7 +19,13 @@ def main():
     parser.add_argument("--set-deadline", type=str, help="设置提交截止时间（ISO 格式，例如 2025-01-15T23:59:59）")
     parser.add_argument("--export-csv", type=str, help="将已提交数据导出为CSV，指定输出路径")
     parser.add_argument("--export-xlsx", type=str, help="将已提交数据导出为Excel，指定输出路径")
-    parser.add_argument("--run-ui", action="store_true", help="使用 Streamlit 运行 Web 界面（调用: streamlit run app.py）")
+    parser.add_argument("--run-ui", action="store_true", help="使用 Streamlit 运行 Web 界面（调用: streamlit run app.py），同时启动后台识别 worker")
+    parser.add_argument("--run-worker", action="store_true", help="在前台运行后台识别 worker（处理上传页面提交的识别任务）")
+    parser.add_argument("--no-worker", action="store_true", help="与 --run-ui 一起使用时不启动后台识别 worker")
+    parser.add_argument("--metrics", action="store_true", help="以 Prometheus 文本格式输出识别链路指标")
+    parser.add_argument("--rasterize", type=str, metavar="DIR", help="用多进程将目录中所有 PDF 的每一页渲染为 PNG（可为已上传的 PDF 预先生成渲染图）")
+    parser.add_argument("--out", type=str, help="与 --rasterize 一起使用：PNG 输出目录，缺省时写在 PDF 旁边")
+    parser.add_argument("--max-side", type=int, help="与 --rasterize 一起使用：限制渲染图最长边（像素）")
 
     args = parser.parse_args()
 
@@ -39,13 +46,46 @@ def main():
         out = export_all_excel(args.export_xlsx)
         print(f"Excel 导出完成：{out}")
 
+    if args.metrics:
+        from extraction_metrics import prometheus_text
+        print(prometheus_text(), end="")
+
+    if args.rasterize:
+        from raster_service import get_raster_service
+        service = get_raster_service()
+        done = failed = 0
+        for pdf_path, page_number, result in service.convert_directory(args.rasterize, args.out, max_side=args.max_side):
+            if isinstance(result, Exception):
+                failed += 1
+                print(f"渲染失败：{pdf_path} 第 {page_number} 页：{result}")
+            else:
+                done += 1
+        print(f"渲染完成：{done} 页，失败 {failed} 页（{service.workers} 个进程）")
+
+    if args.run_worker:
+        from extraction_jobs import run_worker
+        print("后台识别 worker 已启动，按 Ctrl+C 停止")
+        try:
+            run_worker()
+        except KeyboardInterrupt:
+            print("worker 已停止")
+
     if args.run_ui:
+        worker = None
+        if not args.no_worker:
+            # worker 作为独立进程运行，识别任务不受页面刷新和重跑影响
+            worker = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--run-worker"])
+            print(f"后台识别 worker 已启动（PID {worker.pid}）")
         print("启动 Streamlit 应用：streamlit run app.py")
         # 使用 subprocess 调用，用户需要在终端中执行；这里尝试直接启动
         try:
             subprocess.run(["streamlit", "run", "app.py"], check=False)
         except FileNotFoundError:
             print("未找到 streamlit。请先安装并在终端中运行：pip install streamlit，然后执行：streamlit run app.py")
+        finally:
+            if worker is not None:
+                worker.terminate()
+                worker.wait()
 
 
 if __name__ == "__main__":
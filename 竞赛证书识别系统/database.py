@@ -9,6 +9,7 @@ from contextlib import contextmanager
 from datetime import datetime
 from typing import Optional
 
+from sqlalchemy import inspect, text
 from sqlmodel import Field, Session, SQLModel, create_engine, select
 import bcrypt
 
@@ -62,6 +63,8 @@ class Certificate(SQLModel, table=True):
     award_date: Optional[str] = None  # YYYY-MM
     advisor: Optional[str] = None
     file_path: str
+    file_id: Optional[int] = Field(default=None, foreign_key="file.file_id")
+    page_number: Optional[int] = None  # 多页 PDF 按页识别时的页码（从 1 开始），整份文件为 None
     extraction_method: Optional[str] = None  # glm4v/baidu/local等
     extraction_confidence: Optional[float] = None
     status: str = Field(default="draft")  # draft / submitted
@@ -80,15 +83,95 @@ class SystemConfig(SQLModel, table=True):
     updated_by: Optional[int] = Field(default=None, foreign_key="user.user_id")
 
 
+class ExtractionCache(SQLModel, table=True):
+    __tablename__ = "extraction_cache"
+    __table_args__ = {"extend_existing": True}
+    cache_id: Optional[int] = Field(default=None, primary_key=True)
+    cache_key: str = Field(unique=True, index=True)  # sha256(图片内容哈希 + 模型 + 提示词版本)
+    content_hash: str = Field(index=True)  # 图片文件内容的 sha256
+    model: str
+    prompt_version: str
+    result_json: str
+    size_bytes: int
+    hit_count: int = Field(default=0)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    last_accessed: datetime = Field(default_factory=datetime.utcnow, index=True)
+    expires_at: Optional[datetime] = None  # 早于 ttl_hours 过期的条目（如字段不完整的结果）
+
+
+class ExtractionJob(SQLModel, table=True):
+    __tablename__ = "extraction_job"
+    __table_args__ = {"extend_existing": True}
+    job_id: Optional[int] = Field(default=None, primary_key=True)
+    user_id: int = Field(foreign_key="user.user_id")
+    file_path: str  # 上传的原始文件
+    image_path: str  # 实际送去识别的图片（PDF 为页面渲染图）
+    content_hash: str = Field(index=True)
+    page_number: Optional[int] = None  # 多页 PDF 按页识别时的页码（从1开始）；None 表示整份文件
+    status: str = Field(default="queued", index=True)  # queued / running / done / failed
+    result_json: Optional[str] = None
+    error: Optional[str] = None
+    attempts: int = Field(default=0)
+    lease_token: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class ExtractionMetric(SQLModel, table=True):
+    __tablename__ = "extraction_metrics"
+    __table_args__ = {"extend_existing": True}
+    metric_id: Optional[int] = Field(default=None, primary_key=True)
+    call_id: str = Field(index=True)  # 同一次 API 调用的各阶段共用
+    stage: str = Field(index=True)  # decode/resize/encode/base64/network/parse/stream/total
+    duration_ms: float
+    size_bytes: Optional[int] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    total_tokens: Optional[int] = None
+    model: str = ""
+    status: str = Field(default="ok")  # ok / error
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+
 @contextmanager
 def get_session():
     with Session(engine) as session:
         yield session
 
 
+# 旧数据库中缺少的列：create_all 不会修改已有表，需要手动补齐
+MIGRATION_COLUMNS = {
+    "certificate": {
+        "file_id": "INTEGER REFERENCES file(file_id)",
+        "page_number": "INTEGER",
+    },
+    "extraction_cache": {
+        "expires_at": "TIMESTAMP",
+    },
+    "extraction_job": {
+        "page_number": "INTEGER",
+    },
+}
+
+
+def migrate_db():
+    """为已有数据库补齐新增的列"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table, columns in MIGRATION_COLUMNS.items():
+            if not inspector.has_table(table):
+                continue
+            existing = {col["name"] for col in inspector.get_columns(table)}
+            for name, ddl in columns.items():
+                if name not in existing:
+                    conn.execute(text(f'ALTER TABLE "{table}" ADD COLUMN {name} {ddl}'))
+
+
 def init_db():
     """初始化数据库表并创建默认管理员账号"""
     SQLModel.metadata.create_all(engine)
+    migrate_db()
     with get_session() as session:
         admin = session.exec(select(User).where(User.account_id == "admin")).first()
         if not admin:
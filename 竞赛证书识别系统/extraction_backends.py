@@ -0,0 +1,157 @@
+"""
+识别后端注册表与路由：电子版 PDF 文本层、GLM-4V 各级模型、演示数据等后端实现同一接口，
+各自记录最近的耗时、成功率和单次成本。路由器按延迟 SLO 和成本为每次请求排出尝试顺序，
+前一个后端失败或结果不完整时自动切换到下一个。
+新增后端只需继承 ExtractionBackend 并注册到路由器（见 info_extractor.router），页面代码无需改动。
+"""
+from __future__ import annotations
+
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from extraction_metrics import percentile
+
+
+@dataclass
+class ExtractionRequest:
+    """一次识别请求；known 为已知字段（账号信息及精确后端已识别的字段），on_field 为字段回调"""
+
+    image_path: str
+    api_key: Optional[str] = None
+    source_path: Optional[str] = None
+    page_index: int = 0
+    known: Dict[str, Any] = field(default_factory=dict)
+    on_field: Optional[Callable[[str, Any], None]] = None
+
+
+class BackendStats:
+    """最近 window 次调用的耗时（秒）与成败，仅统计当前进程"""
+
+    def __init__(self, window: int = 50):
+        self._calls: Deque[Tuple[float, bool]] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self._calls.append((seconds, ok))
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = list(self._calls)
+        latencies = [seconds for seconds, ok in calls if ok]
+        return {
+            "calls": len(calls),
+            "success_rate": sum(ok for _, ok in calls) / len(calls) if calls else None,
+            "p50_seconds": percentile(latencies, 50) if latencies else None,
+            "p95_seconds": percentile(latencies, 95) if latencies else None,
+        }
+
+
+class ExtractionBackend(ABC):
+    """
+    识别后端抽象基类，子类必须实现 extract。extract 返回原始字段字典；后端不适用于本次请求时返回 None（不计入失败），
+    调用失败时抛出异常，由路由器切换到下一个后端。
+    """
+
+    name = "base"
+    cost = 0.0  # 单次调用的相对成本，路由器优先选择便宜的后端
+    authoritative = False  # 结果为精确文字（如 PDF 文本层），合并时优先于其他后端，并作为已知字段交给后续后端
+    streams = False  # 是否通过 request.on_field 自行发布字段
+    fallback_only = False  # 只在其他后端都没有结果时使用
+
+    def __init__(self, window: int = 50):
+        self.stats = BackendStats(window)
+
+    def supports(self, request: ExtractionRequest) -> bool:
+        return True
+
+    @abstractmethod
+    def extract(self, request: ExtractionRequest) -> Optional[Dict[str, Any]]:
+        """识别一次请求，返回原始字段字典"""
+
+    def is_complete(self, result: Dict[str, Any]) -> bool:
+        """规范化后的结果是否足够完整，可以不再尝试后续后端"""
+        return True
+
+
+class DemoBackend(ExtractionBackend):
+    """演示数据：没有可用的识别服务时返回示例字段，供用户手动修改"""
+
+    name = "demo"
+    fallback_only = True
+
+    def extract(self, request: ExtractionRequest) -> Optional[Dict[str, Any]]:
+        return {
+            "student_name": "",
+            "student_id": "",
+            "department": "",
+            "competition_name": "示例竞赛",
+            "award_category": "",
+            "award_level": "一等奖",
+            "competition_type": "",
+            "organizer": "示例主办方",
+            "award_date": datetime.utcnow().strftime("%Y-%m"),
+            "advisor": "",
+            "extraction_method": "demo",
+            "extraction_confidence": 0.0,
+        }
+
+
+class BackendRouter:
+    """
+    按请求排出后端的尝试顺序：健康的后端在前，其中成本低的优先，成本相同按注册顺序；
+    最近 p95 耗时超过 latency_slo 或成功率低于 min_success_rate 的后端排到最后，只作故障转移。
+    调用次数不足 min_samples 的后端视为健康。
+    """
+
+    def __init__(self, latency_slo: float, min_success_rate: float = 0.5, min_samples: int = 5):
+        self.latency_slo = latency_slo
+        self.min_success_rate = min_success_rate
+        self.min_samples = min_samples
+        self._backends: List[ExtractionBackend] = []
+        self._lock = threading.Lock()
+
+    def register(self, backend: ExtractionBackend) -> None:
+        """注册后端；同名后端替换原有的注册"""
+        with self._lock:
+            self._backends = [b for b in self._backends if b.name != backend.name] + [backend]
+
+    def get(self, name: str) -> Optional[ExtractionBackend]:
+        return next((b for b in self._backends if b.name == name), None)
+
+    def healthy(self, backend: ExtractionBackend) -> bool:
+        snapshot = backend.stats.snapshot()
+        if snapshot["calls"] < self.min_samples:
+            return True
+        if snapshot["success_rate"] < self.min_success_rate:
+            return False
+        return snapshot["p95_seconds"] is None or snapshot["p95_seconds"] <= self.latency_slo
+
+    def plan(self, request: ExtractionRequest) -> List[ExtractionBackend]:
+        candidates = [(index, b) for index, b in enumerate(self._backends) if b.supports(request)]
+        candidates.sort(key=lambda item: (item[1].fallback_only, not self.healthy(item[1]), item[1].cost, item[0]))
+        return [b for _, b in candidates]
+
+    def call(self, backend: ExtractionBackend, request: ExtractionRequest) -> Optional[Dict[str, Any]]:
+        """调用后端并记录耗时与成败；不适用（返回 None）的调用不计入统计"""
+        start = time.perf_counter()
+        try:
+            result = backend.extract(request)
+        except Exception:
+            backend.stats.record(time.perf_counter() - start, False)
+            raise
+        if result is not None:
+            backend.stats.record(time.perf_counter() - start, True)
+        return result
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """各后端的最近耗时、成功率、成本和健康状态，供管理控制台展示"""
+        return [
+            {"backend": b.name, "cost": b.cost, "healthy": self.healthy(b), **b.stats.snapshot()}
+            for b in self._backends
+        ]
@@ -0,0 +1,130 @@
+"""
+识别结果缓存：按图片内容哈希缓存 GLM-4V 的返回结果
+Streamlit 每次交互都会重跑脚本，同一张证书命中缓存后无需再次调用 API
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from sqlmodel import func, or_, select
+
+from database import ExtractionCache, get_session
+from glm4v_api import load_api_config
+
+_cache_config = load_api_config("cache")
+CACHE_ENABLED = bool(_cache_config.get("enabled", True))
+CACHE_TTL_HOURS = float(_cache_config.get("ttl_hours", 24 * 7))
+# 关键字段不完整的结果只缓存较短时间：避免重复付费，又能较快地重新识别
+INCOMPLETE_TTL_HOURS = float(_cache_config.get("incomplete_ttl_hours", 1))
+CACHE_MAX_BYTES = int(float(_cache_config.get("max_mb", 50)) * 1024 * 1024)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    """分块计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_cache_key(content_hash: str, model: str, prompt_version: str) -> str:
+    """缓存键：图片内容哈希 + 模型名 + 提示词版本"""
+    return hashlib.sha256(f"{content_hash}:{model}:{prompt_version}".encode("utf-8")).hexdigest()
+
+
+def get_cached(cache_key: str) -> Optional[Dict[str, Any]]:
+    """读取缓存；过期条目会被删除并返回 None"""
+    if not CACHE_ENABLED:
+        return None
+    now = datetime.utcnow()
+    with get_session() as session:
+        entry = session.exec(select(ExtractionCache).where(ExtractionCache.cache_key == cache_key)).first()
+        if not entry:
+            return None
+        if entry.created_at < now - timedelta(hours=CACHE_TTL_HOURS) or (entry.expires_at and entry.expires_at < now):
+            session.delete(entry)
+            session.commit()
+            return None
+        entry.last_accessed = now
+        entry.hit_count += 1
+        session.add(entry)
+        session.commit()
+        return json.loads(entry.result_json)
+
+
+def put_cached(
+    cache_key: str,
+    content_hash: str,
+    model: str,
+    prompt_version: str,
+    result: Dict[str, Any],
+    ttl_hours: Optional[float] = None,
+) -> None:
+    """写入（或覆盖）缓存，并按 TTL 和容量上限淘汰旧条目；ttl_hours 为该条目的有效期（不超过全局 TTL）"""
+    if not CACHE_ENABLED:
+        return
+    result_json = json.dumps(result, ensure_ascii=False)
+    size_bytes = len(result_json.encode("utf-8"))
+    now = datetime.utcnow()
+    expires_at = now + timedelta(hours=ttl_hours) if ttl_hours is not None else None
+    with get_session() as session:
+        entry = session.exec(select(ExtractionCache).where(ExtractionCache.cache_key == cache_key)).first()
+        if entry:
+            entry.result_json = result_json
+            entry.size_bytes = size_bytes
+            entry.created_at = now
+            entry.last_accessed = now
+            entry.expires_at = expires_at
+        else:
+            entry = ExtractionCache(
+                cache_key=cache_key,
+                content_hash=content_hash,
+                model=model,
+                prompt_version=prompt_version,
+                result_json=result_json,
+                size_bytes=size_bytes,
+                expires_at=expires_at,
+            )
+        session.add(entry)
+        session.commit()
+    evict()
+
+
+def evict(max_bytes: int = CACHE_MAX_BYTES, ttl_hours: float = CACHE_TTL_HOURS) -> int:
+    """删除过期条目，再按最近访问时间（LRU）淘汰直到总大小不超过上限，返回删除条数"""
+    removed = 0
+    with get_session() as session:
+        now = datetime.utcnow()
+        cutoff = now - timedelta(hours=ttl_hours)
+        expired = or_(ExtractionCache.created_at < cutoff, ExtractionCache.expires_at < now)
+        for entry in session.exec(select(ExtractionCache).where(expired)).all():
+            session.delete(entry)
+            removed += 1
+        session.commit()
+
+        total = session.exec(select(func.coalesce(func.sum(ExtractionCache.size_bytes), 0))).one()
+        if total > max_bytes:
+            for entry in session.exec(select(ExtractionCache).order_by(ExtractionCache.last_accessed)).all():
+                if total <= max_bytes:
+                    break
+                total -= entry.size_bytes
+                session.delete(entry)
+                removed += 1
+            session.commit()
+    return removed
+
+
+def clear_cache() -> int:
+    """清空缓存，返回删除条数"""
+    with get_session() as session:
+        entries = session.exec(select(ExtractionCache)).all()
+        for entry in entries:
+            session.delete(entry)
+        session.commit()
+        return len(entries)
@@ -0,0 +1,455 @@
+"""
+后台识别任务队列：上传页面只负责入队和查询状态，识别由 worker 进程完成
+任务以租约方式领取，worker 崩溃后租约过期，任务会被其他 worker 重新领取
+运行 worker: python complete_system.py --run-worker
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+from sqlalchemy import and_, or_, update
+from sqlmodel import select
+
+from database import ExtractionJob, SystemConfig, User, get_session
+from glm4v_api import IMAGE_MAX_SIDE, load_api_config
+from info_extractor import extract_info, known_fields_for_user
+from pdf_converter import get_page_count, page_image_path
+from raster_service import get_raster_service
+
+_jobs_config = load_api_config("jobs")
+LEASE_SECONDS = float(_jobs_config.get("lease_seconds", 180))
+MAX_ATTEMPTS = int(_jobs_config.get("max_attempts", 3))
+POLL_INTERVAL_SECONDS = float(_jobs_config.get("poll_interval_seconds", 1.0))
+# 任务排队超过该时间仍无 worker 领取时，由页面进程的后台线程领取并执行
+INLINE_FALLBACK_SECONDS = float(_jobs_config.get("inline_fallback_seconds", 5))
+# 上游临时故障（限流、熔断、网络、5xx）导致失败的任务重新排队，第 n 次重试至少等待 n × retry_delay_seconds
+RETRY_DELAY_SECONDS = float(_jobs_config.get("retry_delay_seconds", 10))
+# worker 心跳记录在 system_config 表中；超过该时间未更新视为没有 worker 在运行
+HEARTBEAT_KEY = "extraction_worker_heartbeat"
+HEARTBEAT_STALE_SECONDS = 30
+
+ACTIVE_STATUSES = ("queued", "running", "done")
+
+# 上传后立即在后台准备并提交识别任务（与页面渲染预览同时进行），按 (用户, 文件哈希) 去重
+SPECULATIVE_WORKERS = int(_jobs_config.get("speculative_workers", 4))
+SPECULATIVE_MAX_ENTRIES = 256
+_speculative_pool = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="speculative")
+# 执行任务可能耗时较长，单独使用线程池，避免阻塞后续上传的准备工作
+_inline_pool = ThreadPoolExecutor(max_workers=SPECULATIVE_WORKERS, thread_name_prefix="speculative-run")
+_speculative: Dict[Tuple[int, str], Future] = {}
+_speculative_lock = threading.Lock()
+# 已提交到 _inline_pool 尚未执行完的任务，轮询时不重复提交
+_inline_jobs: Set[int] = set()
+_inline_lock = threading.Lock()
+
+
+def enqueue_job(
+    user_id: int, file_path: str, image_path: str, content_hash: str, page_number: Optional[int] = None
+) -> int:
+    """
+    创建识别任务并返回 job_id。page_number 为多页 PDF 按页识别时的页码（从1开始），None 表示整份文件。
+    同一用户相同内容（同一页）的任务（未失败）会被复用，页面重跑不会重复识别。
+    """
+    same_page = ExtractionJob.page_number.is_(None) if page_number is None else ExtractionJob.page_number == page_number
+    with get_session() as session:
+        existing = session.exec(
+            select(ExtractionJob)
+            .where(
+                (ExtractionJob.user_id == user_id)
+                & (ExtractionJob.content_hash == content_hash)
+                & same_page
+                & (ExtractionJob.status.in_(ACTIVE_STATUSES))
+            )
+            .order_by(ExtractionJob.job_id.desc())
+        ).first()
+        if existing:
+            return existing.job_id
+        job = ExtractionJob(
+            user_id=user_id, file_path=file_path, image_path=image_path, content_hash=content_hash, page_number=page_number
+        )
+        session.add(job)
+        session.commit()
+        return job.job_id
+
+
+def get_job_status(job_id: int) -> Optional[Dict[str, Any]]:
+    """
+    查询任务状态；任务完成时附带解析后的识别结果，运行中时附带已识别出的部分字段。
+    lease_expires_at 对运行中的任务是租约到期时间，对等待重试的排队任务是最早可以再次领取的时间。
+    """
+    with get_session() as session:
+        job = session.get(ExtractionJob, job_id)
+        if not job:
+            return None
+        return {
+            "job_id": job.job_id,
+            "status": job.status,
+            "error": job.error,
+            "attempts": job.attempts,
+            "page_number": job.page_number,
+            "created_at": job.created_at,
+            "lease_expires_at": job.lease_expires_at,
+            "result": json.loads(job.result_json) if job.result_json else None,
+        }
+
+
+def claim_job(job_id: Optional[int] = None, lease_seconds: float = LEASE_SECONDS) -> Optional[ExtractionJob]:
+    """
+    领取一个任务：排队中的任务（等待重试的任务需到了重试时间），或租约已过期的运行中任务。
+    使用单条 UPDATE 完成领取，多个 worker 并发领取时不会拿到同一任务。
+    """
+    now = datetime.utcnow()
+    token = uuid.uuid4().hex
+    claimable = and_(
+        ExtractionJob.attempts < MAX_ATTEMPTS,
+        or_(
+            and_(
+                ExtractionJob.status == "queued",
+                or_(ExtractionJob.lease_expires_at.is_(None), ExtractionJob.lease_expires_at < now),
+            ),
+            and_(ExtractionJob.status == "running", ExtractionJob.lease_expires_at < now),
+        ),
+    )
+    if job_id is None:
+        target = (
+            select(ExtractionJob.job_id).where(claimable).order_by(ExtractionJob.job_id).limit(1).scalar_subquery()
+        )
+    else:
+        target = job_id
+    with get_session() as session:
+        session.execute(
+            update(ExtractionJob)
+            .where(and_(ExtractionJob.job_id == target, claimable))
+            .values(
+                status="running",
+                lease_token=token,
+                lease_expires_at=now + timedelta(seconds=lease_seconds),
+                attempts=ExtractionJob.attempts + 1,
+                result_json=None,
+                updated_at=now,
+            )
+        )
+        session.commit()
+        return session.exec(select(ExtractionJob).where(ExtractionJob.lease_token == token)).first()
+
+
+def _finish_job(
+    job_id: int,
+    lease_token: str,
+    status: str,
+    result: Optional[Dict[str, Any]] = None,
+    error: Optional[str] = None,
+    retry_at: Optional[datetime] = None,
+) -> bool:
+    """写回任务结果；租约已被他人接管时不写入。重新排队的任务在 retry_at 之前不会被领取"""
+    with get_session() as session:
+        job = session.get(ExtractionJob, job_id)
+        if not job or job.lease_token != lease_token:
+            return False
+        job.status = status
+        job.result_json = json.dumps(result, ensure_ascii=False, default=str) if result is not None else None
+        job.error = error
+        job.lease_token = None
+        job.lease_expires_at = retry_at
+        job.updated_at = datetime.utcnow()
+        session.add(job)
+        session.commit()
+        return True
+
+
+def _renew_lease(job_id: int, lease_token: str, partial: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    续租：把租约延长到 LEASE_SECONDS 之后，同时写入已识别出的部分字段（如有）。
+    返回 False 表示租约已被他人接管（或任务已结束），调用方应放弃本次执行的结果。
+    """
+    now = datetime.utcnow()
+    values: Dict[str, Any] = {"lease_expires_at": now + timedelta(seconds=LEASE_SECONDS), "updated_at": now}
+    if partial is not None:
+        values["result_json"] = json.dumps(partial, ensure_ascii=False)
+    with get_session() as session:
+        result = session.execute(
+            update(ExtractionJob)
+            .where(
+                and_(
+                    ExtractionJob.job_id == job_id,
+                    ExtractionJob.lease_token == lease_token,
+                    ExtractionJob.status == "running",
+                )
+            )
+            .values(**values)
+        )
+        session.commit()
+        return bool(result.rowcount)
+
+
+def _save_partial(job_id: int, lease_token: str, partial: Dict[str, Any]) -> bool:
+    """运行中写入已识别出的部分字段（供页面轮询时逐步预填）并续租；租约已被他人接管时不写入"""
+    return _renew_lease(job_id, lease_token, partial)
+
+
+def expire_stale_jobs() -> int:
+    """租约过期且已达到最大尝试次数的任务标记为失败，返回处理条数"""
+    now = datetime.utcnow()
+    with get_session() as session:
+        result = session.execute(
+            update(ExtractionJob)
+            .where(
+                and_(
+                    ExtractionJob.status == "running",
+                    ExtractionJob.lease_expires_at < now,
+                    ExtractionJob.attempts >= MAX_ATTEMPTS,
+                )
+            )
+            .values(status="failed", error="任务多次执行超时", lease_token=None, updated_at=now)
+        )
+        session.commit()
+        return result.rowcount or 0
+
+
+def run_job(job: ExtractionJob, on_progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> bool:
+    """
+    执行已领取的任务。上游临时故障（结果带 _transient，或抛出异常）且未达到 MAX_ATTEMPTS 时任务重新排队，
+    等待 RETRY_DELAY_SECONDS 递增的时间后再被领取；其他错误（结果带 _error）或次数用尽时任务记为 failed，
+    下次上传相同内容会重新入队；结果仍然写回，供页面展示空表单。
+    识别过程中每得到一个字段就写入任务记录（同时续租），并回调 on_progress(已识别字段)。
+    执行期间后台线程每 LEASE_SECONDS / 3 续租一次，耗时超过一个租约的识别（多级模型、对冲、重试）
+    不会被其他 worker 或页面重新领取而重复调用 API；续租失败说明租约已被接管，本次结果直接丢弃。
+    """
+    retry = job.attempts < MAX_ATTEMPTS
+    partial: Dict[str, Any] = {}
+    lost = threading.Event()
+    stop = threading.Event()
+
+    def publish(key: str, value: Any) -> None:
+        partial[key] = value
+        if not _save_partial(job.job_id, job.lease_token, partial):
+            lost.set()
+        if on_progress is not None:
+            on_progress(dict(partial))
+
+    def keep_lease() -> None:
+        while not stop.wait(LEASE_SECONDS / 3):
+            try:
+                renewed = _renew_lease(job.job_id, job.lease_token)
+            except Exception:  # noqa: BLE001 - 数据库暂时不可用时下一轮再续
+                continue
+            if not renewed:
+                lost.set()
+                return
+
+    renewer = threading.Thread(target=keep_lease, name=f"lease-{job.job_id}", daemon=True)
+    renewer.start()
+    try:
+        with get_session() as session:
+            known = known_fields_for_user(session.get(User, job.user_id))
+        page_index = (job.page_number or 1) - 1
+        result = extract_info(
+            job.image_path, source_path=job.file_path, page_index=page_index, on_field=publish, known=known
+        )
+        result["file_name"] = os.path.basename(job.file_path)
+    except Exception as exc:  # noqa: BLE001
+        result = None
+        error = str(exc)
+    finally:
+        stop.set()
+        renewer.join()
+    if lost.is_set():
+        return False
+    retry_at = datetime.utcnow() + timedelta(seconds=RETRY_DELAY_SECONDS * job.attempts)
+    if result is None:
+        if retry:
+            return _finish_job(job.job_id, job.lease_token, "queued", error=error, retry_at=retry_at)
+        return _finish_job(job.job_id, job.lease_token, "failed", error=error)
+    if result.get("_transient") and retry:
+        return _finish_job(job.job_id, job.lease_token, "queued", error=result["_error"], retry_at=retry_at)
+    if result.get("_error"):
+        return _finish_job(job.job_id, job.lease_token, "failed", result=result, error=result["_error"])
+    return _finish_job(job.job_id, job.lease_token, "done", result=result)
+
+
+def touch_heartbeat() -> None:
+    """记录 worker 心跳"""
+    now = datetime.utcnow()
+    with get_session() as session:
+        cfg = session.exec(select(SystemConfig).where(SystemConfig.config_key == HEARTBEAT_KEY)).first()
+        if cfg:
+            cfg.config_value = now.isoformat()
+            cfg.updated_at = now
+        else:
+            cfg = SystemConfig(config_key=HEARTBEAT_KEY, config_value=now.isoformat(), description="Extraction worker heartbeat (UTC)")
+        session.add(cfg)
+        session.commit()
+
+
+def worker_alive() -> bool:
+    """最近是否有 worker 在运行"""
+    with get_session() as session:
+        cfg = session.exec(select(SystemConfig).where(SystemConfig.config_key == HEARTBEAT_KEY)).first()
+    if not cfg:
+        return False
+    try:
+        beat = datetime.fromisoformat(cfg.config_value)
+    except ValueError:
+        return False
+    return (datetime.utcnow() - beat).total_seconds() < HEARTBEAT_STALE_SECONDS
+
+
+def poll_job(job_id: int, inline_after: float = INLINE_FALLBACK_SECONDS) -> Optional[Dict[str, Any]]:
+    """
+    查询任务状态，立即返回，不等待任务完成；页面定时调用（见 app.extract_certificate_fields）。
+    没有 worker 在运行、任务排队超过 inline_after 秒仍无人领取，或运行中任务的租约已过期（执行它的进程已退出）时，
+    把任务交给本进程的后台线程执行，这样只运行 streamlit 时页面也能正常工作；识别从不在调用方线程中执行。
+    """
+    status = get_job_status(job_id)
+    if status is None:
+        return None
+    now = datetime.utcnow()
+    lease = status["lease_expires_at"]
+    if status["status"] == "queued":
+        waited = (now - status["created_at"]).total_seconds()
+        if (lease is None or lease < now) and (waited >= inline_after or not worker_alive()):
+            _submit_inline(job_id)
+    elif status["status"] == "running" and lease is not None and lease < now:
+        if status["attempts"] >= MAX_ATTEMPTS:
+            expire_stale_jobs()
+            return get_job_status(job_id)
+        _submit_inline(job_id)
+    return status
+
+
+def _submit_inline(job_id: int) -> None:
+    with _inline_lock:
+        if job_id in _inline_jobs:
+            return
+        _inline_jobs.add(job_id)
+    _inline_pool.submit(_run_inline, job_id)
+
+
+def _run_inline(job_id: int) -> None:
+    """没有 worker 时由后台线程执行任务；任务已被 worker 领取或还没到重试时间时什么也不做"""
+    try:
+        job = claim_job(job_id)
+        if job:
+            run_job(job)
+    finally:
+        with _inline_lock:
+            _inline_jobs.discard(job_id)
+
+
+def _prepare_and_enqueue(user_id: int, file_path: str, content_hash: str) -> int:
+    """渲染识别用的图片（PDF 取第一页）并入队；没有 worker 在运行时在后台线程中直接执行"""
+    image_path = file_path
+    if file_path.lower().endswith(".pdf"):
+        image_path = page_image_path(file_path, 0)
+        if not os.path.exists(image_path):
+            get_raster_service().render(file_path, 0, image_path, max_side=IMAGE_MAX_SIDE)
+    job_id = enqueue_job(user_id, file_path, image_path, content_hash)
+    if not worker_alive():
+        _submit_inline(job_id)
+    return job_id
+
+
+def _speculative_live(future: Future) -> bool:
+    """已完成的预提交是否仍可复用：准备过程没有出错，且它提交的任务存在、没有失败"""
+    if future.exception() is not None:
+        return False
+    status = get_job_status(future.result())
+    return status is not None and status["status"] != "failed"
+
+
+def start_speculative_extraction(user_id: int, file_path: str, content_hash: str) -> Future:
+    """
+    文件保存后立即调用：在后台线程中准备图片、提交识别任务，返回结果为 job_id 的 Future。
+    同一用户相同内容的文件（页面重跑时会再次保存上传文件）返回同一个 Future；
+    准备失败的 Future，以及对应任务已失败或已不存在的 Future 会重新提交（enqueue_job 随之创建新任务）。
+    页面之后用 poll_job(job_id) 查询结果。
+    """
+    key = (user_id, content_hash)
+    with _speculative_lock:
+        future = _speculative.get(key)
+        if future is None or (future.done() and not _speculative_live(future)):
+            if len(_speculative) >= SPECULATIVE_MAX_ENTRIES:
+                for stale in [k for k, f in _speculative.items() if f.done()]:
+                    del _speculative[stale]
+            future = _speculative_pool.submit(_prepare_and_enqueue, user_id, file_path, content_hash)
+            _speculative[key] = future
+    return future
+
+
+def _prepare_pages(user_id: int, pdf_path: str, content_hash: str) -> Dict[int, int]:
+    """
+    多页 PDF 按页识别：所有页一起提交给栅格化服务渲染，每页渲染完成后入队一个任务。
+    渲染失败的页同样入队（识别时只剩文本层可用，失败后在草稿中手动填写）。返回 {页码: job_id}
+    """
+    page_count = get_page_count(pdf_path)
+    raster = get_raster_service()
+    renders = {
+        page_index: raster.submit(pdf_path, page_index, page_image_path(pdf_path, page_index), max_side=IMAGE_MAX_SIDE)
+        for page_index in range(page_count)
+        if not os.path.exists(page_image_path(pdf_path, page_index))
+    }
+    inline = not worker_alive()
+    job_ids: Dict[int, int] = {}
+    for page_index in range(page_count):
+        if page_index in renders:
+            try:
+                renders[page_index].result()
+            except Exception:  # noqa: BLE001
+                pass
+        job_id = enqueue_job(
+            user_id, pdf_path, page_image_path(pdf_path, page_index), content_hash, page_number=page_index + 1
+        )
+        if inline:
+            _submit_inline(job_id)
+        job_ids[page_index + 1] = job_id
+    return job_ids
+
+
+def start_page_extraction(user_id: int, pdf_path: str, content_hash: str) -> Future:
+    """
+    在后台线程中渲染多页 PDF 的所有页并为每页提交识别任务，返回结果为 {页码: job_id} 的 Future。
+    页面不等待识别，之后用 page_jobs(user_id, content_hash) 和 poll_job 查询各页状态；
+    重新加载页面后任务仍在队列中，不会丢失。
+    """
+    return _speculative_pool.submit(_prepare_pages, user_id, pdf_path, content_hash)
+
+
+def page_jobs(user_id: int, content_hash: str) -> Dict[int, int]:
+    """该用户这份 PDF 的按页识别任务，{页码: 最新的 job_id}；没有按页识别过时为空"""
+    with get_session() as session:
+        rows = session.exec(
+            select(ExtractionJob.page_number, ExtractionJob.job_id)
+            .where(
+                (ExtractionJob.user_id == user_id)
+                & (ExtractionJob.content_hash == content_hash)
+                & ExtractionJob.page_number.is_not(None)
+            )
+            .order_by(ExtractionJob.job_id)
+        ).all()
+    return {page_number: job_id for page_number, job_id in rows}
+
+
+def run_worker(poll_interval: float = POLL_INTERVAL_SECONDS, once: bool = False) -> int:
+    """worker 主循环：领取并执行任务，队列为空时休眠；返回已处理任务数"""
+    processed = 0
+    last_beat = 0.0
+    while True:
+        if time.monotonic() - last_beat >= HEARTBEAT_STALE_SECONDS / 3:
+            touch_heartbeat()
+            last_beat = time.monotonic()
+        expire_stale_jobs()
+        job = claim_job()
+        if job:
+            run_job(job)
+            processed += 1
+            continue
+        if once:
+            return processed
+        time.sleep(poll_interval)
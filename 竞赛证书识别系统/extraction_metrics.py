@@ -0,0 +1,212 @@
+"""
+识别链路指标：记录每次 GLM-4V 调用各阶段的耗时、数据量和 token 用量，写入 extraction_metrics 表
+管理控制台展示 p50/p95/p99 汇总，也可以导出 Prometheus 文本格式：
+    python complete_system.py --metrics
+"""
+from __future__ import annotations
+
+import math
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import delete
+from sqlmodel import select
+
+from database import ExtractionMetric, get_session
+
+# 每次调用的汇总行使用的阶段名
+TOTAL_STAGE = "total"
+SUMMARY_QUANTILES = (50, 95, 99)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class CallMetrics:
+    """
+    一次识别调用的指标：按阶段记录耗时（毫秒）和数据量（字节），以及接口返回的 token 用量。
+    finish() 时一次性写入数据库，每个阶段一行，另加一行 total 汇总。
+    """
+
+    def __init__(self, model: str = "", enabled: bool = True):
+        self.call_id = uuid.uuid4().hex
+        self.model = model
+        self.enabled = enabled
+        self.spans: List[Dict[str, Any]] = []
+        self.usage: Dict[str, int] = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def span(self, stage: str) -> Iterator[Dict[str, Any]]:
+        """计时一个阶段；在 with 块内设置 span["bytes"] 可记录该阶段产出的数据量"""
+        record: Dict[str, Any] = {"stage": stage, "bytes": None}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["duration_ms"] = (time.perf_counter() - start) * 1000
+            self.spans.append(record)
+
+    def add_span(self, stage: str, duration_ms: float, size_bytes: Optional[int] = None) -> None:
+        """记录一个在 with 块之外计时的阶段（例如回调中才知道结束时间的阶段）"""
+        self.spans.append({"stage": stage, "bytes": size_bytes, "duration_ms": duration_ms})
+
+    def set_usage(self, usage: Optional[Dict[str, Any]]) -> None:
+        """保存接口响应中的 usage 段"""
+        if not usage:
+            return
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            if usage.get(key) is not None:
+                self.usage[key] = int(usage[key])
+
+    def finish(self, status: str = "ok") -> None:
+        """写入数据库；指标写入失败不影响识别本身"""
+        if not self.enabled:
+            return
+        total_ms = (time.perf_counter() - self.started) * 1000
+        now = datetime.utcnow()
+        rows = [
+            ExtractionMetric(
+                call_id=self.call_id,
+                stage=span["stage"],
+                duration_ms=span["duration_ms"],
+                size_bytes=span["bytes"],
+                model=self.model,
+                status=status,
+                created_at=now,
+            )
+            for span in self.spans
+        ]
+        rows.append(
+            ExtractionMetric(
+                call_id=self.call_id,
+                stage=TOTAL_STAGE,
+                duration_ms=total_ms,
+                prompt_tokens=self.usage.get("prompt_tokens"),
+                completion_tokens=self.usage.get("completion_tokens"),
+                total_tokens=self.usage.get("total_tokens"),
+                model=self.model,
+                status=status,
+                created_at=now,
+            )
+        )
+        try:
+            with get_session() as session:
+                session.add_all(rows)
+                session.commit()
+        except Exception:
+            pass
+
+
+def _load_rows(since: Optional[datetime] = None) -> List[ExtractionMetric]:
+    with get_session() as session:
+        query = select(ExtractionMetric)
+        if since is not None:
+            query = query.where(ExtractionMetric.created_at >= since)
+        return list(session.exec(query).all())
+
+
+def recent_percentile(
+    stage: str,
+    pct: float,
+    model: Optional[str] = None,
+    limit: int = 200,
+    min_samples: int = 1,
+) -> Optional[float]:
+    """最近 limit 次成功调用中某阶段耗时（秒）的分位数；记录少于 min_samples 条时返回 None"""
+    with get_session() as session:
+        query = select(ExtractionMetric.duration_ms).where(
+            (ExtractionMetric.stage == stage) & (ExtractionMetric.status == "ok")
+        )
+        if model:
+            query = query.where(ExtractionMetric.model == model)
+        values = list(session.exec(query.order_by(ExtractionMetric.metric_id.desc()).limit(limit)).all())
+    if len(values) < max(1, min_samples):
+        return None
+    return percentile(values, pct) / 1000
+
+
+def summarize(since: Optional[datetime] = None) -> Dict[str, Any]:
+    """
+    按阶段汇总：调用次数、p50/p95/p99 耗时（毫秒）、平均数据量；
+    以及调用总数、失败数和 token 用量合计。
+    """
+    rows = _load_rows(since)
+    durations: Dict[str, List[float]] = defaultdict(list)
+    sizes: Dict[str, List[int]] = defaultdict(list)
+    calls = errors = 0
+    tokens = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    for row in rows:
+        durations[row.stage].append(row.duration_ms)
+        if row.size_bytes is not None:
+            sizes[row.stage].append(row.size_bytes)
+        if row.stage == TOTAL_STAGE:
+            calls += 1
+            errors += row.status != "ok"
+            for key in tokens:
+                tokens[key] += getattr(row, key) or 0
+
+    stages = []
+    for stage, values in sorted(durations.items(), key=lambda item: item[0] == TOTAL_STAGE):
+        entry: Dict[str, Any] = {"stage": stage, "count": len(values)}
+        for q in SUMMARY_QUANTILES:
+            entry[f"p{q}_ms"] = round(percentile(values, q), 1)
+        entry["avg_bytes"] = int(sum(sizes[stage]) / len(sizes[stage])) if sizes[stage] else None
+        stages.append(entry)
+    return {"calls": calls, "errors": errors, "tokens": tokens, "stages": stages}
+
+
+def prometheus_text(since: Optional[datetime] = None) -> str:
+    """以 Prometheus 文本格式导出指标（summary 的分位数 + 各类计数器）"""
+    rows = _load_rows(since)
+    durations: Dict[str, List[float]] = defaultdict(list)
+    sizes: Dict[str, int] = defaultdict(int)
+    calls: Dict[str, int] = defaultdict(int)
+    tokens = {"prompt": 0, "completion": 0}
+    for row in rows:
+        durations[row.stage].append(row.duration_ms / 1000)
+        if row.size_bytes is not None:
+            sizes[row.stage] += row.size_bytes
+        if row.stage == TOTAL_STAGE:
+            calls[row.status] += 1
+            tokens["prompt"] += row.prompt_tokens or 0
+            tokens["completion"] += row.completion_tokens or 0
+
+    lines = [
+        "# HELP glm4v_stage_duration_seconds Time spent in each extraction stage.",
+        "# TYPE glm4v_stage_duration_seconds summary",
+    ]
+    for stage, values in sorted(durations.items()):
+        for q in SUMMARY_QUANTILES:
+            lines.append(f'glm4v_stage_duration_seconds{{stage="{stage}",quantile="{q / 100:g}"}} {percentile(values, q):.6f}')
+        lines.append(f'glm4v_stage_duration_seconds_sum{{stage="{stage}"}} {sum(values):.6f}')
+        lines.append(f'glm4v_stage_duration_seconds_count{{stage="{stage}"}} {len(values)}')
+    lines += ["# HELP glm4v_stage_bytes_total Bytes produced by each extraction stage.", "# TYPE glm4v_stage_bytes_total counter"]
+    for stage, total in sorted(sizes.items()):
+        lines.append(f'glm4v_stage_bytes_total{{stage="{stage}"}} {total}')
+    lines += ["# HELP glm4v_tokens_total Tokens reported by the API usage block.", "# TYPE glm4v_tokens_total counter"]
+    for kind, total in tokens.items():
+        lines.append(f'glm4v_tokens_total{{kind="{kind}"}} {total}')
+    lines += ["# HELP glm4v_calls_total Extraction calls by outcome.", "# TYPE glm4v_calls_total counter"]
+    for status, count in sorted(calls.items()):
+        lines.append(f'glm4v_calls_total{{status="{status}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+
+def purge_metrics(retention_days: float) -> int:
+    """删除超过保留期的指标记录，返回删除行数"""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    with get_session() as session:
+        result = session.execute(delete(ExtractionMetric).where(ExtractionMetric.created_at < cutoff))
+        session.commit()
+        return result.rowcount or 0
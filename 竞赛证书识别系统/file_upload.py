@@ -3,46 +3,83 @@ File upload handling.
 """
 from __future__ import annotations
 
+import hashlib
+import io
 import os
-import time
-import random
-from datetime import datetime
+import tempfile
+from typing import BinaryIO, Optional
 
 from database import File, get_session
-from file_validator import validate_file
+from file_validator import MAX_FILE_SIZE, SNIFF_BYTES, validate_file, validate_file_header
 
 
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
+CHUNK_SIZE = 1024 * 1024
 
 
 def save_upload(user_id: int, filename: str, file_bytes: bytes) -> tuple[bool, str, str]:
     """Save uploaded file and record in database."""
-    ok, msg = validate_file(filename, len(file_bytes))
+    ok, file_path, _, msg = save_upload_stream(user_id, filename, io.BytesIO(file_bytes), len(file_bytes))
+    return ok, file_path, msg
+
+
+def save_upload_stream(
+    user_id: int,
+    filename: str,
+    stream: BinaryIO,
+    size: Optional[int] = None,
+) -> tuple[bool, str, str, str]:
+    """
+    Stream an upload to disk and record it in the database; returns (ok, path, sha256, message).
+
+    The declared size is checked before anything is read, the first chunk is
+    sniffed for PDF/PNG/JPEG magic bytes, and the running size is checked per
+    chunk. Chunks go to a temp file in UPLOAD_DIR while the SHA-256 is
+    computed, then the file is renamed into place. The final name contains
+    the content hash, so saving the same file again (e.g. on a page rerun)
+    reuses the existing file instead of writing a copy.
+    """
+    ok, msg = validate_file(filename, size or 0)
     if not ok:
-        return False, "", msg
+        return False, "", "", msg
 
-    # Generate unique filename with microsecond precision and random suffix to avoid conflicts
-    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f")  # Include microseconds
-    random_suffix = random.randint(1000, 9999)  # 4-digit random number
     name_part = os.path.splitext(filename)[0][:20]  # Limit name length
     ext = os.path.splitext(filename)[1]
-    unique_name = f"{user_id}_{timestamp}_{random_suffix}_{name_part}{ext}"
-    file_path = os.path.join(UPLOAD_DIR, unique_name)
-
-    # Ensure file doesn't exist (very unlikely but check anyway)
-    counter = 1
-    while os.path.exists(file_path):
-        unique_name = f"{user_id}_{timestamp}_{random_suffix}_{counter}_{name_part}{ext}"
-        file_path = os.path.join(UPLOAD_DIR, unique_name)
-        counter += 1
+    if getattr(stream, "seekable", lambda: False)():
+        # Streamlit keeps the same upload object across reruns; start from the beginning
+        stream.seek(0)
 
-    # Save file
+    digest = hashlib.sha256()
+    written = 0
+    fd, tmp_path = tempfile.mkstemp(prefix=".upload-", dir=UPLOAD_DIR)
     try:
-        with open(file_path, "wb") as f:
-            f.write(file_bytes)
+        with os.fdopen(fd, "wb") as f:
+            head = stream.read(max(CHUNK_SIZE, SNIFF_BYTES))
+            ok, msg = validate_file_header(filename, head)
+            if not ok:
+                raise ValueError(msg)
+            chunk = head
+            while chunk:
+                written += len(chunk)
+                if written > MAX_FILE_SIZE:
+                    raise ValueError(f"文件大小超过限制（最大 {MAX_FILE_SIZE / 1024 / 1024}MB）")
+                digest.update(chunk)
+                f.write(chunk)
+                chunk = stream.read(CHUNK_SIZE)
+        content_hash = digest.hexdigest()
+        file_path = os.path.join(UPLOAD_DIR, f"{user_id}_{content_hash[:16]}_{name_part}{ext}")
+        if os.path.exists(file_path):
+            os.remove(tmp_path)
+            return True, file_path, content_hash, "文件上传成功"
+        os.replace(tmp_path, file_path)
+    except ValueError as e:
+        os.remove(tmp_path)
+        return False, "", "", str(e)
     except Exception as e:
-        return False, "", f"文件保存失败: {e}"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return False, "", "", f"文件保存失败: {e}"
 
     # Record in database
     try:
@@ -53,13 +90,13 @@ def save_upload(user_id: int, filename: str, file_bytes: bytes) -> tuple[bool, s
                 file_name=filename,
                 file_path=file_path,
                 file_type=file_type,
-                file_size=len(file_bytes),
+                file_size=written,
             )
             session.add(file_record)
             session.commit()
-        return True, file_path, "文件上传成功"
+        return True, file_path, content_hash, "文件上传成功"
     except Exception as e:
         # File saved but DB record failed - still return success
-        return True, file_path, f"文件已保存，但数据库记录失败: {e}"
+        return True, file_path, content_hash, f"文件已保存，但数据库记录失败: {e}"
 
 
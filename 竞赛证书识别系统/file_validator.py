@@ -3,9 +3,20 @@ File validation utilities.
 """
 from __future__ import annotations
 
+from typing import Optional
+
 ALLOWED_EXTENSIONS = {".pdf", ".jpg", ".jpeg", ".png"}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
+# Leading bytes of each allowed format. PDF readers accept the header anywhere
+# in the first 1024 bytes, so that many bytes are needed to sniff a file.
+SNIFF_BYTES = 1024
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SIGNATURE = b"\xff\xd8\xff"
+PDF_SIGNATURE = b"%PDF-"
+# Extensions that share a format
+FORMAT_EXTENSIONS = {".pdf": {".pdf"}, ".png": {".png"}, ".jpg": {".jpg", ".jpeg"}}
+
 
 def is_allowed_extension(filename: str) -> bool:
     """Check if file extension is allowed."""
@@ -20,6 +31,28 @@ def validate_file_size(file_size: int) -> bool:
     return file_size <= MAX_FILE_SIZE
 
 
+def sniff_file_type(head: bytes) -> Optional[str]:
+    """Identify PDF/PNG/JPEG from the first bytes of a file; returns ".pdf", ".png", ".jpg" or None."""
+    if head.startswith(PNG_SIGNATURE):
+        return ".png"
+    if head.startswith(JPEG_SIGNATURE):
+        return ".jpg"
+    if PDF_SIGNATURE in head[:SNIFF_BYTES]:
+        return ".pdf"
+    return None
+
+
+def validate_file_header(filename: str, head: bytes) -> tuple[bool, str]:
+    """Check that the content matches the extension, so mislabeled files never reach the decoders."""
+    ext = "." + filename.lower().rsplit(".", 1)[-1] if "." in filename else ""
+    detected = sniff_file_type(head)
+    if detected is None:
+        return False, "文件内容不是有效的 PDF、PNG 或 JPEG 文件"
+    if ext not in FORMAT_EXTENSIONS[detected]:
+        return False, f"文件内容为 {detected[1:].upper()} 格式，与扩展名 {ext or '（无）'} 不符"
+    return True, ""
+
+
 def validate_file(filename: str, file_size: int) -> tuple[bool, str]:
     """Validate file extension and size."""
     if not is_allowed_extension(filename):
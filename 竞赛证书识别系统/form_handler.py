@@ -5,7 +5,7 @@ from __future__ import annotations
 from datetime import datetime
 from typing import Dict, Any, List, Optional
 
-from database import get_session, Certificate, SystemConfig
+from database import get_session, Certificate, File, SystemConfig
 from sqlmodel import select
 
 
@@ -32,14 +32,16 @@ def save_draft(user_id: int, payload: Dict[str, Any], file_path: str) -> int:
         # 尝试查找已有草稿（同一提交者、同一文件）
         existing = session.exec(
             select(Certificate).where(
-                (Certificate.submitter_id == user_id) & (Certificate.file_path == file_path) & (Certificate.status == "draft")
+                (Certificate.submitter_id == user_id)
+                & (Certificate.file_path == file_path)
+                & (Certificate.status == "draft")
+                & (Certificate.page_number == None)  # noqa: E711
             )
         ).first()
         if existing:
             for k, v in payload.items():
                 if hasattr(existing, k):
                     setattr(existing, k, v)
-            existing.created_at = datetime.utcnow()
             session.add(existing)
             session.commit()
             return existing.cert_id
@@ -52,6 +54,55 @@ def save_draft(user_id: int, payload: Dict[str, Any], file_path: str) -> int:
         return cert.cert_id
 
 
+def get_file_id(file_path: str) -> Optional[int]:
+    """按保存路径查找上传文件记录"""
+    with get_session() as session:
+        record = session.exec(select(File).where(File.file_path == file_path)).first()
+        return record.file_id if record else None
+
+
+def save_page_drafts(user_id: int, submitter_role: str, file_path: str, page_results: Dict[int, Dict[str, Any]]) -> Dict[int, int]:
+    """
+    多页 PDF 按页识别后，每页保存（或更新）一条草稿，均关联同一个 File 记录。
+    更新已有草稿时保留其创建时间，重新识别不会改变草稿的顺序。
+    page_results 为 {页码(从1开始): 识别结果}，返回 {页码: cert_id}
+    """
+    file_id = get_file_id(file_path)
+    fields = set(Certificate.model_fields) - {"cert_id", "submitter_id", "submitter_role", "file_path", "file_id", "page_number", "status", "created_at", "submitted_at"}
+    cert_ids: Dict[int, int] = {}
+    with get_session() as session:
+        for page_number, result in sorted(page_results.items()):
+            values = {k: v for k, v in result.items() if k in fields}
+            values["student_id"] = values.get("student_id") or ""
+            values["student_name"] = values.get("student_name") or ""
+            cert = session.exec(
+                select(Certificate).where(
+                    (Certificate.submitter_id == user_id)
+                    & (Certificate.file_path == file_path)
+                    & (Certificate.page_number == page_number)
+                    & (Certificate.status == "draft")
+                )
+            ).first()
+            if cert:
+                for k, v in values.items():
+                    setattr(cert, k, v)
+            else:
+                cert = Certificate(
+                    submitter_id=user_id,
+                    submitter_role=submitter_role,
+                    file_path=file_path,
+                    file_id=file_id,
+                    page_number=page_number,
+                    status="draft",
+                    **values,
+                )
+            session.add(cert)
+            session.flush()
+            cert_ids[page_number] = cert.cert_id
+        session.commit()
+    return cert_ids
+
+
 def submit_certificate(cert_id: int, user_id: int) -> bool:
     """将草稿提交为正式提交，变为不可修改。返回是否提交成功"""
     if not is_before_deadline():
@@ -6,21 +6,354 @@ from __future__ import annotations
 
 import os
 import base64
+import hashlib
 import json
-from typing import Dict, Any, Optional
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 from PIL import Image
 
-from image_processor import image_to_base64, load_image, resize_image
+from api_guard import CircuitBreaker, CircuitOpenError, RateLimitTimeout, TokenBucketLimiter
+from extraction_metrics import CallMetrics
+from image_derivatives import PREVIEW, THUMBNAIL, DerivativeStore, Rendition
+from image_processor import encode_image_to_budget, image_to_base64, open_image, resize_image, resize_to_max_side
 
 
 # GLM-4V API配置
 GLM4V_API_KEY = os.environ.get("GLM4V_API_KEY", "")
-GLM4V_API_URL = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
+DEFAULT_API_URL = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
 
 # API Key从配置文件读取
 CONFIG_FILE = ".env"
+# 接口参数配置文件（不含密钥）
+API_CONFIG_FILE = "api_config.json"
+
+# 提示词版本：修改提示词后递增，使旧的缓存结果失效
+PROMPT_VERSION = "v1"
+# 提示词中的字段及其说明，按此顺序要求模型返回
+FIELD_SCHEMA: Dict[str, str] = {
+    "student_name": "学生姓名",
+    "student_id": "学号（13位数字）",
+    "department": "学生所在学院",
+    "competition_name": "竞赛项目名称",
+    "award_category": "获奖类别（国家级/省级/校级）",
+    "award_level": "获奖等级（特等奖/一等奖/二等奖/三等奖/金奖/银奖/铜奖/优秀奖）",
+    "competition_type": "竞赛类型（A类/B类）",
+    "organizer": "主办单位",
+    "award_date": "获奖时间（格式：YYYY-MM）",
+    "advisor": "指导教师姓名",
+}
+PROMPT_FIELDS = tuple(FIELD_SCHEMA)
+
+
+def load_api_config(section: Optional[str] = None) -> Dict[str, Any]:
+    """读取 api_config.json，文件缺失或格式错误时返回空字典"""
+    config: Dict[str, Any] = {}
+    if os.path.exists(API_CONFIG_FILE):
+        try:
+            with open(API_CONFIG_FILE, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        except Exception:
+            config = {}
+    if section is None:
+        return config
+    value = config.get(section, {})
+    return value if isinstance(value, dict) else {}
+
+
+_glm4v_config = load_api_config("glm4v")
+# 环境变量 GLM4V_API_URL 优先，便于临时指向本地测试服务
+GLM4V_API_URL = os.environ.get("GLM4V_API_URL") or _glm4v_config.get("api_url", DEFAULT_API_URL)
+GLM4V_MODEL = _glm4v_config.get("model", "glm-4v-plus")
+# 流式输出（SSE）：字段值一结束就可以回调给上层，字段齐全后提前断开
+GLM4V_STREAM = bool(_glm4v_config.get("stream", False))
+# 结构化输出：请求带 response_format={"type": "json_object"}；接口以 400 拒绝且错误信息提到 response_format 时
+# 记住该模型并改用普通模式，其他 400 只让当次请求去掉该参数重发
+GLM4V_JSON_MODE = bool(_glm4v_config.get("json_mode", False))
+# 回复无法解析时，修复调用（纯文本请求）使用的模型；为空时与识别模型相同
+GLM4V_REPAIR_MODEL = _glm4v_config.get("repair_model") or ""
+# 修复调用中附带的原回复最大字符数
+REPAIR_MAX_CHARS = 4000
+_json_mode_unsupported: set = set()
+# 每次调用的分阶段耗时、数据量和 token 用量写入 extraction_metrics 表
+METRICS_ENABLED = bool(load_api_config("metrics").get("enabled", True))
+
+# 图片编码：budget 模式按字节预算选择 JPEG/WebP 质量；png 模式保持原先的 PNG 编码
+_image_config = load_api_config("image")
+IMAGE_ENCODING = _image_config.get("encoding", "budget")
+IMAGE_MAX_BYTES = int(_image_config.get("max_kb", 300)) * 1024
+IMAGE_MAX_SIDE = int(_image_config.get("max_side", 1600))
+IMAGE_FORMAT = str(_image_config.get("format", "jpeg")).upper()
+IMAGE_GRAYSCALE = bool(_image_config.get("grayscale", True))
+# 批量模式：一次请求携带多张缩小后的图片，单张的尺寸和字节预算更小；
+# enabled 为 false 或 images_per_request 不大于 1 时不使用批量请求，也不生成批量尺寸的派生图
+_batch_config = load_api_config("batch")
+BATCH_ENABLED = bool(_batch_config.get("enabled", True)) and int(_batch_config.get("images_per_request", 1)) > 1
+BATCH_IMAGE_MAX_SIDE = int(_batch_config.get("image_max_side", 1024))
+BATCH_IMAGE_MAX_BYTES = int(_batch_config.get("image_max_kb", 150)) * 1024
+# 编码参数会影响识别结果，作为缓存键的一部分
+IMAGE_ENCODING_SIGNATURE = (
+    f"{IMAGE_ENCODING}-{IMAGE_FORMAT}-{IMAGE_MAX_BYTES}-{IMAGE_MAX_SIDE}-{int(IMAGE_GRAYSCALE)}"
+    if IMAGE_ENCODING == "budget"
+    else "png-1024"
+)
+
+# 派生图缓存：缩略图、预览图和送模型的压缩图在一次解码中生成，按内容哈希保存并按最近使用淘汰
+_derivatives_config = load_api_config("derivatives")
+DERIVATIVES_ENABLED = bool(_derivatives_config.get("enabled", True)) and IMAGE_ENCODING == "budget"
+API_RENDITION = Rendition("api", IMAGE_MAX_SIDE, IMAGE_FORMAT, IMAGE_MAX_BYTES, IMAGE_GRAYSCALE)
+BATCH_RENDITION = Rendition("api_batch", BATCH_IMAGE_MAX_SIDE, IMAGE_FORMAT, BATCH_IMAGE_MAX_BYTES, IMAGE_GRAYSCALE)
+derivative_store = DerivativeStore(
+    _derivatives_config.get("dir", os.path.join("data", "derivatives")),
+    int(_derivatives_config.get("max_mb", 200)) * 1024 * 1024,
+    [PREVIEW, THUMBNAIL, API_RENDITION] + ([BATCH_RENDITION] if BATCH_ENABLED else []),
+)
+
+# 可重试的HTTP状态码：限流和服务端临时错误
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class RequestCancelled(RuntimeError):
+    """流式读取过程中调用方取消了请求（例如对冲请求中另一路已先返回）"""
+
+
+class GLM4VClient:
+    """
+    GLM-4V HTTP 客户端
+    复用同一个 Session 的连接池（keep-alive），对 429/5xx 和连接失败做带抖动的指数退避重试，
+    并遵循服务端返回的 Retry-After。参数默认取自 api_config.json 的 glm4v 段。
+    每次发送（含重试）都要先从跨进程令牌桶拿到名额；上游持续失败时熔断器打开，请求直接失败。
+    """
+
+    def __init__(
+        self,
+        api_url: Optional[str] = None,
+        pool_size: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        backoff_base: Optional[float] = None,
+        backoff_max: Optional[float] = None,
+        connect_timeout: Optional[float] = None,
+        read_timeout: Optional[float] = None,
+    ):
+        cfg = load_api_config("glm4v")
+        self.api_url = api_url or GLM4V_API_URL
+        self.pool_size = int(pool_size or cfg.get("pool_size", 10))
+        self.max_retries = int(max_retries if max_retries is not None else cfg.get("max_retries", 3))
+        self.backoff_base = float(backoff_base if backoff_base is not None else cfg.get("backoff_base_seconds", 0.5))
+        self.backoff_max = float(backoff_max if backoff_max is not None else cfg.get("backoff_max_seconds", 8))
+        self.connect_timeout = float(connect_timeout or cfg.get("connect_timeout_seconds", 5))
+        self.read_timeout = float(read_timeout or cfg.get("read_timeout_seconds", cfg.get("timeout_seconds", 30)))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        limit_cfg = load_api_config("rate_limit")
+        self.limiter: Optional[TokenBucketLimiter] = None
+        if limit_cfg.get("enabled", True):
+            self.limiter = TokenBucketLimiter(
+                rate=float(limit_cfg.get("requests_per_second", 5)),
+                burst=float(limit_cfg.get("burst", 10)),
+                max_concurrent=int(limit_cfg.get("max_concurrent", 8)),
+                slot_ttl=self.connect_timeout + self.read_timeout + 5,
+            )
+        self.acquire_timeout = float(limit_cfg.get("acquire_timeout_seconds", 10))
+        breaker_cfg = load_api_config("circuit_breaker")
+        self.breaker: Optional[CircuitBreaker] = None
+        if breaker_cfg.get("enabled", True):
+            self.breaker = CircuitBreaker(
+                failure_threshold=int(breaker_cfg.get("failure_threshold", 5)),
+                cooldown_seconds=float(breaker_cfg.get("cooldown_seconds", 30)),
+                probe_timeout=self.connect_timeout + self.read_timeout,
+            )
+
+    def backoff_delay(self, attempt: int) -> float:
+        """第 attempt 次重试前的等待时间（full jitter：0 ~ base*2^attempt，且不超过上限）"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    @staticmethod
+    def parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """解析 Retry-After 头（秒数或 HTTP 日期），无法解析时返回 None"""
+        if not value:
+            return None
+        value = value.strip()
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            when = parsedate_to_datetime(value)
+            if when.tzinfo is None:
+                when = when.replace(tzinfo=timezone.utc)
+            return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+        except Exception:
+            return None
+
+    def _send(self, headers: Dict[str, str], payload: Dict[str, Any], stream: bool = False) -> requests.Response:
+        """
+        在限流名额内发送一次请求；stream=True 时只读取响应头，响应体由调用方逐块读取，
+        名额一直占用到响应 close() 为止，max_concurrent 限制的是同时在读的响应数。
+        """
+        kwargs = {
+            "headers": headers,
+            "json": payload,
+            "timeout": (self.connect_timeout, self.read_timeout),
+            "stream": stream,
+        }
+        if self.limiter is None:
+            return self.session.post(self.api_url, **kwargs)
+        if not stream:
+            with self.limiter.slot(self.acquire_timeout):
+                return self.session.post(self.api_url, **kwargs)
+        slot_id = self.limiter.acquire(self.acquire_timeout)
+        try:
+            response = self.session.post(self.api_url, **kwargs)
+        except BaseException:
+            self.limiter.release(slot_id)
+            raise
+        self._release_on_close(response, slot_id)
+        return response
+
+    def _release_on_close(self, response: requests.Response, slot_id: str) -> None:
+        """响应关闭时（读完、提前断开、重试前丢弃或出错）归还限流名额，重复 close() 只归还一次"""
+        close = response.close
+        released = threading.Event()
+
+        def close_and_release() -> None:
+            try:
+                close()
+            finally:
+                if not released.is_set():
+                    released.set()
+                    self.limiter.release(slot_id)
+
+        response.close = close_and_release
+
+    def post(self, payload: Dict[str, Any], api_key: str, stream: bool = False) -> requests.Response:
+        """
+        经熔断器检查后发送请求，返回状态码为 2xx 的响应。
+        连接失败、超时和重试耗尽后的 429/5xx 计为上游失败，其他 4xx 不影响熔断状态。
+        stream=True 时返回未读取响应体的流式响应，成功与否要等响应体读完才知道，
+        熔断器的成功记录交给 stream()；流式请求应通过 stream() 发送。
+        """
+        if self.breaker is not None:
+            self.breaker.before_call()
+        try:
+            response = self._post_with_retries(payload, api_key, stream)
+        except requests.exceptions.HTTPError as exc:
+            status = exc.response.status_code if exc.response is not None else 0
+            if self.breaker is not None:
+                if status in RETRY_STATUS_CODES:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+            raise
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if self.breaker is not None:
+                self.breaker.record_failure()
+            raise
+        if self.breaker is not None and not stream:
+            self.breaker.record_success()
+        return response
+
+    def stream(self, payload: Dict[str, Any], api_key: str, read: Callable[[requests.Response], Any]) -> Any:
+        """
+        以流式发送请求，并在占用限流名额期间用 read(response) 读取响应体，返回 read 的结果。
+        读完后才向熔断器记录结果：读取中的连接中断、读超时计为上游失败；调用方取消不计入。
+        """
+        response = self.post(payload, api_key, stream=True)
+        try:
+            result = read(response)
+        except requests.exceptions.RequestException:
+            if self.breaker is not None:
+                self.breaker.record_failure()
+            raise
+        except RequestCancelled:
+            raise
+        except Exception:
+            # 上游已正常返回，只是内容无法解析
+            if self.breaker is not None:
+                self.breaker.record_success()
+            raise
+        finally:
+            response.close()
+        if self.breaker is not None:
+            self.breaker.record_success()
+        return result
+
+    def _post_with_retries(self, payload: Dict[str, Any], api_key: str, stream: bool = False) -> requests.Response:
+        """
+        发送请求并按需重试，返回状态码为 2xx 的响应。
+        读超时不重试（用户已经等待了完整的读超时时间）；
+        Retry-After 超过退避上限时不再等待，直接抛出。
+        """
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        }
+        attempt = 0
+        while True:
+            try:
+                response = self._send(headers, payload, stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.ConnectTimeout):
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self.backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                retry_after = self.parse_retry_after(response.headers.get("Retry-After"))
+                if retry_after is not None and retry_after > self.backoff_max:
+                    self._raise_for_status(response)
+                delay = retry_after if retry_after is not None else self.backoff_delay(attempt)
+                response.close()
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            self._raise_for_status(response)
+            return response
+
+    @staticmethod
+    def _raise_for_status(response: requests.Response) -> None:
+        """
+        错误响应先读完响应体再关闭，然后抛出 HTTPError：连接及时归还连接池（流式响应同时释放限流名额），
+        调用方仍可从 exc.response.text 读取错误信息。
+        """
+        if response.ok:
+            return
+        try:
+            response.content
+        except requests.exceptions.RequestException:
+            pass
+        finally:
+            response.close()
+        response.raise_for_status()
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_default_client: Optional[GLM4VClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> GLM4VClient:
+    """获取进程内共享的客户端（首次调用时创建）"""
+    global _default_client
+    if _default_client is None:
+        with _client_lock:
+            if _default_client is None:
+                _default_client = GLM4VClient()
+    return _default_client
 
 
 def load_api_key() -> str:
@@ -49,23 +382,441 @@ def prepare_image_for_api(image_path: str, max_size: int = 1024) -> str:
     Returns:
         Base64编码的图片字符串
     """
-    img = load_image(image_path)
+    img = open_image(image_path, max_width=max_size)
     # 压缩图片以降低API调用成本
     img = resize_image(img, max_width=max_size)
     return image_to_base64(img)
 
 
-def extract_with_glm4v(image_path: str, api_key: Optional[str] = None) -> Dict[str, Any]:
+def prepare_image_payload(
+    image_path: str,
+    metrics: Optional[CallMetrics] = None,
+    max_side: Optional[int] = None,
+    max_bytes: Optional[int] = None,
+) -> tuple[str, str]:
+    """
+    按 api_config.json 的 image 段准备图片，返回 (Base64 字符串, MIME 类型)。
+    budget 模式限制最长边并在字节预算内选择压缩质量，近似灰度的证书转为灰度图；
+    max_side / max_bytes 可覆盖配置（批量模式使用更小的图片）。
+    尺寸与已注册的 API_RENDITION / BATCH_RENDITION 相同时从派生图缓存读取（未命中时与预览图等一起生成），
+    此时 encode 阶段为读取或生成派生图的耗时。
+    未命中派生图时按目标尺寸解码（JPEG 草稿模式，见 image_processor.open_image）并按 EXIF 方向摆正。
+    传入 metrics 时分别记录解码、缩放、编码和 Base64 各阶段的耗时与数据量。
+    """
+    max_side = max_side or IMAGE_MAX_SIDE
+    max_bytes = max_bytes or IMAGE_MAX_BYTES
+    metrics = metrics or CallMetrics(enabled=False)
+    if IMAGE_ENCODING != "budget":
+        with metrics.span("encode") as span:
+            image_base64 = prepare_image_for_api(image_path)
+            span["bytes"] = len(image_base64)
+        return image_base64, "image/png"
+    rendition = next(
+        (
+            r for r in (API_RENDITION, BATCH_RENDITION)
+            if r.name in derivative_store.renditions and (r.max_size, r.max_bytes) == (max_side, max_bytes)
+        ),
+        None,
+    )
+    if DERIVATIVES_ENABLED and rendition is not None:
+        with metrics.span("encode") as span:
+            data, mime = derivative_store.get(image_path, rendition.name)
+            span["bytes"] = len(data)
+        with metrics.span("base64") as span:
+            image_base64 = base64.b64encode(data).decode("utf-8")
+            span["bytes"] = len(image_base64)
+        return image_base64, mime
+    with metrics.span("decode") as span:
+        img = open_image(image_path, max_side=max_side)
+        span["bytes"] = os.path.getsize(image_path)
+    with metrics.span("resize"):
+        img = resize_to_max_side(img, max_side)
+    with metrics.span("encode") as span:
+        data, mime = encode_image_to_budget(
+            img,
+            max_bytes=max_bytes,
+            max_side=max_side,
+            fmt=IMAGE_FORMAT,
+            allow_grayscale=IMAGE_GRAYSCALE,
+        )
+        span["bytes"] = len(data)
+    with metrics.span("base64") as span:
+        image_base64 = base64.b64encode(data).decode("utf-8")
+        span["bytes"] = len(image_base64)
+    return image_base64, mime
+
+
+class StreamingJSONFieldParser:
+    """
+    增量解析模型输出中的第一个 JSON 对象：每喂入一段文本，返回其中刚结束的顶层字段 [(字段, 值)]。
+    对象之前的 ```json 等文字被忽略；对象闭合后 complete 为 True，之后的内容（如补充说明）不再解析。
+    解析是容错的：单引号字符串、全角冒号、末尾多余的逗号和未加引号的值都可以识别，
+    输出被截断时已结束的字段仍然保留在 fields 中。
+    """
+
+    def __init__(self):
+        self.fields: Dict[str, Any] = {}
+        self.complete = False
+        self._state = "start"
+        self._buf: List[str] = []
+        self._key = ""
+        self._escape = False
+        self._in_string = False
+        self._depth = 0
+        self._quote = '"'
+
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        emitted: List[Tuple[str, Any]] = []
+        for ch in text:
+            if self.complete:
+                break
+            self._step(ch, emitted)
+        return emitted
+
+    def _emit(self, raw: str, emitted: List[Tuple[str, Any]]) -> None:
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            value = raw.strip()
+        self.fields[self._key] = value
+        emitted.append((self._key, value))
+        self._buf = []
+
+    @staticmethod
+    def _decode_string(body: str) -> str:
+        """按 JSON 规则处理转义；单引号字符串中未转义的双引号也能正确解码"""
+        try:
+            return json.loads('"' + body.replace("\\'", "'").replace('\\"', '"').replace('"', '\\"') + '"')
+        except json.JSONDecodeError:
+            return body
+
+    def _step(self, ch: str, emitted: List[Tuple[str, Any]]) -> None:
+        state = self._state
+        if state == "start":
+            if ch == "{":
+                self._state = "key_start"
+        elif state in ("key_start", "after_value"):
+            if ch in "\"'" and state == "key_start":
+                self._buf = []
+                self._quote = ch
+                self._state = "key"
+            elif ch == ",":
+                self._state = "key_start"
+            elif ch == "}":
+                self.complete = True
+        elif state == "key":
+            if self._escape:
+                self._escape = False
+                self._buf.append(ch)
+            elif ch == "\\":
+                self._escape = True
+                self._buf.append(ch)
+            elif ch == self._quote:
+                self._key = self._decode_string("".join(self._buf))
+                self._state = "colon"
+            else:
+                self._buf.append(ch)
+        elif state == "colon":
+            if ch in ":：":
+                self._state = "value_start"
+        elif state == "value_start":
+            if ch.isspace():
+                return
+            if ch in "\"'":
+                self._buf = []
+                self._quote = ch
+                self._state = "string"
+                return
+            self._buf = [ch]
+            if ch in "[{":
+                self._depth = 1
+                self._in_string = False
+                self._state = "nested"
+            else:
+                self._state = "scalar"
+        elif state == "string":
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == self._quote:
+                self.fields[self._key] = value = self._decode_string("".join(self._buf))
+                emitted.append((self._key, value))
+                self._buf = []
+                self._state = "after_value"
+                return
+            self._buf.append(ch)
+        elif state == "nested":
+            self._buf.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "[{":
+                self._depth += 1
+            elif ch in "]}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._emit("".join(self._buf), emitted)
+                    self._state = "after_value"
+        elif state == "scalar":
+            if ch in ",}" or ch.isspace():
+                # 数字、true/false/null 没有结束符，遇到分隔符时结束并交给 after_value 处理
+                self._emit("".join(self._buf), emitted)
+                self._state = "after_value"
+                self._step(ch, emitted)
+            else:
+                self._buf.append(ch)
+
+
+def iter_sse_content(response: requests.Response, usage: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+    """逐条读取流式响应（SSE），产出每个分片中 delta.content 的文本；分片带 usage 时写入 usage"""
+    for line in response.iter_lines():
+        if not line or not line.startswith(b"data:"):
+            continue
+        data = line[5:].strip()
+        if data == b"[DONE]":
+            return
+        chunk = json.loads(data.decode("utf-8"))
+        if usage is not None and chunk.get("usage"):
+            usage.update(chunk["usage"])
+        for choice in chunk.get("choices", []):
+            text = (choice.get("delta") or {}).get("content")
+            if text:
+                yield text
+
+
+def _parse_content(content: str) -> Optional[Dict[str, Any]]:
+    """
+    从模型回复文本中取出 JSON 字段：先按标准 JSON 解析，失败时用 StreamingJSONFieldParser 容错解析。
+    一个 FIELD_SCHEMA 字段都取不到时返回 None，由调用方发起修复调用。
+    """
+    text = content
+    # 如果返回的是代码块格式，提取JSON部分
+    if "```json" in text:
+        json_start = text.find("```json") + 7
+        json_end = text.find("```", json_start)
+        text = text[json_start:json_end if json_end != -1 else None].strip()
+    elif "```" in text:
+        json_start = text.find("```") + 3
+        json_end = text.find("```", json_start)
+        text = text[json_start:json_end if json_end != -1 else None].strip()
+
+    try:
+        extracted = json.loads(text)
+    except json.JSONDecodeError:
+        extracted = None
+    if not isinstance(extracted, dict):
+        parser = StreamingJSONFieldParser()
+        parser.feed(content)
+        extracted = dict(parser.fields)
+    if not any(key in FIELD_SCHEMA for key in extracted):
+        return None
+
+    # 添加元数据
+    extracted["extraction_method"] = "glm4v"
+    extracted["extraction_confidence"] = 0.85  # GLM-4V的置信度
+    return extracted
+
+
+def build_repair_prompt(content: str, fields: Optional[Iterable[str]] = None) -> str:
+    """修复调用的提示词：给出字段结构和无法解析的原回复，要求整理为 JSON 对象"""
+    fields = [f for f in (fields or PROMPT_FIELDS) if f in FIELD_SCHEMA]
+    return "\n".join(
+        [
+            "下面是一段竞赛证书识别结果，但格式不是合法的JSON。请把其中的信息整理为以下结构的JSON对象：",
+            json.dumps({f: FIELD_SCHEMA[f] for f in fields}, ensure_ascii=False, indent=4),
+            "",
+            "原文中没有的字段返回空字符串，不要编造。只返回JSON对象，不要其他文字说明。",
+            "",
+            "识别结果原文：",
+            content[:REPAIR_MAX_CHARS],
+        ]
+    )
+
+
+def is_transient_error(exc: BaseException) -> bool:
+    """
+    上游的临时故障（限流、熔断、连接失败、超时、429/5xx）：稍后重试可能成功，与图片或提示词本身的问题区分。
+    extract_with_glm4v 包装后的异常按其原因（__cause__）判断。
+    """
+    if exc.__cause__ is not None and is_transient_error(exc.__cause__):
+        return True
+    if isinstance(exc, (RateLimitTimeout, CircuitOpenError, requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        return exc.response.status_code in RETRY_STATUS_CODES
+    return False
+
+
+def _rejects_response_format(response: requests.Response) -> bool:
+    """400 错误响应的内容是否指向 response_format 参数"""
+    try:
+        return "response_format" in response.text
+    except Exception:
+        return False
+
+
+def _post_structured(
+    payload: Dict[str, Any],
+    api_key: str,
+    read: Optional[Callable[[requests.Response], Any]] = None,
+) -> Any:
+    """
+    按 glm4v.json_mode 请求 JSON 输出模式后发送；接口以 400 拒绝时去掉参数重发一次。
+    只有错误信息提到 response_format 时才记住该模型不支持 JSON 模式——图片过大、内容审核等原因
+    同样返回 400，不能因为一次这样的请求关闭之后所有请求的 JSON 模式。
+    read 为 None 时返回响应；否则以流式发送并返回 read(response) 的结果（见 GLM4VClient.stream）。
+    """
+
+    def send(body: Dict[str, Any]) -> Any:
+        client = get_client()
+        return client.post(body, api_key) if read is None else client.stream(body, api_key, read)
+
+    model = payload.get("model", "")
+    if not GLM4V_JSON_MODE or model in _json_mode_unsupported:
+        return send(payload)
+    try:
+        return send({**payload, "response_format": {"type": "json_object"}})
+    except requests.exceptions.HTTPError as exc:
+        if exc.response is None or exc.response.status_code != 400:
+            raise
+        if _rejects_response_format(exc.response):
+            _json_mode_unsupported.add(model)
+        return send(payload)
+
+
+def _repair_content(
+    content: str,
+    api_key: str,
+    model: str,
+    fields: Optional[Iterable[str]],
+    metrics: CallMetrics,
+) -> Dict[str, Any]:
+    """
+    回复无法解析时的一次定向修复调用：把原回复和字段结构发给模型（纯文本请求，不再上传图片）。
+    修复调用失败或结果仍无法解析时退回 parse_text_response。
+    """
+    payload = {
+        "model": GLM4V_REPAIR_MODEL or model,
+        "messages": [{"role": "user", "content": [{"type": "text", "text": build_repair_prompt(content, fields)}]}],
+        "temperature": 0.1,
+    }
+    try:
+        with metrics.span("repair") as span:
+            response = _post_structured(payload, api_key)
+            span["bytes"] = len(response.content)
+            result = response.json()
+        repaired = _parse_content(result["choices"][0]["message"]["content"])
+    except Exception:
+        repaired = None
+    if repaired is None:
+        return parse_text_response(content)
+    usage = result.get("usage") or {}
+    metrics.set_usage({k: metrics.usage.get(k, 0) + int(v) for k, v in usage.items() if isinstance(v, int)})
+    repaired["extraction_confidence"] = 0.75
+    return repaired
+
+
+def _read_stream(
+    response: requests.Response,
+    on_field: Optional[Callable[[str, Any], None]] = None,
+    stop_fields: Optional[Iterable[str]] = None,
+    usage: Optional[Dict[str, Any]] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Tuple[Optional[Dict[str, Any]], str]:
+    """
+    读取流式响应：每个字段的值一结束就回调 on_field(字段, 值)。
+    JSON 对象闭合，或 stop_fields 全部到齐时立即断开连接，不再等待模型后续输出。
+    cancel 被设置时断开连接并抛出 RequestCancelled。
+    返回 (解析结果, 已收到的文本)；解析结果为 None 时调用方可用原文发起修复调用。
+    """
+    parser = StreamingJSONFieldParser()
+    wanted = set(stop_fields) if stop_fields is not None else None
+    content = ""
+    try:
+        for text in iter_sse_content(response, usage):
+            if cancel is not None and cancel.is_set():
+                raise RequestCancelled("请求已取消")
+            content += text
+            for key, value in parser.feed(text):
+                if on_field is not None:
+                    on_field(key, value)
+            if parser.complete or (wanted is not None and wanted.issubset(parser.fields)):
+                break
+    finally:
+        response.close()
+
+    if not any(key in FIELD_SCHEMA for key in parser.fields):
+        return _parse_content(content), content
+    extracted = dict(parser.fields)
+    extracted["extraction_method"] = "glm4v"
+    extracted["extraction_confidence"] = 0.85
+    return extracted, content
+
+
+def build_prompt(fields: Optional[Iterable[str]] = None, known: Optional[Dict[str, Any]] = None) -> str:
+    """
+    按 FIELD_SCHEMA 生成提示词，只要求模型返回 fields 中的字段（默认全部）。
+    known 中的已知值（如上传者本人的学号、姓名）不再要求提取，而是请模型与证书核对，
+    不一致的字段名放在 mismatch 列表中返回。
+    """
+    known = {k: str(v).strip() for k, v in (known or {}).items() if k in FIELD_SCHEMA and str(v or "").strip()}
+    fields = [f for f in (fields or PROMPT_FIELDS) if f in FIELD_SCHEMA and f not in known]
+    schema = {f: FIELD_SCHEMA[f] for f in fields}
+    if known:
+        schema["mismatch"] = "与已知信息不一致的字段名列表（全部一致时为空列表）"
+
+    lines = ["请从这张竞赛证书图片中提取以下信息，并以JSON格式返回：", json.dumps(schema, ensure_ascii=False, indent=4)]
+    if known:
+        lines.append("")
+        lines.append("以下信息已知，无需提取，请与证书上的内容核对：")
+        lines.extend(f"- {k}（{FIELD_SCHEMA[k]}）：{v}" for k, v in known.items())
+    lines.append("")
+    lines.append("如果某个字段无法识别，请返回空字符串。只返回JSON，不要其他文字说明。")
+    return "\n".join(lines)
+
+
+def prompt_signature(fields: Optional[Iterable[str]] = None, known: Optional[Dict[str, Any]] = None) -> str:
+    """提示词内容的短哈希，用作缓存键的一部分"""
+    return hashlib.sha256(build_prompt(fields, known).encode("utf-8")).hexdigest()[:12]
+
+
+def extract_with_glm4v(
+    image_path: str,
+    api_key: Optional[str] = None,
+    on_field: Optional[Callable[[str, Any], None]] = None,
+    stream: Optional[bool] = None,
+    stop_fields: Optional[Iterable[str]] = None,
+    model: Optional[str] = None,
+    fields: Optional[Iterable[str]] = None,
+    known: Optional[Dict[str, Any]] = None,
+    cancel: Optional[threading.Event] = None,
+) -> Dict[str, Any]:
     """
     使用GLM-4V API提取证书信息
     
     Args:
         image_path: 证书图片路径
         api_key: API密钥（可选，默认从环境变量读取）
+        on_field: 流式模式下每识别出一个字段就回调 on_field(字段, 值)
+        stream: 是否使用流式输出，默认取 api_config.json 中 glm4v.stream
+        stop_fields: 流式模式下这些字段全部到齐即断开连接（默认等待 JSON 对象闭合）
+        model: 使用的模型，默认取 api_config.json 中 glm4v.model
+        fields: 需要模型提取的字段，默认 FIELD_SCHEMA 中的全部字段
+        known: 已知的字段值，不再要求提取，只请模型核对（结果中 mismatch 为不一致的字段）
+        cancel: 流式模式下该事件被设置时立即断开连接并抛出 RequestCancelled
     
     Returns:
         提取的字段字典
     """
+    stream = GLM4V_STREAM if stream is None else stream
+    model = model or GLM4V_MODEL
     api_key = api_key or load_api_key()
     if not api_key:
         raise ValueError(
@@ -73,33 +824,15 @@ def extract_with_glm4v(image_path: str, api_key: Optional[str] = None) -> Dict[s
         )
     
     # 准备图片
-    image_base64 = prepare_image_for_api(image_path)
+    metrics = CallMetrics(model, enabled=METRICS_ENABLED)
+    image_base64, image_mime = prepare_image_payload(image_path, metrics)
     
     # 构造提示词
-    prompt = """请从这张竞赛证书图片中提取以下信息，并以JSON格式返回：
-{
-    "student_name": "学生姓名",
-    "student_id": "学号（13位数字）",
-    "department": "学生所在学院",
-    "competition_name": "竞赛项目名称",
-    "award_category": "获奖类别（国家级/省级/校级）",
-    "award_level": "获奖等级（特等奖/一等奖/二等奖/三等奖/金奖/银奖/铜奖/优秀奖）",
-    "competition_type": "竞赛类型（A类/B类）",
-    "organizer": "主办单位",
-    "award_date": "获奖时间（格式：YYYY-MM）",
-    "advisor": "指导教师姓名"
-}
-
-如果某个字段无法识别，请返回空字符串。只返回JSON，不要其他文字说明。"""
+    prompt = build_prompt(fields, known)
     
     # 构造请求
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
-    
     payload = {
-        "model": "glm-4v-plus",  # 或 "glm-4v" 根据你的API版本
+        "model": model,  # 在 api_config.json 中配置，如 "glm-4v"
         "messages": [
             {
                 "role": "user",
@@ -111,7 +844,7 @@ def extract_with_glm4v(image_path: str, api_key: Optional[str] = None) -> Dict[s
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/png;base64,{image_base64}",
+                            "url": f"data:{image_mime};base64,{image_base64}",
                         },
                     },
                 ],
@@ -119,50 +852,193 @@ def extract_with_glm4v(image_path: str, api_key: Optional[str] = None) -> Dict[s
         ],
         "temperature": 0.1,  # 降低随机性，提高准确性
     }
+    if stream:
+        payload["stream"] = True
     
+    status = "error"
     try:
-        response = requests.post(GLM4V_API_URL, headers=headers, json=payload, timeout=30)
-        response.raise_for_status()
-        result = response.json()
-        
-        # 解析响应
-        if "choices" in result and len(result["choices"]) > 0:
-            content = result["choices"][0]["message"]["content"]
-            
-            # 尝试提取JSON
-            try:
-                # 如果返回的是代码块格式，提取JSON部分
-                if "```json" in content:
-                    json_start = content.find("```json") + 7
-                    json_end = content.find("```", json_start)
-                    content = content[json_start:json_end].strip()
-                elif "```" in content:
-                    json_start = content.find("```") + 3
-                    json_end = content.find("```", json_start)
-                    content = content[json_start:json_end].strip()
-                
-                extracted = json.loads(content)
-                
-                # 添加元数据
-                extracted["extraction_method"] = "glm4v"
-                extracted["extraction_confidence"] = 0.85  # GLM-4V的置信度
-                
-                return extracted
-            except json.JSONDecodeError:
-                # 如果JSON解析失败，尝试从文本中提取
-                return parse_text_response(content)
+        if stream:
+            usage: Dict[str, Any] = {}
+            sent = time.perf_counter()
+
+            def read(response: requests.Response) -> Tuple[Optional[Dict[str, Any]], str]:
+                # network 阶段到收到响应头为止，之后是 stream 阶段
+                metrics.add_span("network", (time.perf_counter() - sent) * 1000)
+                with metrics.span("stream"):
+                    return _read_stream(response, on_field, stop_fields, usage, cancel)
+
+            extracted, content = _post_structured(payload, api_key, read=read)
+            metrics.set_usage(usage)
         else:
-            raise ValueError(f"API响应格式异常: {result}")
+            with metrics.span("network") as span:
+                response = _post_structured(payload, api_key)
+                span["bytes"] = len(response.content)
+            with metrics.span("parse"):
+                result = response.json()
+
+                # 解析响应
+                if "choices" in result and len(result["choices"]) > 0:
+                    content = result["choices"][0]["message"]["content"]
+                    extracted = _parse_content(content)
+                else:
+                    raise ValueError(f"API响应格式异常: {result}")
+            metrics.set_usage(result.get("usage"))
+        if extracted is None:
+            # 回复中取不到任何字段：一次纯文本修复调用，代替只能识别获奖等级的关键词匹配
+            extracted = _repair_content(content, api_key, model, fields, metrics)
+        status = "ok"
+        return extracted
             
+    except RequestCancelled:
+        status = "cancelled"
+        raise
+    except (CircuitOpenError, RateLimitTimeout):
+        # 熔断或排队超时：原样抛出，由上层提示手动填写
+        raise
+    except requests.exceptions.RequestException as e:
+        raise RuntimeError(f"GLM-4V API调用失败: {e}") from e
+    except Exception as e:
+        raise RuntimeError(f"解析API响应失败: {e}") from e
+    finally:
+        metrics.finish(status)
+
+
+def build_batch_prompt(count: int, fields: Optional[Iterable[str]] = None) -> str:
+    """批量模式的提示词：按图片顺序返回 JSON 数组，每个元素用 index 标明对应的图片"""
+    fields = [f for f in (fields or PROMPT_FIELDS) if f in FIELD_SCHEMA]
+    schema = {"index": f"图片编号（0 到 {count - 1}）"}
+    schema.update({f: FIELD_SCHEMA[f] for f in fields})
+    return "\n".join(
+        [
+            f"下面按顺序给出 {count} 张竞赛证书图片，编号依次为 0 到 {count - 1}。",
+            "请分别从每张图片中提取以下信息，以JSON数组返回，每张图片对应数组中的一个对象：",
+            json.dumps(schema, ensure_ascii=False, indent=4),
+            "",
+            "如果某个字段无法识别，请返回空字符串。只返回JSON数组，不要其他文字说明。",
+        ]
+    )
+
+
+def _parse_batch_items(content: str) -> List[Any]:
+    """
+    取出批量回复中的 JSON 数组：先从第一个 [ 起按标准 JSON 解析（忽略数组之后的说明文字），
+    失败时逐个对象用 StreamingJSONFieldParser 容错解析，截断的最后一个对象保留已结束的字段。
+    """
+    if "```" in content:
+        start = content.find("```")
+        start = content.find("\n", start) + 1 if content.startswith("```json", start) else start + 3
+        end = content.find("```", start)
+        content = content[start:end if end != -1 else None]
+    start = content.find("[")
+    if start == -1:
+        return []
+    try:
+        items, _ = json.JSONDecoder().raw_decode(content[start:])
+        if isinstance(items, list):
+            return items
+    except ValueError:
+        pass
+    items = []
+    parser: Optional[StreamingJSONFieldParser] = None
+    for ch in content[start + 1:]:
+        if parser is None:
+            if ch == "]":
+                break
+            if ch == "{":
+                parser = StreamingJSONFieldParser()
+                parser.feed(ch)
+            continue
+        parser.feed(ch)
+        if parser.complete:
+            items.append(dict(parser.fields))
+            parser = None
+    if parser is not None and parser.fields:
+        items.append(dict(parser.fields))
+    return items
+
+
+def _parse_batch_content(content: str, count: int) -> List[Optional[Dict[str, Any]]]:
+    """
+    把批量回复解析为与图片一一对应的列表；缺失、编号越界、格式不对或被多项同时认领的图片为 None，
+    由调用方改为单张识别。没有 index 的项按数组位置对应。
+    """
+    claims: Dict[int, List[Dict[str, Any]]] = {}
+    for position, item in enumerate(_parse_batch_items(content)):
+        if not isinstance(item, dict):
+            continue
+        try:
+            index = int(item.pop("index", position))
+        except (TypeError, ValueError):
+            continue
+        if 0 <= index < count:
+            claims.setdefault(index, []).append(item)
+
+    results: List[Optional[Dict[str, Any]]] = [None] * count
+    for index, items in claims.items():
+        if len(items) == 1 and any(key in FIELD_SCHEMA for key in items[0]):
+            items[0]["extraction_method"] = "glm4v_batch"
+            items[0]["extraction_confidence"] = 0.8
+            results[index] = items[0]
+    return results
+
+
+def extract_batch_with_glm4v(
+    image_paths: List[str],
+    api_key: Optional[str] = None,
+    model: Optional[str] = None,
+    fields: Optional[Iterable[str]] = None,
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    在一次请求中识别多张证书：图片缩小到 batch.image_max_side / image_max_kb 后放入同一条消息，
+    要求模型返回按 index 对应的 JSON 数组。
+    返回与 image_paths 等长的列表，模型没有覆盖到的图片为 None，由调用方改为单张识别。
+    """
+    api_key = api_key or load_api_key()
+    if not api_key:
+        raise ValueError(
+            "未设置GLM-4V API Key。请设置环境变量 GLM4V_API_KEY 或在 .env 文件中配置。"
+        )
+    model = model or GLM4V_MODEL
+    metrics = CallMetrics(model, enabled=METRICS_ENABLED)
+    content: List[Dict[str, Any]] = [{"type": "text", "text": build_batch_prompt(len(image_paths), fields)}]
+    for image_path in image_paths:
+        image_base64, image_mime = prepare_image_payload(
+            image_path, metrics, max_side=BATCH_IMAGE_MAX_SIDE, max_bytes=BATCH_IMAGE_MAX_BYTES
+        )
+        content.append({"type": "image_url", "image_url": {"url": f"data:{image_mime};base64,{image_base64}"}})
+    payload = {
+        "model": model,
+        "messages": [{"role": "user", "content": content}],
+        "temperature": 0.1,
+    }
+
+    status = "error"
+    try:
+        with metrics.span("network") as span:
+            response = get_client().post(payload, api_key)
+            span["bytes"] = len(response.content)
+        with metrics.span("parse"):
+            result = response.json()
+            if not result.get("choices"):
+                raise ValueError(f"API响应格式异常: {result}")
+            items = _parse_batch_content(result["choices"][0]["message"]["content"], len(image_paths))
+        metrics.set_usage(result.get("usage"))
+        status = "ok"
+        return items
+    except (CircuitOpenError, RateLimitTimeout):
+        raise
     except requests.exceptions.RequestException as e:
-        raise RuntimeError(f"GLM-4V API调用失败: {e}")
+        raise RuntimeError(f"GLM-4V API调用失败: {e}") from e
     except Exception as e:
-        raise RuntimeError(f"解析API响应失败: {e}")
+        raise RuntimeError(f"解析API响应失败: {e}") from e
+    finally:
+        metrics.finish(status)
 
 
 def parse_text_response(text: str) -> Dict[str, Any]:
     """
     从文本响应中解析字段（备用方案）
+    结果带 _fallback_parse 标记：只有关键词匹配得到的字段，不写入识别结果缓存
     """
     result = {
         "student_name": "",
@@ -177,6 +1053,7 @@ def parse_text_response(text: str) -> Dict[str, Any]:
         "advisor": "",
         "extraction_method": "glm4v",
         "extraction_confidence": 0.7,
+        "_fallback_parse": True,
     }
     
     # 简单的关键词匹配（作为备用）
@@ -192,12 +1069,17 @@ def parse_text_response(text: str) -> Dict[str, Any]:
 
 
 def test_api_connection(api_key: Optional[str] = None) -> bool:
-    """测试API连接"""
+    """测试API连接：发送一条极短的纯文本请求，收到 2xx 响应即视为连通"""
     try:
         api_key = api_key or load_api_key()
         if not api_key:
             return False
-        # 可以发送一个简单的测试请求
+        payload = {
+            "model": GLM4V_MODEL,
+            "messages": [{"role": "user", "content": [{"type": "text", "text": "ping"}]}],
+            "max_tokens": 1,
+        }
+        get_client().post(payload, api_key)
         return True
     except Exception:
         return False
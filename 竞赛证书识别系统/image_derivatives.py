@@ -0,0 +1,221 @@
+"""
+派生图缓存：同一张证书图片的缩略图、页面预览图和送模型的压缩图在一次解码中全部生成，
+按图片内容的 SHA-256 存放在磁盘上（data/derivatives/<哈希>/），总大小超过上限时按最近使用时间淘汰。
+页面重跑、草稿页预览和识别请求都从这里读取，不再重复解码和编码原图。
+"""
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from PIL import Image
+
+from image_processor import MIME_TYPES, encode_image_to_budget, open_image, resize_image
+
+META_FILE = "meta.json"
+HASH_CHUNK_SIZE = 1024 * 1024
+# 内存中记住内容哈希的文件数，超出时淘汰最久未用的
+HASH_CACHE_ENTRIES = 1024
+EXTENSIONS = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp"}
+# 生成方式变化（如解码时按 EXIF 方向摆正）时递增，旧的派生图随签名失效重新生成
+GENERATION = 2
+
+
+@dataclass(frozen=True)
+class Rendition:
+    """
+    一种派生图。max_bytes 为 None 时按最大宽度 max_size 缩放（与 resize_image 相同）并无损保存；
+    否则限制最长边为 max_size，在字节预算内选择压缩质量（见 encode_image_to_budget）。
+    """
+
+    name: str
+    max_size: int
+    fmt: str = "PNG"
+    max_bytes: Optional[int] = None
+    allow_grayscale: bool = False
+
+    def signature(self) -> str:
+        return f"{self.name}-{self.max_size}-{self.fmt}-{self.max_bytes}-{int(self.allow_grayscale)}"
+
+    def render(self, img: Image.Image) -> Tuple[bytes, str]:
+        if self.max_bytes is not None:
+            return encode_image_to_budget(
+                img, max_bytes=self.max_bytes, max_side=self.max_size, fmt=self.fmt, allow_grayscale=self.allow_grayscale
+            )
+        buffer = io.BytesIO()
+        resize_image(img, self.max_size).save(buffer, format=self.fmt)
+        return buffer.getvalue(), MIME_TYPES.get(self.fmt.upper(), "application/octet-stream")
+
+
+# 页面使用的派生图；送模型的尺寸取决于 api_config.json，由 glm4v_api 注册
+PREVIEW = Rendition("preview", 500)
+THUMBNAIL = Rendition("thumb", 160)
+
+
+class DerivativeStore:
+    """
+    派生图的磁盘缓存。每张源图一个目录，meta.json 记录原图尺寸和各派生图的文件名、MIME 与大小；
+    渲染参数变化（签名不一致）时整组重新生成。读取时更新 meta.json 的修改时间作为最近使用时间。
+    """
+
+    def __init__(self, root: str, max_bytes: int, renditions: Iterable[Rendition] = (PREVIEW, THUMBNAIL)):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.renditions: Dict[str, Rendition] = {}
+        self._hashes: "OrderedDict[str, Tuple[float, int, str]]" = OrderedDict()
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        for rendition in renditions:
+            self.register(rendition)
+
+    def register(self, rendition: Rendition) -> None:
+        self.renditions[rendition.name] = rendition
+
+    @property
+    def signature(self) -> str:
+        return "|".join([f"v{GENERATION}"] + [r.signature() for _, r in sorted(self.renditions.items())])
+
+    def content_hash(self, image_path: str) -> str:
+        """图片内容的 SHA-256；文件大小和修改时间未变时复用上次的结果，页面重跑不必重新读取整个文件"""
+        stat = os.stat(image_path)
+        with self._lock:
+            cached = self._hashes.get(image_path)
+            if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+                self._hashes.move_to_end(image_path)
+                return cached[2]
+        digest = hashlib.sha256()
+        with open(image_path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(chunk)
+        with self._lock:
+            self._hashes[image_path] = (stat.st_mtime, stat.st_size, digest.hexdigest())
+            self._hashes.move_to_end(image_path)
+            while len(self._hashes) > HASH_CACHE_ENTRIES:
+                self._hashes.popitem(last=False)
+        return digest.hexdigest()
+
+    def ensure(self, image_path: str) -> Dict[str, Any]:
+        """返回图片的派生图信息（meta.json 内容，另加 dir），缺失或过期时一次解码生成全部派生图"""
+        content_hash = self.content_hash(image_path)
+        directory = os.path.join(self.root, content_hash)
+        meta = self._read_meta(directory)
+        if meta is not None:
+            return meta
+        with self._lock:
+            lock = self._locks.setdefault(content_hash, threading.Lock())
+        with lock:
+            meta = self._read_meta(directory)
+            if meta is None:
+                meta = self._generate(image_path, directory)
+                self._evict(keep=content_hash)
+        with self._lock:
+            self._locks.pop(content_hash, None)
+        return meta
+
+    def get(self, image_path: str, name: str) -> Tuple[bytes, str]:
+        """读取一种派生图，返回 (文件内容, MIME 类型)"""
+        meta = self.ensure(image_path)
+        entry = meta["renditions"][name]
+        with open(os.path.join(meta["dir"], entry["file"]), "rb") as f:
+            return f.read(), entry["mime"]
+
+    def path(self, image_path: str, name: str) -> str:
+        """一种派生图的文件路径，可直接交给 st.image"""
+        meta = self.ensure(image_path)
+        return os.path.join(meta["dir"], meta["renditions"][name]["file"])
+
+    def _read_meta(self, directory: str) -> Optional[Dict[str, Any]]:
+        meta_path = os.path.join(directory, META_FILE)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("signature") != self.signature:
+            return None
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+        meta["dir"] = directory
+        return meta
+
+    def _generate(self, image_path: str, directory: str) -> Dict[str, Any]:
+        """
+        解码一次原图，写入全部派生图；先写到临时目录再整体改名，读者不会看到写了一半的目录。
+        JPEG 按最大的派生图所需的尺寸解码（草稿模式），不在内存中展开整张原图；meta 记录摆正后的原图尺寸。
+        """
+        budgeted = [r.max_size for r in self.renditions.values() if r.max_bytes is not None]
+        widths = [r.max_size for r in self.renditions.values() if r.max_bytes is None]
+        img = open_image(image_path, max_side=max(budgeted, default=None), max_width=max(widths, default=None))
+        width, height = img.info.get("original_size", img.size)
+        os.makedirs(self.root, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=self.root)
+        meta: Dict[str, Any] = {"signature": self.signature, "width": width, "height": height, "renditions": {}}
+        try:
+            for name, rendition in self.renditions.items():
+                data, mime = rendition.render(img)
+                ext = next((e for fmt, e in EXTENSIONS.items() if MIME_TYPES.get(fmt) == mime), ".bin")
+                file_name = f"{name}{ext}"
+                with open(os.path.join(tmp_dir, file_name), "wb") as f:
+                    f.write(data)
+                meta["renditions"][name] = {"file": file_name, "mime": mime, "bytes": len(data)}
+            with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            if os.path.isdir(directory):
+                shutil.rmtree(directory, ignore_errors=True)
+            os.replace(tmp_dir, directory)
+        except OSError:
+            # 其他进程抢先生成了同一目录：使用它们的结果
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            existing = self._read_meta(directory)
+            if existing is None:
+                raise
+            return existing
+        meta["dir"] = directory
+        return meta
+
+    def _evict(self, keep: str) -> int:
+        """总大小超过 max_bytes 时按最近使用时间从旧到新删除整组派生图，返回删除的组数"""
+        entries = []
+        total = 0
+        try:
+            names = os.listdir(self.root)
+        except OSError:
+            return 0
+        for name in names:
+            directory = os.path.join(self.root, name)
+            if name.startswith(".tmp-"):
+                # 中断留下的临时目录，超过一小时即清理
+                try:
+                    if time.time() - os.path.getmtime(directory) > 3600:
+                        shutil.rmtree(directory, ignore_errors=True)
+                except OSError:
+                    pass
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+                used = os.path.getmtime(os.path.join(directory, META_FILE))
+            except OSError:
+                continue
+            total += size
+            entries.append((used, name, size))
+        removed = 0
+        for _, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
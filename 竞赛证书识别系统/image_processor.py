@@ -1,13 +1,21 @@
 """
-Image processing helpers: rotate, resize, base64.
+Image processing helpers: rotate, resize, base64, byte-budgeted encoding,
+and a loader that decodes large photos near the target scale.
 """
 from __future__ import annotations
 
 import base64
 import io
-from typing import Tuple
+import math
+from typing import Optional, Tuple
 
-from PIL import Image
+from PIL import Image, ImageOps, ImageStat, features
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+ORIENTATION_TAG = 0x0112
+# Downscales first use Image.reduce (box filter) down to this multiple of the target size,
+# then LANCZOS for the rest; at 3.0 the result is indistinguishable from a full LANCZOS pass.
+REDUCING_GAP = 3.0
 
 
 def rotate_image(img: Image.Image, degrees: int) -> Image.Image:
@@ -19,7 +27,7 @@ def resize_image(img: Image.Image, max_width: int = 1200) -> Image.Image:
         return img
     ratio = max_width / float(img.width)
     new_height = int(img.height * ratio)
-    return img.resize((max_width, new_height))
+    return img.resize((max_width, max(1, new_height)), Image.LANCZOS, reducing_gap=REDUCING_GAP)
 
 
 def image_to_base64(img: Image.Image) -> str:
@@ -28,7 +36,128 @@ def image_to_base64(img: Image.Image) -> str:
     return base64.b64encode(buffer.getvalue()).decode("utf-8")
 
 
-def load_image(path: str) -> Image.Image:
-    return Image.open(path)
+def _orientation(img: Image.Image) -> int:
+    try:
+        return int(img.getexif().get(ORIENTATION_TAG, 1))
+    except Exception:  # noqa: BLE001 - malformed EXIF is treated as upright
+        return 1
+
+
+def open_image(path: str, max_side: Optional[int] = None, max_width: Optional[int] = None) -> Image.Image:
+    """
+    Decode an image upright, at no more resolution than the caller needs.
+
+    JPEGs are decoded in draft mode (DCT scaling by 1/2, 1/4 or 1/8) at the
+    smallest scale whose longest side still covers max_side and whose width
+    still covers max_width, so a 48 MP phone photo never exists at full size.
+    The result is at least that large; callers finish with resize_to_max_side
+    or resize_image. The EXIF orientation is applied once, and the upright
+    size of the original is kept in img.info["original_size"].
+    """
+    img = Image.open(path)
+    orientation = _orientation(img)
+    width, height = img.size
+    if orientation in (5, 6, 7, 8):
+        width, height = height, width
+    scale = 0.0
+    if max_side:
+        scale = max(scale, max_side / float(max(width, height)))
+    if max_width:
+        scale = max(scale, max_width / float(width))
+    if 0 < scale < 1:
+        # draft works on the stored (unrotated) frame; the scale is the same either way
+        img.draft(None, (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+    img.load()
+    if orientation != 1:
+        img = ImageOps.exif_transpose(img)
+    img.info["original_size"] = (width, height)
+    return img
+
+
+def load_image(path: str, max_side: Optional[int] = None) -> Image.Image:
+    """open_image bounded to max_side, with the final step done by LANCZOS."""
+    img = open_image(path, max_side=max_side)
+    return resize_to_max_side(img, max_side) if max_side else img
+
+
+def resize_to_max_side(img: Image.Image, max_side: int) -> Image.Image:
+    """Bound the longest side (unlike resize_image, tall photos are shrunk too)."""
+    longest = max(img.width, img.height)
+    if longest <= max_side:
+        return img
+    ratio = max_side / float(longest)
+    size = (max(1, int(img.width * ratio)), max(1, int(img.height * ratio)))
+    return img.resize(size, Image.LANCZOS, reducing_gap=REDUCING_GAP)
+
+
+def is_near_grayscale(img: Image.Image, max_saturation: float = 12.0) -> bool:
+    """True when the mean HSV saturation is low enough that dropping colour loses nothing useful."""
+    sample = img.convert("RGB")
+    sample.thumbnail((128, 128))
+    saturation = sample.convert("HSV").getchannel("S")
+    return ImageStat.Stat(saturation).mean[0] <= max_saturation
+
+
+def _flatten(img: Image.Image) -> Image.Image:
+    """Drop alpha onto white and convert to a mode JPEG/WebP can store."""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    if img.mode not in ("RGB", "L"):
+        return img.convert("RGB")
+    return img
+
+
+def _encode(img: Image.Image, fmt: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    if fmt == "JPEG":
+        img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    else:
+        img.save(buffer, format=fmt, quality=quality)
+    return buffer.getvalue()
+
+
+def encode_image_to_budget(
+    img: Image.Image,
+    max_bytes: int = 300 * 1024,
+    max_side: int = 1600,
+    fmt: str = "JPEG",
+    min_quality: int = 40,
+    max_quality: int = 90,
+    allow_grayscale: bool = True,
+) -> Tuple[bytes, str]:
+    """
+    Encode an image as JPEG/WebP within max_bytes.
+
+    The longest side is bounded first, near-grayscale images are stored as L,
+    then the highest quality that fits is found by binary search. If even
+    min_quality is too large the image is shrunk by 25% and searched again.
+    Returns (encoded bytes, MIME type).
+    """
+    fmt = fmt.upper()
+    if fmt == "WEBP" and not features.check("webp"):
+        fmt = "JPEG"
+    img = _flatten(resize_to_max_side(img, max_side))
+    if allow_grayscale and img.mode != "L" and is_near_grayscale(img):
+        img = img.convert("L")
 
+    best: Optional[bytes] = None
+    while True:
+        lo, hi = min_quality, max_quality
+        while lo <= hi:
+            quality = (lo + hi) // 2
+            data = _encode(img, fmt, quality)
+            if len(data) <= max_bytes:
+                best = data
+                lo = quality + 1
+            else:
+                hi = quality - 1
+        if best is not None or max(img.size) <= 256:
+            break
+        img = img.resize((max(1, int(img.width * 0.75)), max(1, int(img.height * 0.75))), Image.LANCZOS)
 
+    if best is None:
+        best = _encode(img, fmt, min_quality)
+    return best, MIME_TYPES[fmt]
@@ -3,10 +3,36 @@
 """
 from __future__ import annotations
 
-from typing import Dict, Any, Optional
+import os
+import queue
+import threading
+import time
+from dataclasses import replace
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
 from datetime import datetime
 
-from glm4v_api import extract_with_glm4v
+from auth_system import validate_account_id
+from extraction_backends import BackendRouter, DemoBackend, ExtractionBackend, ExtractionRequest
+from extraction_cache import INCOMPLETE_TTL_HOURS, file_sha256, get_cached, make_cache_key, put_cached
+from extraction_metrics import TOTAL_STAGE, recent_percentile
+from glm4v_api import (
+    GLM4V_MODEL,
+    IMAGE_ENCODING_SIGNATURE,
+    BATCH_ENABLED,
+    BATCH_IMAGE_MAX_BYTES,
+    BATCH_IMAGE_MAX_SIDE,
+    IMAGE_MAX_SIDE,
+    PROMPT_VERSION,
+    extract_batch_with_glm4v,
+    extract_with_glm4v,
+    is_transient_error,
+    load_api_config,
+    prompt_signature,
+)
+from pdf_converter import get_page_count, page_image_path
+from raster_service import RasterService, get_raster_service
+from pdf_text_extractor import extract_from_pdf_text
 
 REQUIRED_FIELDS = [
     "department",
@@ -21,6 +47,63 @@ REQUIRED_FIELDS = [
     "advisor",
 ]
 
+# 进程内同时进行中的识别请求上限（所有批量任务共享），取自 api_config.json 的 batch 段
+_batch_config = load_api_config("batch")
+MAX_IN_FLIGHT = int(_batch_config.get("max_in_flight", 8))
+_in_flight = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+# 批量识别时每次请求携带的图片数；1 表示逐张识别（batch.enabled 为 false 时固定为 1）
+IMAGES_PER_REQUEST = int(_batch_config.get("images_per_request", 1)) if BATCH_ENABLED else 1
+BATCH_VERSION = f"{PROMPT_VERSION}/batch-{BATCH_IMAGE_MAX_SIDE}-{BATCH_IMAGE_MAX_BYTES}"
+
+# 电子版 PDF 文本层识别：以下字段都识别出来时跳过视觉模型，其余字段留给用户核验
+_text_layer_config = load_api_config("text_layer")
+TEXT_LAYER_ENABLED = bool(_text_layer_config.get("enabled", True))
+TEXT_LAYER_REQUIRED_FIELDS = _text_layer_config.get("required_fields", REQUIRED_FIELDS)
+
+# 对冲请求：调用超过对冲延迟仍未返回时再发一路相同请求，先通过校验的结果胜出，另一路随即取消。
+# 对冲延迟取最近成功调用总耗时的 p95（样本不足时使用 delay_seconds），因此只有约 5% 的调用会多发一次
+_hedge_config = load_api_config("hedging")
+HEDGE_ENABLED = bool(_hedge_config.get("enabled", False))
+HEDGE_DELAY_SECONDS = float(_hedge_config.get("delay_seconds", 8))
+HEDGE_PERCENTILE = float(_hedge_config.get("percentile", 95))
+HEDGE_MIN_SAMPLES = int(_hedge_config.get("min_samples", 20))
+HEDGE_MIN_DELAY_SECONDS = float(_hedge_config.get("min_delay_seconds", 1))
+HEDGE_REFRESH_SECONDS = 60
+_hedge_pool = ThreadPoolExecutor(max_workers=max(8, MAX_IN_FLIGHT * 4), thread_name_prefix="hedge")
+_hedge_delays: Dict[str, Tuple[float, float]] = {}
+
+# 分级模型路由：先用便宜快速的模型，结果缺少关键字段或学号不合法时再升级到下一级模型
+_routing_config = load_api_config("routing")
+ROUTING_TIERS = (_routing_config.get("tiers") or [GLM4V_MODEL]) if _routing_config.get("enabled", False) else [GLM4V_MODEL]
+ROUTING_REQUIRED_FIELDS = _routing_config.get("required_fields", TEXT_LAYER_REQUIRED_FIELDS)
+
+# 识别后端路由：延迟 SLO、健康判定和各后端的相对成本，见 extraction_backends
+_backend_config = load_api_config("backends")
+BACKEND_COSTS: Dict[str, float] = _backend_config.get("cost", {})
+
+
+def empty_result(file_name: str = "") -> Dict[str, Any]:
+    """包含所有 REQUIRED_FIELDS 的空结果"""
+    result: Dict[str, Any] = {k: "" for k in REQUIRED_FIELDS}
+    result.update({"extraction_method": "", "extraction_confidence": 0.0, "file_name": file_name})
+    return result
+
+
+def known_fields_for_user(user: Any) -> Dict[str, str]:
+    """
+    上传者账号中已有的字段：学生上传时为本人学号、姓名和学院，教师上传时为指导教师姓名。
+    这些字段不再让模型提取，只请模型核对。
+    """
+    if user is None:
+        return {}
+    if user.role == "student":
+        known = {"student_id": user.account_id, "student_name": user.name, "department": user.department or ""}
+    elif user.role == "teacher":
+        known = {"advisor": user.name}
+    else:
+        known = {}
+    return {k: v for k, v in known.items() if v}
+
 
 def normalize_date(value: str) -> str:
     """尝试将日期规范为 YYYY-MM 或原样返回空串"""
@@ -48,21 +131,218 @@ def normalize_date(value: str) -> str:
     return value
 
 
-def extract_info(image_path: str, api_key: Optional[str] = None) -> Dict[str, Any]:
+class SingleFlight:
     """
-    调用 GLM-4V 并规范化输出，保证返回包含所有 REQUIRED_FIELDS 的字典。
-    当 API 调用失败或某些字段缺失时，使用空字符串占位并记录状态信息。
+    合并相同键的并发调用：同一时刻每个键只执行一次，
+    其余调用者等待并得到同一个结果（或同一个异常）。调用结束后键即释放。
     """
-    result: Dict[str, Any] = {k: "" for k in REQUIRED_FIELDS}
-    result.update({"extraction_method": "", "extraction_confidence": 0.0, "file_name": ""})
 
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+
+    def do(self, key: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        if not leader:
+            result = future.result()
+            return dict(result) if isinstance(result, dict) else result
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+
+# 以缓存键（图片内容哈希 + 模型 + 提示词）合并进程内相同的识别请求
+_single_flight = SingleFlight()
+
+
+def hedge_delay(model: str) -> float:
+    """模型的对冲延迟（秒），每分钟按最近的调用记录重新计算一次"""
+    now = time.monotonic()
+    cached = _hedge_delays.get(model)
+    if cached and now - cached[0] < HEDGE_REFRESH_SECONDS:
+        return cached[1]
     try:
-        raw = extract_with_glm4v(image_path, api_key=api_key)
-    except Exception as exc:
-        # 记录失败信息以便上层展示
-        result.update({"extraction_method": "glm4v_failed", "extraction_confidence": 0.0})
-        result["_error"] = str(exc)
-        return result
+        observed = recent_percentile(TOTAL_STAGE, HEDGE_PERCENTILE, model=model, min_samples=HEDGE_MIN_SAMPLES)
+    except Exception:
+        observed = None
+    delay = max(HEDGE_MIN_DELAY_SECONDS, observed) if observed is not None else HEDGE_DELAY_SECONDS
+    _hedge_delays[model] = (now, delay)
+    return delay
+
+
+def _stop_fields(known: Optional[Dict[str, Any]] = None) -> list:
+    """
+    流式识别可以提前断开的字段集合：提示词要求返回的 REQUIRED_FIELDS（已知字段不在提示词中），
+    附带已知信息时还要等到 mismatch 列表（见 glm4v_api.build_prompt）
+    """
+    known_keys = {k for k, v in (known or {}).items() if str(v or "").strip()}
+    fields = [k for k in REQUIRED_FIELDS if k not in known_keys]
+    if known_keys & set(REQUIRED_FIELDS):
+        fields.append("mismatch")
+    return fields
+
+
+def _hedged_extract(
+    image_path: str,
+    api_key: Optional[str] = None,
+    on_field: Optional[Callable[[str, Any], None]] = None,
+    model: str = GLM4V_MODEL,
+    known: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    调用 GLM-4V；超过 hedge_delay 仍未返回时发出第二路相同请求。
+    先返回且通过 routing_problems 检查的结果胜出，另一路（流式）随即断开；
+    两路都未通过检查时取先返回的结果，都失败时抛出第一个异常。
+    两路请求都在 _hedge_pool 的线程中执行，on_field 却只在调用线程中回调：主请求的字段事件
+    先放入队列，由调用线程取出后回调（Streamlit 的页面元素只能在脚本线程中更新）。
+    对冲请求不回调 on_field，避免两路字段交错写入页面。on_field 抛出的异常原样传给调用方，仍在进行的请求随之取消。
+    两路都是流式请求时，_stop_fields 中的字段全部到齐即断开，不等待模型在 JSON 之后追加的说明文字。
+    """
+    stop_fields = _stop_fields(known)
+    if not HEDGE_ENABLED:
+        return extract_with_glm4v(
+            image_path, api_key=api_key, on_field=on_field, model=model, known=known, stop_fields=stop_fields
+        )
+
+    # 队列中的元素：(字段, 值) 为主请求的字段事件，(None, Future) 为某一路请求结束
+    events: "queue.Queue[Tuple[Optional[str], Any]]" = queue.Queue()
+    cancels: Dict[Future, threading.Event] = {}
+
+    def start(relay: Optional[Callable[[str, Any], None]]) -> Future:
+        cancel = threading.Event()
+        future = _hedge_pool.submit(
+            extract_with_glm4v,
+            image_path,
+            api_key=api_key,
+            on_field=relay,
+            model=model,
+            known=known,
+            stop_fields=stop_fields,
+            cancel=cancel,
+        )
+        cancels[future] = cancel
+        future.add_done_callback(lambda f: events.put((None, f)))
+        return future
+
+    pending = {start((lambda key, value: events.put((key, value))) if on_field is not None else None)}
+    deadline = time.monotonic() + hedge_delay(model)
+    fallback: Optional[Dict[str, Any]] = None
+    error: Optional[Exception] = None
+    try:
+        while pending:
+            # 对冲请求发出前最多等到对冲时刻，之后一直等到某一路结束
+            timeout = max(0.0, deadline - time.monotonic()) if len(cancels) == 1 else None
+            try:
+                key, value = events.get(timeout=timeout)
+            except queue.Empty:
+                pending.add(start(None))
+                continue
+            if key is not None:
+                on_field(key, value)
+                continue
+            pending.discard(value)
+            try:
+                raw = value.result()
+            except Exception as exc:  # noqa: BLE001
+                error = error or exc
+                continue
+            if routing_problems(_apply_known(normalize_raw(raw), known or {}, raw)):
+                fallback = fallback or raw
+                continue
+            return raw
+    finally:
+        # 已有结果胜出，或调用方的 on_field 抛出异常：仍在进行的请求全部取消（流式连接随之断开、释放限流名额），
+        # 尚未开始的直接撤销
+        for other in pending:
+            cancels[other].set()
+            other.cancel()
+    if fallback is not None:
+        return fallback
+    raise error
+
+
+def _cache_lookup(image_path: str, model: str, version: str) -> Tuple[str, str, Optional[Dict[str, Any]]]:
+    """返回 (缓存键, 内容哈希, 缓存结果)；计算哈希或读取缓存失败时缓存键为空"""
+    try:
+        content_hash = file_sha256(image_path)
+        cache_key = make_cache_key(content_hash, model, version)
+        return cache_key, content_hash, get_cached(cache_key)
+    except Exception:
+        return "", "", None
+
+
+def _cacheable(raw: Any) -> bool:
+    """
+    结果是否可以缓存：备用关键词解析得到的结果（回复无法解析）和带 _error 的结果不缓存，
+    一次异常回复不会在 TTL 内一直返回给同一文件的重新上传。
+    """
+    return isinstance(raw, dict) and not raw.get("_fallback_parse") and not raw.get("_error")
+
+
+def _cache_ttl_hours(raw: Dict[str, Any], known: Optional[Dict[str, Any]] = None) -> Optional[float]:
+    """
+    缓存有效期：关键字段不完整（证书上本来就没有，或模型漏识别）的结果只缓存 INCOMPLETE_TTL_HOURS，
+    短时间内的重新上传不必再付费调用各级模型，过后会重新识别；其余结果使用全局 TTL（返回 None）
+    """
+    if routing_problems(_apply_known(normalize_raw(raw), known or {}, raw)):
+        return INCOMPLETE_TTL_HOURS
+    return None
+
+
+def _extract_with_cache(
+    image_path: str,
+    api_key: Optional[str] = None,
+    on_field: Optional[Callable[[str, Any], None]] = None,
+    model: str = GLM4V_MODEL,
+    known: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    先按图片内容哈希查缓存，未命中再调用 GLM-4V，通过 _cacheable 检查的结果写回缓存（各模型、各提示词的结果分别缓存）。
+    缓存读写失败不影响识别本身。on_field 只在实际调用 API（流式输出）时逐字段回调。
+    """
+    version = f"{PROMPT_VERSION}/{IMAGE_ENCODING_SIGNATURE}/{prompt_signature(known=known)}"
+    cache_key, content_hash, cached = _cache_lookup(image_path, model, version)
+    if cached is not None:
+        cached["_cache_hit"] = True
+        return cached
+
+    def call() -> Dict[str, Any]:
+        raw = _hedged_extract(image_path, api_key=api_key, on_field=on_field, model=model, known=known)
+        if cache_key and _cacheable(raw):
+            try:
+                put_cached(cache_key, content_hash, model, version, raw, ttl_hours=_cache_ttl_hours(raw, known))
+            except Exception:
+                pass
+        return raw
+
+    if not cache_key:
+        return call()
+    # 相同内容的识别正在进行时等待其结果，不再重复调用 API（等待者不会收到 on_field 回调）
+    return _single_flight.do(cache_key, call)
+
+
+def missing_fields(result: Dict[str, Any], fields: Iterable[str] = REQUIRED_FIELDS) -> list:
+    """返回结果中为空的字段"""
+    return [k for k in fields if not str(result.get(k) or "").strip()]
+
+
+def normalize_raw(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """把模型或本地识别器的原始输出规范化为包含所有 REQUIRED_FIELDS 的字典"""
+    result = empty_result()
 
     # GLM 返回的字段名可能与我们预期一致；尽量兼容常见别名
     mapping_candidates = {
@@ -111,3 +391,372 @@ def extract_info(image_path: str, api_key: Optional[str] = None) -> Dict[str, An
     # 附加原始字段备查
     result["_raw_response"] = raw
     return result
+
+
+def routing_problems(result: Dict[str, Any]) -> list:
+    """规范化结果需要升级模型的原因：关键字段为空，或学号不是 13 位数字"""
+    problems = [f"{k} 为空" for k in missing_fields(result, ROUTING_REQUIRED_FIELDS)]
+    student_id = str(result.get("student_id") or "").strip()
+    if student_id and not validate_account_id(student_id, "student"):
+        problems.append("student_id 不是13位数字")
+    return problems
+
+
+def _apply_known(result: Dict[str, Any], known: Dict[str, Any], raw: Any = None) -> Dict[str, Any]:
+    """已知字段填入结果中的空字段；模型报告与已知值不一致的字段记录在 _mismatch 中"""
+    for key, value in known.items():
+        if key in REQUIRED_FIELDS and not str(result.get(key) or "").strip():
+            result[key] = value
+    mismatch = raw.get("mismatch") if isinstance(raw, dict) else None
+    if isinstance(mismatch, list):
+        flagged = [k for k in mismatch if k in known]
+        if flagged:
+            result["_mismatch"] = flagged
+    return result
+
+
+def _field_publisher(
+    on_field: Optional[Callable[[str, Any], None]],
+    skip: Iterable[str] = (),
+) -> Optional[Callable[[str, Any], None]]:
+    """
+    包装 on_field：只转发 REQUIRED_FIELDS 中的非空字段，日期规范为 YYYY-MM；
+    skip 中的字段（文本层已识别）以文本层为准，不再重复发布。
+    """
+    if on_field is None:
+        return None
+    skipped = set(skip)
+
+    def publish(key: str, value: Any) -> None:
+        if key not in REQUIRED_FIELDS or key in skipped:
+            return
+        value = str(value or "").strip()
+        if key == "award_date":
+            value = normalize_date(value)
+        if value:
+            on_field(key, value)
+
+    return publish
+
+
+def _extract_text_layer(source_path: Optional[str], page_index: int = 0) -> Optional[Dict[str, Any]]:
+    """电子版 PDF 的文本层识别结果；非 PDF、扫描件或读取失败时返回 None"""
+    if not TEXT_LAYER_ENABLED or not source_path or not source_path.lower().endswith(".pdf"):
+        return None
+    try:
+        return extract_from_pdf_text(source_path, page_index)
+    except Exception:
+        return None
+
+
+class PdfTextBackend(ExtractionBackend):
+    """电子版 PDF 文本层：本地解析，毫秒级、零成本，结果为精确文字"""
+
+    name = "pdf_text"
+    authoritative = True
+
+    def supports(self, request: ExtractionRequest) -> bool:
+        return TEXT_LAYER_ENABLED and bool(request.source_path) and request.source_path.lower().endswith(".pdf")
+
+    def extract(self, request: ExtractionRequest) -> Optional[Dict[str, Any]]:
+        return _extract_text_layer(request.source_path, request.page_index)
+
+    def is_complete(self, result: Dict[str, Any]) -> bool:
+        return not missing_fields(result, TEXT_LAYER_REQUIRED_FIELDS)
+
+
+class GLM4VBackend(ExtractionBackend):
+    """GLM-4V 视觉模型，每一级模型一个后端；调用经过结果缓存、请求合并和对冲"""
+
+    streams = True
+
+    def __init__(self, model: str, cost: float, window: int = 50):
+        super().__init__(window)
+        self.model = model
+        self.name = f"glm4v:{model}"
+        self.cost = cost
+
+    def extract(self, request: ExtractionRequest) -> Optional[Dict[str, Any]]:
+        return _extract_with_cache(
+            request.image_path,
+            api_key=request.api_key,
+            on_field=request.on_field,
+            model=self.model,
+            known=request.known,
+        )
+
+    def is_complete(self, result: Dict[str, Any]) -> bool:
+        return not routing_problems(result)
+
+
+def _build_router() -> BackendRouter:
+    window = int(_backend_config.get("window", 50))
+    backend_router = BackendRouter(
+        latency_slo=float(_backend_config.get("latency_slo_seconds", 20)),
+        min_success_rate=float(_backend_config.get("min_success_rate", 0.5)),
+        min_samples=int(_backend_config.get("min_samples", 5)),
+    )
+    backends: list = [PdfTextBackend(window)]
+    # 未配置成本的模型按 ROUTING_TIERS 的顺序递增，保持“先便宜后昂贵”的升级顺序
+    backends += [GLM4VBackend(model, index + 1, window) for index, model in enumerate(ROUTING_TIERS)]
+    if _backend_config.get("demo_fallback", False):
+        backends.append(DemoBackend(window))
+    for backend in backends:
+        backend.cost = float(BACKEND_COSTS.get(backend.name, backend.cost))
+        backend_router.register(backend)
+    return backend_router
+
+
+router = _build_router()
+
+
+def extract_info(
+    image_path: str,
+    api_key: Optional[str] = None,
+    source_path: Optional[str] = None,
+    page_index: int = 0,
+    on_field: Optional[Callable[[str, Any], None]] = None,
+    known: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    经 router 选择的识别后端（文本层、GLM-4V 各级模型……）识别并规范化输出，保证返回包含所有 REQUIRED_FIELDS 的字典。
+    当所有后端都失败或某些字段缺失时，使用空字符串占位并记录状态信息。
+    source_path 为电子版 PDF 时先读取文本层：TEXT_LAYER_REQUIRED_FIELDS 都已识别则不再调用视觉模型，
+    否则由 GLM-4V 补全文本层缺失的字段。
+    on_field(字段, 值) 在每个字段识别出来时立即回调（文本层字段先发布，模型字段随流式输出到达），
+    供页面逐步预填表单。
+    所有后端失败时结果带 _error；失败原因是上游临时故障（见 glm4v_api.is_transient_error）时另带 _transient，
+    后台任务据此稍后重试。
+    known 为上传者账号中已有的字段（见 known_fields_for_user），与文本层已识别的字段一起写入提示词，
+    模型只提取其余字段并核对已知值。
+    """
+    known = {k: v for k, v in (known or {}).items() if str(v or "").strip()}
+    request = ExtractionRequest(image_path, api_key=api_key, source_path=source_path, page_index=page_index, known=known)
+    publish = _field_publisher(on_field)
+    # 按 router.plan 的顺序尝试后端：结果通过该后端的 is_complete 检查即停止，失败或不完整时切换到下一个
+    exact: Dict[str, Any] = {}  # 精确后端（文本层）识别出的字段：优先于模型结果，并作为已知值写入提示词
+    methods: list = []
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[Exception] = None
+    inexact_ok = False
+    for backend in router.plan(request):
+        if backend.fallback_only and result is not None:
+            break
+        attempt = replace(
+            request,
+            known={**known, **exact},
+            on_field=_field_publisher(on_field, skip=exact) if backend.streams else None,
+        )
+        try:
+            raw = router.call(backend, attempt)
+        except Exception as exc:
+            error = exc
+            continue
+        if not raw:
+            continue
+        if backend.authoritative:
+            exact.update({k: v for k, v in raw.items() if k in REQUIRED_FIELDS and str(v or "").strip()})
+        else:
+            inexact_ok = True
+        method = str(raw.get("extraction_method") or backend.name)
+        if method not in methods:
+            methods.append(method)
+        merged = dict(raw)
+        merged.update(exact)
+        backend_result = _apply_known(normalize_raw(merged), known, raw)
+        if result is not None:
+            # 前一个后端已识别、本后端为空的字段保留前一个后端的值
+            for key in missing_fields(backend_result):
+                backend_result[key] = result.get(key, "")
+        result = backend_result
+        result["extraction_method"] = "+".join(methods)
+        if isinstance(backend, GLM4VBackend):
+            result["_model"] = backend.model
+        if backend.is_complete(result):
+            break
+        if publish is not None and not backend.streams:
+            for key, value in raw.items():
+                publish(key, value)
+
+    if result is None:
+        result = _apply_known(empty_result(), known)
+        result["extraction_method"] = "glm4v_failed"
+        result["_error"] = str(error or "没有可用的识别后端")
+    elif error is not None and not inexact_ok:
+        # 只有文本层有结果、模型全部失败：记录失败信息以便上层展示，文本层已识别的字段仍然保留
+        result["_error"] = str(error)
+    if result.get("_error") and error is not None and is_transient_error(error):
+        result["_transient"] = True
+    return result
+
+
+def _extract_one(
+    image_path: str,
+    api_key: Optional[str] = None,
+    source_path: Optional[str] = None,
+    page_index: int = 0,
+    known: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """批量任务中的单项：占用一个全局并发名额，异常也转换为规范化结果"""
+    with _in_flight:
+        try:
+            result = extract_info(image_path, api_key=api_key, source_path=source_path, page_index=page_index, known=known)
+        except Exception as exc:  # noqa: BLE001
+            result = empty_result()
+            result.update({"extraction_method": "glm4v_failed", "_error": str(exc)})
+    result["file_name"] = os.path.basename(source_path or image_path)
+    return result
+
+
+def _extract_group(paths: list, api_key: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """
+    一次请求识别一组图片（使用第一级模型）。结果按图片分别缓存；
+    返回 {路径: 规范化结果}，模型没有覆盖到或未通过 routing_problems 检查的图片不在其中。
+    """
+    model = ROUTING_TIERS[0]
+    results: Dict[str, Dict[str, Any]] = {}
+    to_send = []
+    for path in paths:
+        cache_key, content_hash, cached = _cache_lookup(path, model, BATCH_VERSION)
+        if cached is not None:
+            cached["_cache_hit"] = True
+            results[path] = cached
+        else:
+            to_send.append((path, cache_key, content_hash))
+
+    if to_send:
+        with _in_flight:
+            try:
+                raws = extract_batch_with_glm4v([p for p, _, _ in to_send], api_key=api_key, model=model)
+            except Exception:
+                raws = [None] * len(to_send)
+        for (path, cache_key, content_hash), raw in zip(to_send, raws):
+            if raw is None:
+                continue
+            results[path] = raw
+            if cache_key and _cacheable(raw):
+                try:
+                    put_cached(cache_key, content_hash, model, BATCH_VERSION, raw, ttl_hours=_cache_ttl_hours(raw))
+                except Exception:
+                    pass
+
+    normalized = {}
+    for path, raw in results.items():
+        result = normalize_raw(raw)
+        if routing_problems(result):
+            continue
+        result["_model"] = model
+        result["file_name"] = os.path.basename(path)
+        normalized[path] = result
+    return normalized
+
+
+def extract_many(
+    paths: Iterable[str],
+    max_concurrency: int = 4,
+    api_key: Optional[str] = None,
+    images_per_request: int = IMAGES_PER_REQUEST,
+) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    并发识别多张证书，按完成顺序逐个产出 (路径, 规范化结果)。
+    max_concurrency 限制本批次的线程数，同时所有批次共享 MAX_IN_FLIGHT 的全局上限；
+    单项失败时结果中带 _error，不影响其他项。提前停止迭代会取消尚未开始的任务。
+    images_per_request > 1 时每 images_per_request 张图片合并为一次请求，
+    批量结果没有覆盖到或关键字段不完整的图片自动改为单张识别（按 ROUTING_TIERS 逐级升级）。
+    """
+    paths = list(paths)
+    executor = ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="extract")
+    try:
+        if images_per_request <= 1:
+            futures = {executor.submit(_extract_one, path, api_key): path for path in paths}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+            return
+
+        groups = {
+            executor.submit(_extract_group, paths[i:i + images_per_request], api_key): paths[i:i + images_per_request]
+            for i in range(0, len(paths), images_per_request)
+        }
+        singles: Dict[Any, str] = {}
+        pending = set(groups)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in singles:
+                    yield singles[future], future.result()
+                    continue
+                covered = future.result()
+                for path in groups[future]:
+                    if path in covered:
+                        yield path, covered[path]
+                    else:
+                        single = executor.submit(_extract_one, path, api_key)
+                        singles[single] = path
+                        pending.add(single)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def extract_pdf_pages(
+    pdf_path: str,
+    max_concurrency: int = 4,
+    render_workers: Optional[int] = None,
+    dpi: int = 200,
+    api_key: Optional[str] = None,
+    known: Optional[Dict[str, Any]] = None,
+    max_side: Optional[int] = IMAGE_MAX_SIDE,
+) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    逐页识别多页 PDF（每页一张证书），按完成顺序产出 (页码(从1开始), 规范化结果)。
+    文本层已完整的页直接返回；其余页交给栅格化服务的常驻进程池并行渲染（render_workers 指定时
+    单独建一个该大小的进程池），渲染完成的页立即提交识别，渲染与识别同时进行。
+    单页失败时结果中带 _error，不影响其他页。
+    known 为上传者账号中已有的字段，含义同 extract_info。
+    页面直接按 max_side（默认为送模型图片的最长边）渲染，不生成用不到的高分辨率位图。
+    """
+    file_name = os.path.basename(pdf_path)
+    page_count = get_page_count(pdf_path)
+    pending_pages = []
+    for page_index in range(page_count):
+        local = _extract_text_layer(pdf_path, page_index)
+        if local and not missing_fields(local, TEXT_LAYER_REQUIRED_FIELDS):
+            result = _apply_known(normalize_raw(local), known or {})
+            result["file_name"] = file_name
+            yield page_index + 1, result
+        else:
+            pending_pages.append(page_index)
+    if not pending_pages:
+        return
+
+    raster = RasterService(render_workers) if render_workers else get_raster_service()
+    extract_pool = ThreadPoolExecutor(max_workers=max(1, max_concurrency), thread_name_prefix="extract-page")
+    renders: Dict[Future, int] = {}
+    try:
+        # 任务只携带页码，页面在子进程中打开和渲染，主进程不持有位图
+        for i in pending_pages:
+            renders[raster.submit(pdf_path, i, page_image_path(pdf_path, i), max_side=max_side, dpi=dpi)] = i
+        extracts: Dict[Any, int] = {}
+        pending = set(renders)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in renders:
+                    page_index = renders[future]
+                    try:
+                        image_path = future.result()
+                    except Exception as exc:  # noqa: BLE001
+                        result = empty_result(file_name)
+                        result.update({"extraction_method": "none", "_error": f"第 {page_index + 1} 页渲染失败: {exc}"})
+                        yield page_index + 1, result
+                        continue
+                    extract_future = extract_pool.submit(_extract_one, image_path, api_key, pdf_path, page_index, known)
+                    extracts[extract_future] = page_index
+                    pending.add(extract_future)
+                else:
+                    yield extracts[future] + 1, future.result()
+    finally:
+        for future in renders:
+            future.cancel()
+        if render_workers:
+            raster.shutdown()
+        extract_pool.shutdown(wait=False, cancel_futures=True)
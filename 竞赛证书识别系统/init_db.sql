@@ -46,12 +46,15 @@ CREATE TABLE IF NOT EXISTS "certificate" (
     award_date TEXT,
     advisor TEXT,
     file_path TEXT NOT NULL,
+    file_id INTEGER,
+    page_number INTEGER,
     extraction_method TEXT,
     extraction_confidence REAL,
     status TEXT NOT NULL DEFAULT 'draft',
     created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     submitted_at TIMESTAMP,
-    FOREIGN KEY (submitter_id) REFERENCES "user"(user_id)
+    FOREIGN KEY (submitter_id) REFERENCES "user"(user_id),
+    FOREIGN KEY (file_id) REFERENCES "file"(file_id)
 );
 
 -- 系统配置表
@@ -67,6 +70,66 @@ CREATE TABLE IF NOT EXISTS "system_config" (
 
 CREATE INDEX IF NOT EXISTS idx_system_config_key ON "system_config"(config_key);
 
+-- 识别结果缓存表（按图片内容哈希 + 模型 + 提示词版本缓存 GLM-4V 返回）
+CREATE TABLE IF NOT EXISTS "extraction_cache" (
+    cache_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    cache_key TEXT NOT NULL UNIQUE,
+    content_hash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    result_json TEXT NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    hit_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    last_accessed TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_extraction_cache_key ON "extraction_cache"(cache_key);
+CREATE INDEX IF NOT EXISTS idx_extraction_cache_content_hash ON "extraction_cache"(content_hash);
+CREATE INDEX IF NOT EXISTS idx_extraction_cache_last_accessed ON "extraction_cache"(last_accessed);
+
+-- 后台识别任务表（worker 以租约方式领取任务）
+CREATE TABLE IF NOT EXISTS "extraction_job" (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    file_path TEXT NOT NULL,
+    image_path TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    page_number INTEGER,
+    status TEXT NOT NULL DEFAULT 'queued',
+    result_json TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_token TEXT,
+    lease_expires_at TIMESTAMP,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES "user"(user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_extraction_job_content_hash ON "extraction_job"(content_hash);
+CREATE INDEX IF NOT EXISTS idx_extraction_job_status ON "extraction_job"(status);
+
+-- 识别链路指标表：每次调用各阶段一行，另有 stage='total' 的汇总行记录 token 用量
+CREATE TABLE IF NOT EXISTS "extraction_metrics" (
+    metric_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    call_id TEXT NOT NULL,
+    stage TEXT NOT NULL,  -- decode/resize/encode/base64/network/parse/stream/total
+    duration_ms REAL NOT NULL,
+    size_bytes INTEGER,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    total_tokens INTEGER,
+    model TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL DEFAULT 'ok',  -- ok/error
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_extraction_metrics_call_id ON "extraction_metrics"(call_id);
+CREATE INDEX IF NOT EXISTS idx_extraction_metrics_stage ON "extraction_metrics"(stage);
+CREATE INDEX IF NOT EXISTS idx_extraction_metrics_created_at ON "extraction_metrics"(created_at);
+
 -- 插入默认管理员账号（密码：Admin@123，bcrypt哈希）
 -- 注意：实际使用时应该通过 database.py 的 init_db() 函数创建，因为需要 bcrypt 哈希
 -- 这里仅作为参考，实际密码哈希值需要通过 Python 的 bcrypt 生成
@@ -0,0 +1,393 @@
+"""
+本地 GLM-4V 替身服务：实现 /api/paas/v4/chat/completions 接口，回放录制好的识别结果
+用于离线压测与重试行为验证，无需联网、不产生API费用
+
+运行:
+    python mock_glm4v_server.py --port 8765 --latency-median 2.0 --error-rate 0.05
+然后将 api_config.json 中 glm4v.api_url 改为
+    http://127.0.0.1:8765/api/paas/v4/chat/completions
+（或设置环境变量 GLM4V_API_URL）。
+
+请求中的图片按感知哈希（dHash）匹配 fixtures 中的源图片，
+因此客户端缩放或重新编码图片后仍能命中对应的录制结果。
+请求带 response_format={"type": "json_object"} 时返回不带代码块的 JSON；
+--garble-rate 按概率把图片请求的回复改写为不规范的格式，用于验证容错解析和修复调用。
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import io
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from glm4v_api import load_api_config
+from pdf_converter import render_page
+
+API_PATH = "/api/paas/v4/chat/completions"
+DEFAULT_FIXTURES = "test_files/glm4v_fixtures.json"
+# dHash 汉明距离不超过该值视为同一张图片
+MATCH_THRESHOLD = 10
+# 流式响应每个分片的字符数
+STREAM_CHUNK_CHARS = 8
+
+
+def dhash(img: Image.Image, hash_size: int = 8) -> int:
+    """差值哈希：对缩放和重新编码不敏感"""
+    small = img.convert("L").resize((hash_size + 1, hash_size))
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def _load_source_image(path: str) -> Image.Image:
+    if path.lower().endswith(".pdf"):
+        return render_page(path, 0, dpi=72)
+    return Image.open(path)
+
+
+class FixtureStore:
+    """录制结果：source 图片的 dHash -> 模型返回的 JSON 内容"""
+
+    def __init__(self, fixtures_path: str = DEFAULT_FIXTURES):
+        with open(fixtures_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.default: Dict[str, Any] = data.get("default", {})
+        self.entries: List[Tuple[int, str, Dict[str, Any]]] = []
+        for item in data.get("fixtures", []):
+            try:
+                self.entries.append((dhash(_load_source_image(item["source"])), item["source"], item["content"]))
+            except Exception as exc:  # noqa: BLE001
+                print(f"跳过无法加载的 fixture {item.get('source')}: {exc}")
+
+    def lookup(self, img: Image.Image) -> Tuple[Optional[str], Dict[str, Any]]:
+        """返回 (匹配的源文件, 内容)；未匹配时返回默认内容"""
+        if not self.entries:
+            return None, self.default
+        h = dhash(img)
+        distance, source, content = min(((bin(h ^ eh).count("1"), src, c) for eh, src, c in self.entries), key=lambda e: e[0])
+        if distance <= MATCH_THRESHOLD:
+            return source, content
+        return None, self.default
+
+
+class FaultProfile:
+    """延迟分布、随机错误率和周期性 429 突发"""
+
+    def __init__(
+        self,
+        latency_median: float = 1.0,
+        latency_sigma: float = 0.5,
+        error_rate: float = 0.0,
+        burst_every: float = 0.0,
+        burst_length: float = 0.0,
+        retry_after: float = 1.0,
+        chunk_interval: float = 0.02,
+        trailing_chars: int = 0,
+        garble_rate: float = 0.0,
+    ):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.retry_after = retry_after
+        # 流式响应：分片间隔，以及 JSON 之后附加的说明文字长度（模拟模型多说的话）
+        self.chunk_interval = chunk_interval
+        self.trailing_chars = trailing_chars
+        # 不使用 JSON 模式时，回复被改写为不规范格式的概率
+        self.garble_rate = garble_rate
+        self.started = time.monotonic()
+
+    def sample_latency(self) -> float:
+        """对数正态分布：中位数为 latency_median，sigma 越大长尾越明显"""
+        if self.latency_median <= 0:
+            return 0.0
+        return random.lognormvariate(math.log(self.latency_median), self.latency_sigma)
+
+    def in_burst(self) -> bool:
+        """每 burst_every 秒的开头 burst_length 秒内返回 429"""
+        if self.burst_every <= 0 or self.burst_length <= 0:
+            return False
+        return (time.monotonic() - self.started) % self.burst_every < self.burst_length
+
+    def should_fail(self) -> bool:
+        return random.random() < self.error_rate
+
+    def should_garble(self) -> bool:
+        return random.random() < self.garble_rate
+
+
+class MockStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+
+    def incr(self, key: str) -> None:
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def stream_started(self) -> None:
+        """进行中的流式响应数，以及运行以来的峰值（stream_active / stream_peak）"""
+        with self.lock:
+            active = self.counts.get("stream_active", 0) + 1
+            self.counts["stream_active"] = active
+            self.counts["stream_peak"] = max(self.counts.get("stream_peak", 0), active)
+
+    def stream_finished(self) -> None:
+        with self.lock:
+            self.counts["stream_active"] = self.counts.get("stream_active", 0) - 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.counts)
+
+
+def _images(payload: Dict[str, Any]) -> List[Image.Image]:
+    """按顺序取出请求中的所有 data URL 图片"""
+    images = []
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            if part.get("type") != "image_url":
+                continue
+            url = part.get("image_url", {}).get("url", "")
+            if "," in url:
+                url = url.split(",", 1)[1]
+            images.append(Image.open(io.BytesIO(base64.b64decode(url))))
+    return images
+
+
+def _prompt_text(payload: Dict[str, Any]) -> str:
+    """请求中所有文本片段拼接后的内容"""
+    texts = []
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            texts.append(content)
+        elif isinstance(content, list):
+            texts.extend(part.get("text", "") for part in content if part.get("type") == "text")
+    return "\n".join(texts)
+
+
+def _garble(content: Dict[str, Any]) -> str:
+    """模拟模型不按要求输出：一半为单引号、全角冒号、多余逗号的近似 JSON，一半为逐行的“字段：值”文字"""
+    if random.random() < 0.5:
+        body = ", ".join(f"'{key}'：'{value}'" for key, value in content.items())
+        return "以下是识别结果：{" + body + ",}"
+    return "识别结果如下：\n" + "\n".join(f"{key}：{value}" for key, value in content.items())
+
+
+def _unscramble(text: str) -> Dict[str, Any]:
+    """模拟修复调用：从原回复中逐行取回“字段：值”"""
+    fields = {}
+    for line in text.splitlines():
+        key, sep, value = line.partition("：")
+        if sep and key.strip().isidentifier():
+            fields[key.strip()] = value.strip()
+    return fields
+
+
+def make_handler(store: FixtureStore, profile: FaultProfile, stats: MockStats):
+    class MockHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _write_chunk(self, data: bytes) -> None:
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def _send_stream(self, text: str, model: str, usage: Dict[str, int]) -> None:
+            """以 SSE 分片返回内容（chunked 编码），客户端提前断开时停止发送"""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            completion_id = uuid.uuid4().hex
+            stats.stream_started()
+            try:
+                for start in range(0, len(text), STREAM_CHUNK_CHARS):
+                    chunk = {
+                        "id": completion_id,
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "delta": {"role": "assistant", "content": text[start:start + STREAM_CHUNK_CHARS]}}],
+                    }
+                    self._write_chunk(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    time.sleep(profile.chunk_interval)
+                done = {"id": completion_id, "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}], "usage": usage}
+                self._write_chunk(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+                self._write_chunk(b"")
+                stats.incr("stream_complete")
+            except (BrokenPipeError, ConnectionResetError):
+                stats.incr("stream_cancelled")
+                self.close_connection = True
+            finally:
+                stats.stream_finished()
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._send_json(200, stats.snapshot())
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            raw = self.rfile.read(length)
+            if self.path != API_PATH:
+                stats.incr("404")
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+            if not self.headers.get("Authorization", "").startswith("Bearer "):
+                stats.incr("401")
+                self._send_json(401, {"error": {"code": "1000", "message": "身份验证失败"}})
+                return
+            if profile.in_burst():
+                stats.incr("429")
+                self._send_json(
+                    429,
+                    {"error": {"code": "1302", "message": "接口请求并发超额，请稍后重试"}},
+                    {"Retry-After": f"{profile.retry_after:g}"},
+                )
+                return
+
+            time.sleep(profile.sample_latency())
+            if profile.should_fail():
+                stats.incr("500")
+                self._send_json(500, {"error": {"code": "500", "message": "模拟服务端错误"}})
+                return
+
+            try:
+                payload = json.loads(raw)
+                images = _images(payload)
+            except Exception as exc:  # noqa: BLE001
+                stats.incr("400")
+                self._send_json(400, {"error": {"code": "1210", "message": f"请求参数错误: {exc}"}})
+                return
+
+            prompt = _prompt_text(payload)
+            if not images and "识别结果原文：" in prompt:
+                # 修复调用：把原回复中的字段整理为 JSON
+                stats.incr("200_repair")
+                content = _unscramble(prompt.split("识别结果原文：", 1)[1])
+            elif len(images) > 1:
+                # 批量请求：按图片顺序返回带 index 的 JSON 数组
+                stats.incr("200_batch")
+                content = [{"index": i, **store.lookup(img)[1]} for i, img in enumerate(images)]
+            else:
+                source, content = store.lookup(images[0]) if images else (None, store.default)
+                stats.incr("200" if source else "200_default")
+            if (payload.get("response_format") or {}).get("type") == "json_object":
+                text = json.dumps(content, ensure_ascii=False)
+            elif images and isinstance(content, dict) and profile.should_garble():
+                stats.incr("garbled")
+                text = _garble(content)
+            else:
+                text = "```json\n" + json.dumps(content, ensure_ascii=False, indent=2) + "\n```"
+            if payload.get("stream"):
+                text += "\n" + "以上信息根据证书图片识别，仅供参考。" * max(0, profile.trailing_chars // 18)
+            usage = {
+                "prompt_tokens": 1000 + len(raw) // 1000,
+                "completion_tokens": len(text) // 2,
+                "total_tokens": 1000 + len(raw) // 1000 + len(text) // 2,
+            }
+            if payload.get("stream"):
+                self._send_stream(text, payload.get("model", ""), usage)
+                return
+            self._send_json(
+                200,
+                {
+                    "id": uuid.uuid4().hex,
+                    "created": int(time.time()),
+                    "model": payload.get("model", ""),
+                    "choices": [
+                        {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}
+                    ],
+                    "usage": usage,
+                },
+            )
+
+        def log_message(self, format, *args):  # noqa: A002
+            pass
+
+    return MockHandler
+
+
+def start_server(
+    host: str = "127.0.0.1",
+    port: int = 8765,
+    fixtures_path: str = DEFAULT_FIXTURES,
+    profile: Optional[FaultProfile] = None,
+) -> ThreadingHTTPServer:
+    """在后台线程启动服务并返回 server（port=0 时自动分配端口，见 server.server_port）"""
+    store = FixtureStore(fixtures_path)
+    server = ThreadingHTTPServer((host, port), make_handler(store, profile or FaultProfile(), MockStats()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    cfg = load_api_config("mock_server")
+    parser = argparse.ArgumentParser(description="本地 GLM-4V 替身服务（离线压测用）")
+    parser.add_argument("--host", default=cfg.get("host", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(cfg.get("port", 8765)))
+    parser.add_argument("--fixtures", default=cfg.get("fixtures", DEFAULT_FIXTURES), help="录制结果文件")
+    parser.add_argument("--latency-median", type=float, default=float(cfg.get("latency_median_seconds", 1.0)), help="响应延迟中位数（秒）")
+    parser.add_argument("--latency-sigma", type=float, default=float(cfg.get("latency_sigma", 0.5)), help="对数正态分布的 sigma，越大长尾越明显")
+    parser.add_argument("--error-rate", type=float, default=float(cfg.get("error_rate", 0.0)), help="返回 500 的概率")
+    parser.add_argument("--burst-every", type=float, default=float(cfg.get("burst_every_seconds", 0.0)), help="每隔多少秒出现一次 429 突发（0 表示关闭）")
+    parser.add_argument("--burst-length", type=float, default=float(cfg.get("burst_length_seconds", 0.0)), help="每次 429 突发持续的秒数")
+    parser.add_argument("--retry-after", type=float, default=float(cfg.get("retry_after_seconds", 1.0)), help="429 响应中的 Retry-After 秒数")
+    parser.add_argument("--chunk-interval", type=float, default=float(cfg.get("chunk_interval_seconds", 0.02)), help="流式响应的分片间隔（秒）")
+    parser.add_argument("--trailing-chars", type=int, default=int(cfg.get("trailing_chars", 0)), help="流式响应在 JSON 之后附加的说明文字长度")
+    parser.add_argument("--garble-rate", type=float, default=float(cfg.get("garble_rate", 0.0)), help="不使用 JSON 模式时回复被改写为不规范格式的概率")
+    args = parser.parse_args()
+
+    profile = FaultProfile(
+        latency_median=args.latency_median,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        burst_every=args.burst_every,
+        burst_length=args.burst_length,
+        retry_after=args.retry_after,
+        chunk_interval=args.chunk_interval,
+        trailing_chars=args.trailing_chars,
+        garble_rate=args.garble_rate,
+    )
+    server = start_server(args.host, args.port, args.fixtures, profile)
+    print(f"GLM-4V 替身服务已启动：http://{args.host}:{server.server_port}{API_PATH}")
+    print(f"请求统计：http://{args.host}:{server.server_port}/stats ，按 Ctrl+C 停止")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
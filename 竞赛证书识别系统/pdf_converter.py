@@ -5,8 +5,13 @@ PDF to image utilities.
 from __future__ import annotations
 
 import io
+import math
 import os
-from typing import List, Optional
+import re
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
 
 from PIL import Image
 
@@ -29,36 +34,242 @@ except ImportError:
 # On Windows, install Poppler and set POPPLER_PATH or pass poppler_path explicitly.
 POPPLER_PATH = os.environ.get("POPPLER_PATH")
 
+# 裁剪区域 (x0, y0, x1, y1)，单位为 PDF 点（1/72 英寸），原点在页面左上角
+ClipRect = Tuple[float, float, float, float]
+# 像素通道数 -> PIL 模式（渲染时不带 alpha 通道）
+PIXMAP_MODES = {1: "L", 3: "RGB", 4: "CMYK"}
+# 无法读取页面尺寸时按 A4 估算（点）
+A4_POINTS = (595.0, 842.0)
+# 每个进程中同时驻留的页面位图总大小上限，多个用户同时上传大 PDF 时渲染排队而不是耗尽内存
+RENDER_BUDGET_MB = int(os.environ.get("PDF_RENDER_BUDGET_MB", "256"))
+
+
+class MemoryBudget:
+    """
+    进程内页面位图的内存预算：渲染前按估算的字节数预留，位图用完后释放；
+    预算不足时等待其他页面释放。单页超过整个预算时等到预算空闲后独占渲染。
+    """
+
+    def __init__(self, limit_bytes: int):
+        self.limit = limit_bytes
+        self.used = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def reserve(self, nbytes: int) -> Iterator[None]:
+        nbytes = min(max(0, nbytes), self.limit)
+        with self._cond:
+            while self.used and self.used + nbytes > self.limit:
+                self._cond.wait()
+            self.used += nbytes
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.used -= nbytes
+                self._cond.notify_all()
+
+
+render_budget = MemoryBudget(RENDER_BUDGET_MB * 1024 * 1024)
+
+
+def render_zoom(width: float, height: float, dpi: int = 200, max_side: Optional[int] = None) -> float:
+    """页面（或裁剪区域）尺寸为 width×height 点时的缩放倍数：按 dpi 渲染，指定 max_side 时最长边不超过它"""
+    zoom = dpi / 72.0  # 72 是默认 DPI
+    if max_side:
+        zoom = min(zoom, max_side / max(width, height, 1.0))
+    return zoom
+
+
+def _pixmap_to_image(pix) -> Image.Image:
+    """直接用像素数据构造 PIL 图片，不经过 PNG 编码和解码"""
+    mode = PIXMAP_MODES.get(pix.n)
+    if mode is None:
+        return Image.open(io.BytesIO(pix.tobytes("png")))
+    return Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+
+
+def _render_pymupdf_page(page, dpi: int = 200, max_side: Optional[int] = None, clip: Optional[ClipRect] = None) -> Image.Image:
+    rect = fitz.Rect(clip) if clip else page.rect
+    zoom = render_zoom(rect.width, rect.height, dpi, max_side)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=rect if clip else None, alpha=False)
+    return _pixmap_to_image(pix)
+
+
+def _render_pdf2image_page(
+    pdf_path: str,
+    page_index: int = 0,
+    dpi: int = 200,
+    max_side: Optional[int] = None,
+    clip: Optional[ClipRect] = None,
+    poppler_path: Optional[str] = POPPLER_PATH,
+) -> Image.Image:
+    """pdf2image 只渲染指定的一页，再按 clip 裁剪、按 max_side 缩小"""
+    images = convert_from_path(
+        pdf_path, dpi=dpi, poppler_path=poppler_path, first_page=page_index + 1, last_page=page_index + 1
+    )
+    if not images:
+        raise ValueError("无法从 PDF 转出图片")
+    img = images[0]
+    if clip:
+        scale = dpi / 72.0
+        img = img.crop(tuple(int(round(v * scale)) for v in clip))
+    if max_side and max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+    return img
+
+
+def _page_points(
+    pdf_path: str,
+    page_index: int = 0,
+    doc=None,
+    poppler_path: Optional[str] = POPPLER_PATH,
+) -> Tuple[float, float]:
+    """页面尺寸（点）；PyMuPDF 不可用时读取 pdfinfo 的 Page size，都取不到时按 A4"""
+    try:
+        if doc is not None:
+            rect = doc[page_index].rect
+            return rect.width, rect.height
+        if PYMUPDF_AVAILABLE:
+            with fitz.open(pdf_path) as opened:
+                rect = opened[page_index].rect
+                return rect.width, rect.height
+        if PDF2IMAGE_AVAILABLE:
+            from pdf2image import pdfinfo_from_path
+            info = pdfinfo_from_path(pdf_path, poppler_path=poppler_path)
+            match = re.match(r"\s*([\d.]+)\s*x\s*([\d.]+)", str(info.get("Page size", "")))
+            if match:
+                return float(match.group(1)), float(match.group(2))
+    except Exception:
+        pass
+    return A4_POINTS
+
+
+def estimate_render_bytes(
+    width: float,
+    height: float,
+    dpi: int = 200,
+    max_side: Optional[int] = None,
+    clip: Optional[ClipRect] = None,
+) -> int:
+    """按页面尺寸（点）估算渲染出的 RGB 位图字节数"""
+    if clip:
+        width, height = clip[2] - clip[0], clip[3] - clip[1]
+    zoom = render_zoom(width, height, dpi, max_side)
+    return math.ceil(width * zoom) * math.ceil(height * zoom) * 3
+
+
+@contextmanager
+def rendered_page(
+    pdf_path: str,
+    page_index: int = 0,
+    dpi: int = 200,
+    max_side: Optional[int] = None,
+    clip: Optional[ClipRect] = None,
+    poppler_path: Optional[str] = POPPLER_PATH,
+    doc=None,
+) -> Iterator[Image.Image]:
+    """
+    在 render_budget 中预留内存后渲染一页，with 块结束时释放预留；
+    doc 为已打开的 PyMuPDF 文档时直接使用（逐页迭代时避免反复打开文件）。
+    """
+    if doc is None and not PYMUPDF_AVAILABLE and not PDF2IMAGE_AVAILABLE:
+        raise ImportError("PDF转换库未安装。请安装 PyMuPDF: pip install PyMuPDF")
+    width, height = _page_points(pdf_path, page_index, doc, poppler_path)
+    # pdf2image 先按 dpi 渲染整页再缩小，峰值按整页估算
+    uses_pymupdf = doc is not None or PYMUPDF_AVAILABLE
+    nbytes = estimate_render_bytes(width, height, dpi, max_side if uses_pymupdf else None, clip)
+    with render_budget.reserve(nbytes):
+        if doc is not None:
+            img = _render_pymupdf_page(doc[page_index], dpi, max_side, clip)
+        else:
+            img = render_page(pdf_path, page_index, dpi, max_side, clip, poppler_path)
+        yield img
+
+
+def render_page(
+    pdf_path: str,
+    page_index: int = 0,
+    dpi: int = 200,
+    max_side: Optional[int] = None,
+    clip: Optional[ClipRect] = None,
+    poppler_path: Optional[str] = POPPLER_PATH,
+) -> Image.Image:
+    """
+    把 PDF 的第 page_index 页（从 0 开始）渲染为 PIL 图片，只渲染需要的分辨率。
+    max_side 限制最长边的像素数（不会超过 dpi 对应的尺寸），clip 只渲染页面的一部分。
+    PyMuPDF 直接按目标尺寸计算缩放矩阵并读取像素数据；pdf2image 只渲染该页，再缩放和裁剪。
+    不经过 render_budget；需要限制内存时使用 rendered_page 或 iter_pdf_pages。
+    """
+    if PYMUPDF_AVAILABLE:
+        doc = fitz.open(pdf_path)
+        try:
+            if page_index >= len(doc):
+                raise ValueError(f"PDF 只有 {len(doc)} 页")
+            return _render_pymupdf_page(doc[page_index], dpi, max_side, clip)
+        finally:
+            doc.close()
+    if PDF2IMAGE_AVAILABLE:
+        return _render_pdf2image_page(pdf_path, page_index, dpi, max_side, clip, poppler_path)
+    raise ImportError("PDF转换库未安装。请安装 PyMuPDF: pip install PyMuPDF")
+
+
+def _iter_pymupdf_pages(pdf_path: str, dpi: int = 200, max_side: Optional[int] = None) -> Iterator[Image.Image]:
+    doc = fitz.open(pdf_path)
+    try:
+        for page_index in range(len(doc)):
+            with rendered_page(pdf_path, page_index, dpi, max_side, doc=doc) as img:
+                yield img
+    finally:
+        doc.close()
+
+
+def _iter_pdf2image_pages(
+    pdf_path: str,
+    dpi: int = 200,
+    max_side: Optional[int] = None,
+    poppler_path: Optional[str] = POPPLER_PATH,
+) -> Iterator[Image.Image]:
+    """pdf2image 逐页调用 convert_from_path(first_page=last_page=页码)，不一次转换整份文件"""
+    from pdf2image import pdfinfo_from_path
+
+    page_count = int(pdfinfo_from_path(pdf_path, poppler_path=poppler_path)["Pages"])
+    width, height = _page_points(pdf_path, 0, poppler_path=poppler_path)
+    for page_index in range(page_count):
+        with render_budget.reserve(estimate_render_bytes(width, height, dpi)):
+            yield _render_pdf2image_page(pdf_path, page_index, dpi, max_side, None, poppler_path)
+
+
+def iter_pdf_pages(
+    pdf_path: str,
+    dpi: int = 200,
+    max_side: Optional[int] = None,
+    poppler_path: Optional[str] = POPPLER_PATH,
+) -> Iterator[Image.Image]:
+    """
+    逐页渲染 PDF 并依次产出 PIL 图片，优先使用 PyMuPDF。
+    每页渲染前在 render_budget 中预留内存，调用方取下一页（或关闭生成器）时释放，
+    因此调用方处理完一页后不要继续持有该图片，驻留的位图才会受预算约束。
+    """
+    if PYMUPDF_AVAILABLE:
+        return _iter_pymupdf_pages(pdf_path, dpi, max_side)
+    if PDF2IMAGE_AVAILABLE:
+        return _iter_pdf2image_pages(pdf_path, dpi, max_side, poppler_path)
+    raise ImportError("PDF转换库未安装。请安装 PyMuPDF: pip install PyMuPDF")
+
 
 def pdf_to_images_pymupdf(pdf_path: str, dpi: int = 200) -> List[Image.Image]:
-    """使用 PyMuPDF 将 PDF 转换为图片列表（推荐方法，无需外部依赖）"""
+    """使用 PyMuPDF 将 PDF 转换为图片列表（推荐方法，无需外部依赖）；页数多时请用 iter_pdf_pages 逐页处理"""
     if not PYMUPDF_AVAILABLE:
         raise ImportError("PyMuPDF 未安装，请运行: pip install PyMuPDF")
-    
-    doc = fitz.open(pdf_path)
-    images = []
-    
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        # 计算缩放因子以匹配 DPI
-        zoom = dpi / 72.0  # 72 是默认 DPI
-        mat = fitz.Matrix(zoom, zoom)
-        pix = page.get_pixmap(matrix=mat)
-        
-        # 转换为 PIL Image
-        img_data = pix.tobytes("png")
-        img = Image.open(io.BytesIO(img_data))
-        images.append(img)
-    
-    doc.close()
-    return images
+    return list(_iter_pymupdf_pages(pdf_path, dpi))
 
 
 def pdf_to_images_pdf2image(pdf_path: str, poppler_path: Optional[str] = POPPLER_PATH, dpi: int = 200) -> List[Image.Image]:
-    """使用 pdf2image 将 PDF 转换为图片列表（需要 Poppler）"""
+    """使用 pdf2image 将 PDF 转换为图片列表（需要 Poppler），逐页转换"""
     if not PDF2IMAGE_AVAILABLE:
         raise ImportError("pdf2image 未安装，请运行: pip install pdf2image")
-    return convert_from_path(pdf_path, dpi=dpi, poppler_path=poppler_path)
+    return list(_iter_pdf2image_pages(pdf_path, dpi, poppler_path=poppler_path))
 
 
 def pdf_to_images(pdf_path: str, poppler_path: Optional[str] = POPPLER_PATH, dpi: int = 200) -> List[Image.Image]:
@@ -92,58 +303,110 @@ def pdf_to_images(pdf_path: str, poppler_path: Optional[str] = POPPLER_PATH, dpi
     )
 
 
-def save_first_page_image(pdf_path: str, output_path: str, poppler_path: Optional[str] = POPPLER_PATH) -> str:
+def page_image_path(pdf_path: str, page_index: int) -> str:
     """
-    保存 PDF 第一页为图片
-    优先使用 PyMuPDF（无需外部依赖）
+    第 page_index 页（从 0 开始）的渲染图路径。识别任务、按页识别和上传页面的预览共用这张图，
+    同一页只渲染一次。
     """
-    import io
-    
+    return f"{pdf_path}.page{page_index + 1}.png"
+
+
+def get_page_count(pdf_path: str) -> int:
+    """返回 PDF 页数（只读取文档结构，不渲染页面）"""
+    if PYMUPDF_AVAILABLE:
+        doc = fitz.open(pdf_path)
+        try:
+            return len(doc)
+        finally:
+            doc.close()
+    if PDF2IMAGE_AVAILABLE:
+        from pdf2image import pdfinfo_from_path
+        return int(pdfinfo_from_path(pdf_path, poppler_path=POPPLER_PATH)["Pages"])
+    raise ImportError("PDF转换库未安装。请安装 PyMuPDF: pip install PyMuPDF")
+
+
+def save_page_image(
+    pdf_path: str,
+    page_index: int,
+    output_path: str,
+    dpi: int = 200,
+    poppler_path: Optional[str] = POPPLER_PATH,
+    max_side: Optional[int] = None,
+) -> str:
+    """
+    只渲染 PDF 的第 page_index 页（从 0 开始）并保存为 PNG；max_side 限制最长边（见 render_page）。
+    为模块级函数，可直接提交到进程池并行渲染多页。
+    """
+    with rendered_page(pdf_path, page_index, dpi=dpi, max_side=max_side, poppler_path=poppler_path) as img:
+        _save_png(img, output_path)
+    return output_path
+
+
+def _save_png(img: Image.Image, output_path: str) -> None:
+    """
+    保存渲染图：先写入同目录的临时文件再改名，其他线程或进程看到 output_path 时文件总是完整的
+    （预览、识别任务和派生图缓存会读取同一张渲染图）。渲染图只是中间文件，用最快的压缩级别。
+    """
+    fd, tmp_path = tempfile.mkstemp(prefix=".render-", suffix=".png", dir=os.path.dirname(output_path) or ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            img.save(f, format="PNG", compress_level=1)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def save_first_page_image(
+    pdf_path: str,
+    output_path: str,
+    poppler_path: Optional[str] = POPPLER_PATH,
+    max_side: Optional[int] = None,
+) -> str:
+    """
+    保存 PDF 第一页为图片（200 DPI，max_side 限制最长边）
+    优先使用 PyMuPDF（无需外部依赖）；渲染和保存期间占用 render_budget
+    """
+    with render_budget.reserve(estimate_render_bytes(*_page_points(pdf_path, 0, poppler_path=poppler_path))):
+        return _save_first_page_image(pdf_path, output_path, poppler_path, max_side)
+
+
+def _save_first_page_image(
+    pdf_path: str,
+    output_path: str,
+    poppler_path: Optional[str] = POPPLER_PATH,
+    max_side: Optional[int] = None,
+) -> str:
     # 优先尝试 PyMuPDF
     if PYMUPDF_AVAILABLE:
         try:
             doc = fitz.open(pdf_path)
-            if len(doc) == 0:
+            try:
+                if len(doc) == 0:
+                    raise ValueError("PDF 文件为空")
+                img = _render_pymupdf_page(doc[0], max_side=max_side)
+            finally:
                 doc.close()
-                raise ValueError("PDF 文件为空")
-            
-            page = doc[0]
-            # 使用 200 DPI 的缩放因子
-            zoom = 200 / 72.0
-            mat = fitz.Matrix(zoom, zoom)
-            pix = page.get_pixmap(matrix=mat)
-            
-            # 保存为 PNG
-            pix.save(output_path)
-            doc.close()
-            return output_path
         except Exception as e:
             # PyMuPDF 失败，尝试 pdf2image
-            if PDF2IMAGE_AVAILABLE:
-                try:
-                    images = pdf_to_images_pdf2image(pdf_path, poppler_path=poppler_path)
-                    if not images:
-                        raise ValueError("无法从 PDF 转出图片")
-                    images[0].save(output_path, format="PNG")
-                    return output_path
-                except Exception:
-                    raise RuntimeError(f"PDF转换失败。PyMuPDF错误: {e}，pdf2image也失败")
-            else:
+            if not PDF2IMAGE_AVAILABLE:
                 raise RuntimeError(f"PyMuPDF转换失败: {e}，且pdf2image未安装")
-    
-    # 如果没有 PyMuPDF，使用 pdf2image
-    if PDF2IMAGE_AVAILABLE:
-        images = pdf_to_images_pdf2image(pdf_path, poppler_path=poppler_path)
-        if not images:
-            raise ValueError("无法从 PDF 转出图片")
-        images[0].save(output_path, format="PNG")
-        return output_path
-    
-    # 两者都不可用
-    raise ImportError(
-        "PDF转换库未安装。请安装其中一个：\n"
-        "  - PyMuPDF (推荐): pip install PyMuPDF\n"
-        "  - pdf2image: pip install pdf2image (还需要安装 Poppler)"
-    )
-
-
+            try:
+                img = _render_pdf2image_page(pdf_path, max_side=max_side, poppler_path=poppler_path)
+            except Exception:
+                raise RuntimeError(f"PDF转换失败。PyMuPDF错误: {e}，pdf2image也失败")
+    elif PDF2IMAGE_AVAILABLE:
+        # 如果没有 PyMuPDF，使用 pdf2image
+        img = _render_pdf2image_page(pdf_path, max_side=max_side, poppler_path=poppler_path)
+    else:
+        # 两者都不可用
+        raise ImportError(
+            "PDF转换库未安装。请安装其中一个：\n"
+            "  - PyMuPDF (推荐): pip install PyMuPDF\n"
+            "  - pdf2image: pip install pdf2image (还需要安装 Poppler)"
+        )
+    _save_png(img, output_path)
+    return output_path
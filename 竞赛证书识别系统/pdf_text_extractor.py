@@ -0,0 +1,188 @@
+"""
+PDF 文本层识别：直接读取电子版 PDF 证书的文字和位置，按规则映射到证书字段
+电子版证书无需渲染图片、也无需调用视觉模型，毫秒级完成
+"""
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from pdf_converter import PYMUPDF_AVAILABLE, fitz
+
+# 标签 -> 字段；较长的标签放在前面，避免“姓名”抢先匹配“学生姓名”
+FIELD_LABELS: List[Tuple[str, str]] = [
+    ("学生姓名", "student_name"),
+    ("获奖学生", "student_name"),
+    ("姓名", "student_name"),
+    ("学号", "student_id"),
+    ("所在学院", "department"),
+    ("学院", "department"),
+    ("院系", "department"),
+    ("竞赛项目", "competition_name"),
+    ("竞赛名称", "competition_name"),
+    ("比赛项目", "competition_name"),
+    ("获奖类别", "award_category"),
+    ("获奖级别", "award_category"),
+    ("获奖等级", "award_level"),
+    ("奖项", "award_level"),
+    ("竞赛类型", "competition_type"),
+    ("主办单位", "organizer"),
+    ("主办方", "organizer"),
+    ("获奖时间", "award_date"),
+    ("获奖日期", "award_date"),
+    ("颁发日期", "award_date"),
+    ("指导教师", "advisor"),
+    ("指导老师", "advisor"),
+]
+
+PRIZE_LEVELS = ["特等奖", "一等奖", "二等奖", "三等奖", "金奖", "银奖", "铜奖", "优秀奖"]
+STUDENT_ID_RE = re.compile(r"(?<!\d)\d{13}(?!\d)")
+DATE_RE = re.compile(r"(20\d{2}|19\d{2})\s*[年\-/.]\s*(\d{1,2})")
+COMPETITION_RE = re.compile(r"(竞赛|大赛|挑战赛|比赛|锦标赛)")
+ORGANIZER_SUFFIXES = ("组委会", "委员会", "协会", "学会", "中心", "教育厅", "教育部", "基金会")
+LABEL_SEPARATORS = "：:　 "
+
+# 同一行的判定：两个文字片段的垂直中心相差不超过字号的一半
+LINE_TOLERANCE = 0.5
+
+
+def _page_lines(page) -> List[Dict[str, Any]]:
+    """把 PyMuPDF 的 span 按位置重新拼成阅读顺序的行：[{text, size, y}]"""
+    spans = []
+    for block in page.get_text("dict").get("blocks", []):
+        for line in block.get("lines", []):
+            for span in line.get("spans", []):
+                text = span.get("text", "").strip()
+                if not text:
+                    continue
+                x0, y0, x1, y1 = span["bbox"]
+                spans.append({"text": text, "x": x0, "y": (y0 + y1) / 2, "size": span.get("size", 0)})
+    spans.sort(key=lambda s: (s["y"], s["x"]))
+
+    lines: List[List[Dict[str, Any]]] = []
+    for span in spans:
+        if lines and abs(lines[-1][0]["y"] - span["y"]) <= LINE_TOLERANCE * max(span["size"], 1):
+            lines[-1].append(span)
+        else:
+            lines.append([span])
+    result = []
+    for line in lines:
+        line.sort(key=lambda s: s["x"])
+        result.append(
+            {
+                "text": "".join(s["text"] for s in line),
+                "size": max(s["size"] for s in line),
+                "y": line[0]["y"],
+            }
+        )
+    return result
+
+
+def _normalize_date(text: str) -> str:
+    match = DATE_RE.search(text)
+    if not match:
+        return ""
+    return f"{int(match.group(1)):04d}-{int(match.group(2)):02d}"
+
+
+def _match_label(text: str) -> Optional[Tuple[str, str]]:
+    """行首是已知标签时返回 (字段, 值)"""
+    for label, field in FIELD_LABELS:
+        if text.startswith(label):
+            rest = text[len(label):]
+            if rest and rest[0] not in LABEL_SEPARATORS:
+                continue
+            return field, rest.lstrip(LABEL_SEPARATORS).strip()
+    return None
+
+
+def extract_fields_from_text(lines: List[Dict[str, Any]]) -> Dict[str, str]:
+    """对已排好序的文本行应用字段规则"""
+    fields: Dict[str, str] = {}
+
+    # 1. 显式标签：“学号：2023…”；标签单独成行时取下一行作为值
+    for index, line in enumerate(lines):
+        matched = _match_label(line["text"])
+        if not matched:
+            continue
+        field, value = matched
+        if not value and index + 1 < len(lines) and not _match_label(lines[index + 1]["text"]):
+            value = lines[index + 1]["text"]
+        if value and not fields.get(field):
+            fields[field] = value
+
+    full_text = "\n".join(line["text"] for line in lines)
+
+    # 2. 无标签时的兜底规则
+    if not fields.get("student_id"):
+        match = STUDENT_ID_RE.search(full_text)
+        if match:
+            fields["student_id"] = match.group(0)
+    else:
+        match = STUDENT_ID_RE.search(fields["student_id"])
+        fields["student_id"] = match.group(0) if match else fields["student_id"]
+
+    level_source = fields.get("award_level") or full_text
+    for level in PRIZE_LEVELS:
+        if level in level_source:
+            fields["award_level"] = level
+            break
+
+    if not fields.get("competition_name"):
+        candidates = [line for line in lines if COMPETITION_RE.search(line["text"]) and not _match_label(line["text"])]
+        if candidates:
+            fields["competition_name"] = max(candidates, key=lambda line: line["size"])["text"]
+
+    if not fields.get("organizer"):
+        # 落款一般在证书底部，从下往上找
+        for line in reversed(lines):
+            if line["text"].endswith(ORGANIZER_SUFFIXES):
+                fields["organizer"] = line["text"]
+                break
+
+    if fields.get("award_date"):
+        fields["award_date"] = _normalize_date(fields["award_date"]) or fields["award_date"]
+    else:
+        # 同样优先取底部落款处的日期
+        for line in reversed(lines):
+            date = _normalize_date(line["text"])
+            if date:
+                fields["award_date"] = date
+                break
+
+    if not fields.get("award_category"):
+        scope = fields.get("competition_name", "") + fields.get("award_level", "") + full_text
+        if "国家级" in scope or "全国" in scope:
+            fields["award_category"] = "国家级"
+        elif "省级" in scope or "省" in fields.get("competition_name", ""):
+            fields["award_category"] = "省级"
+
+    return {k: v for k, v in fields.items() if v}
+
+
+def extract_from_pdf_text(pdf_path: str, page_index: int = 0) -> Optional[Dict[str, Any]]:
+    """
+    读取 PDF 指定页的文本层并提取字段。
+    扫描件（没有文本层）或 PyMuPDF 不可用时返回 None，由调用方改用视觉模型。
+    """
+    if not PYMUPDF_AVAILABLE:
+        return None
+    try:
+        doc = fitz.open(pdf_path)
+    except Exception:
+        return None
+    try:
+        if page_index >= len(doc):
+            return None
+        lines = _page_lines(doc[page_index])
+    finally:
+        doc.close()
+    if not lines:
+        return None
+
+    fields = extract_fields_from_text(lines)
+    if not fields:
+        return None
+    fields["extraction_method"] = "pdf_text"
+    fields["extraction_confidence"] = 0.95
+    return fields
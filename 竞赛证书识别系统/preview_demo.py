@@ -6,13 +6,16 @@ import os
 import tempfile
 
 import streamlit as st
-from PIL import Image
 
-from pdf_converter import save_first_page_image
-from image_processor import rotate_image, resize_image, image_to_base64
+from raster_service import get_raster_service
+from image_processor import open_image, rotate_image, resize_image, image_to_base64
 from file_validator import is_allowed_extension
+from glm4v_api import DERIVATIVES_ENABLED, IMAGE_MAX_SIDE, derivative_store
+from image_derivatives import PREVIEW
 
 
+MAX_WIDTH_LIMIT = 1600
+
 st.set_page_config(page_title="证书预览演示", layout="wide")
 st.title("证书预览与图片处理演示")
 
@@ -50,7 +53,8 @@ if uploaded:
             st.markdown("### 🔄 PDF转图片")
             image_path = os.path.join(tmpdir, "preview.png")
             try:
-                image_path = save_first_page_image(src_path, image_path)
+                # 在栅格化服务的常驻进程中渲染，页面进程不承担 PDF 渲染
+                image_path = get_raster_service().render(src_path, 0, image_path, max_side=IMAGE_MAX_SIDE)
                 st.success("✅ PDF转图片成功")
             except Exception as e:
                 st.error(f"❌ PDF转图片失败: {e}")
@@ -58,11 +62,24 @@ if uploaded:
         else:
             image_path = src_path
 
-        # 加载图片
+        # 加载图片：派生图缓存可用时，预览、旋转缩放和尺寸信息都使用缓存中的预览图（宽 PREVIEW.max_size），
+        # 滑块调整引起的重跑只解码这张小图，不再解码原图
         try:
-            img = Image.open(image_path)
             st.markdown("### 🖼️ 原始图片预览")
-            st.image(img, caption="原始图片", use_container_width=True)
+            if DERIVATIVES_ENABLED:
+                meta = derivative_store.ensure(image_path)
+                preview_path = derivative_store.path(image_path, "preview")
+                img = open_image(preview_path)
+                original_size = (meta["width"], meta["height"])
+                width_limit = PREVIEW.max_size
+                st.image(preview_path, caption="原始图片", use_container_width=True)
+            else:
+                meta = None
+                # 按滑块的最大宽度解码（大照片不展开到原始分辨率），并按 EXIF 方向摆正
+                img = open_image(image_path, max_width=MAX_WIDTH_LIMIT)
+                original_size = img.info.get("original_size", img.size)
+                width_limit = MAX_WIDTH_LIMIT
+                st.image(img, caption="原始图片", use_container_width=True)
         except Exception as e:
             st.error(f"❌ 图片加载失败: {e}")
             st.stop()
@@ -73,7 +90,7 @@ if uploaded:
         with col_control1:
             rotate_deg = st.slider("旋转角度", -180, 180, 0, step=5)
         with col_control2:
-            max_w = st.slider("最大宽度 (像素)", 400, 1600, 1000, step=50)
+            max_w = st.slider("最大宽度 (像素)", min(400, width_limit // 2), width_limit, min(1000, width_limit), step=50)
 
         # 处理图片
         processed = rotate_image(img, rotate_deg)
@@ -105,10 +122,14 @@ if uploaded:
         st.markdown("### 📊 处理信息")
         col_info3, col_info4, col_info5 = st.columns(3)
         with col_info3:
-            st.metric("原始尺寸", f"{img.width} × {img.height}")
+            original_width, original_height = original_size
+            st.metric("原始尺寸", f"{original_width} × {original_height}")
         with col_info4:
             st.metric("处理后尺寸", f"{processed.width} × {processed.height}")
         with col_info5:
             st.metric("Base64大小", f"{len(b64) / 1024:.1f} KB")
+        if meta is not None:
+            api = meta["renditions"]["api"]
+            st.caption(f"实际送模型的图片（{api['mime']}）：{api['bytes'] / 1024:.1f} KB，取自派生图缓存")
 
 
@@ -0,0 +1,145 @@
+"""
+PDF 栅格化服务：在常驻的进程池中渲染 PDF 页面，绕开 GIL，批量转换可以用满所有 CPU 核心。
+任务为 (PDF 路径, 页码, 输出路径, 目标尺寸)，结果直接写成 PNG 文件，进程之间只传递路径，不传位图。
+按页识别、预览演示页和批量转换（python complete_system.py --rasterize DIR）共用同一个进程池。
+"""
+from __future__ import annotations
+
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterator, Optional, Tuple, Union
+
+from glm4v_api import load_api_config
+from pdf_converter import get_page_count, page_image_path, save_page_image
+
+_raster_config = load_api_config("raster")
+# 工作进程数；0 表示与 CPU 核心数相同
+RASTER_WORKERS = int(_raster_config.get("workers", 0)) or (os.cpu_count() or 1)
+RASTER_DPI = int(_raster_config.get("dpi", 200))
+
+
+def _warm_worker() -> None:
+    """工作进程启动时预先加载渲染库，第一个任务不再承担导入开销"""
+    import pdf_converter  # noqa: F401
+
+
+class RasterService:
+    """
+    常驻进程池。工作进程用 spawn 方式启动（Streamlit 和 worker 进程里有其他线程，fork 可能复制到被占用的锁），
+    首次提交任务时创建；某个工作进程异常退出导致进程池损坏时，下一次提交会重建进程池。
+    每个工作进程各有一份 pdf_converter.render_budget，同时驻留的位图总量约为 workers × 预算。
+    """
+
+    def __init__(self, workers: int = RASTER_WORKERS, dpi: int = RASTER_DPI):
+        self.workers = max(1, workers)
+        self.dpi = dpi
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _executor(self, rebuild: bool = False) -> ProcessPoolExecutor:
+        with self._lock:
+            if rebuild and self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_warm_worker,
+                )
+            return self._pool
+
+    def submit(
+        self,
+        pdf_path: str,
+        page_index: int,
+        output_path: str,
+        max_side: Optional[int] = None,
+        dpi: Optional[int] = None,
+    ) -> Future:
+        """提交一页的渲染任务，Future 的结果为写好的 PNG 路径；max_side 限制最长边（见 pdf_converter.render_page）"""
+        # 任务函数直接取自 pdf_converter，工作进程只需导入渲染模块
+        args = (save_page_image, pdf_path, page_index, output_path, dpi or self.dpi)
+        try:
+            return self._executor().submit(*args, max_side=max_side)
+        except BrokenProcessPool:
+            return self._executor(rebuild=True).submit(*args, max_side=max_side)
+
+    def render(
+        self,
+        pdf_path: str,
+        page_index: int,
+        output_path: str,
+        max_side: Optional[int] = None,
+        dpi: Optional[int] = None,
+    ) -> str:
+        """渲染一页并等待完成，返回 PNG 路径"""
+        return self.submit(pdf_path, page_index, output_path, max_side=max_side, dpi=dpi).result()
+
+    def convert_directory(
+        self,
+        input_dir: str,
+        output_dir: Optional[str] = None,
+        max_side: Optional[int] = None,
+        dpi: Optional[int] = None,
+    ) -> Iterator[Tuple[str, int, Union[str, Exception]]]:
+        """
+        将目录中所有 PDF 的每一页渲染为 <PDF 文件名>.page<页码>.png，所有页面一起提交到进程池，
+        按完成顺序产出 (PDF 路径, 页码(从1开始), PNG 路径或异常)。
+        output_dir 缺省时写在 PDF 旁边，文件名与按页识别使用的渲染图相同（见 pdf_converter.page_image_path），
+        可以预先为已上传的 PDF 生成渲染图。
+        """
+        output_dir = output_dir or input_dir
+        os.makedirs(output_dir, exist_ok=True)
+        pdf_paths = sorted(
+            os.path.join(input_dir, name) for name in os.listdir(input_dir) if name.lower().endswith(".pdf")
+        )
+        tasks = {}
+        for pdf_path in pdf_paths:
+            try:
+                page_count = get_page_count(pdf_path)
+            except Exception as exc:  # noqa: BLE001
+                yield pdf_path, 0, exc
+                continue
+            for page_index in range(page_count):
+                output_path = os.path.join(output_dir, os.path.basename(page_image_path(pdf_path, page_index)))
+                future = self.submit(pdf_path, page_index, output_path, max_side=max_side, dpi=dpi)
+                tasks[future] = (pdf_path, page_index + 1)
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pdf_path, page_number = tasks[future]
+                    try:
+                        yield pdf_path, page_number, future.result()
+                    except Exception as exc:  # noqa: BLE001
+                        yield pdf_path, page_number, exc
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+
+_service: Optional[RasterService] = None
+_service_lock = threading.Lock()
+
+
+def get_raster_service() -> RasterService:
+    """进程内共享的栅格化服务；Streamlit 页面重跑之间保持同一个进程池"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = RasterService()
+            atexit.register(_service.shutdown)
+        return _service
+
@@ -0,0 +1,61 @@
+"""
+测试脚本共用的隔离环境：数据库、限流状态、上传目录和派生图缓存都使用相对当前目录的路径
+（data/app.db、data/api_guard.db、uploads/、data/derivatives/），
+测试在临时目录中运行，不读写仓库中的数据。必须在导入项目模块之前进入。
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import contextmanager
+from typing import Iterator
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+# 临时目录中需要的配置文件（.env 不复制，测试不会使用真实的 API Key）
+CONFIG_FILES = ("api_config.json",)
+# 只读的素材目录以符号链接放入临时目录（替身服务的 fixture 按相对路径引用示例证书）
+ASSET_DIRS = ("sample_certificates", "test_files")
+
+
+def project_path(*parts: str) -> str:
+    """仓库中文件的绝对路径（测试图片、app.py 等）"""
+    return os.path.join(PROJECT_DIR, *parts)
+
+
+@contextmanager
+def isolated_workdir() -> Iterator[str]:
+    """在临时目录中运行测试，结束后恢复当前目录并删除临时目录；返回临时目录路径"""
+    previous = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="cert-test-")
+    for name in CONFIG_FILES:
+        shutil.copy(project_path(name), workdir)
+    for name in ASSET_DIRS:
+        os.symlink(project_path(name), os.path.join(workdir, name))
+    if PROJECT_DIR not in sys.path:
+        sys.path.insert(0, PROJECT_DIR)
+    os.environ.pop("GLM4V_API_KEY", None)
+    os.chdir(workdir)
+    try:
+        yield workdir
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def create_student():
+    """取一个学生账号（没有时创建），在 isolated_workdir 中调用"""
+    from sqlmodel import select
+
+    from database import User, get_session, init_db
+
+    init_db()
+    with get_session() as session:
+        user = session.exec(select(User).where(User.role == "student")).first()
+        if user is None:
+            user = User(account_id="2099000001", name="测试学生", role="student", email="2099000001@test.local", password_hash="-")
+            session.add(user)
+            session.commit()
+            session.refresh(user)
+        return user
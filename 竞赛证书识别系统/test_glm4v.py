@@ -27,7 +27,7 @@ def main():
     # 测试连接
     print("\n测试API连接...")
     if test_api_connection(api_key):
-        print("✓ API连接测试通过（基础检查）")
+        print("✓ API连接测试通过（已收到接口响应）")
     else:
         print("✗ API连接测试失败")
     
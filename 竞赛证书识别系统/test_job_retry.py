@@ -0,0 +1,130 @@
+"""
+测试后台识别任务的重试与租约：
+- 本地替身服务对所有请求返回 500，任务应重新排队并在重试时间之前不可领取，达到 max_attempts 后记为失败；
+  页面使用的 poll_job 只查询状态，不在调用线程中执行识别
+- 识别耗时超过一个租约时执行中会续租，任务不会被重新领取；租约被他人接管时结果被丢弃
+数据库、识别缓存和限流状态在临时目录中（见 test_env）
+运行: python test_job_retry.py
+"""
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from test_env import create_student, isolated_workdir, project_path
+
+TEST_IMAGE = project_path("test_files", "valid_image.png")
+FIXTURES = project_path("test_files", "glm4v_fixtures.json")
+
+
+def _use_mock(profile) -> tuple:
+    """启动替身服务并让识别使用它，返回 (服务, 客户端)"""
+    import glm4v_api
+    from glm4v_api import GLM4VClient
+    from mock_glm4v_server import API_PATH, start_server
+
+    server = start_server(port=0, profile=profile, fixtures_path=FIXTURES)
+    client = GLM4VClient(api_url=f"http://127.0.0.1:{server.server_port}{API_PATH}")
+    client.max_retries = 0
+    client.breaker = None
+    glm4v_api._default_client = client
+    return server, client
+
+
+def check_transient_retry(user_id: int) -> None:
+    import extraction_jobs
+    from database import ExtractionJob, get_session
+    from extraction_jobs import MAX_ATTEMPTS, claim_job, enqueue_job, get_job_status, poll_job, run_job
+    from mock_glm4v_server import FaultProfile
+
+    server, client = _use_mock(FaultProfile(latency_median=0, error_rate=1.0, retry_after=0))
+    try:
+        job_id = enqueue_job(user_id, TEST_IMAGE, TEST_IMAGE, uuid.uuid4().hex)
+        run_job(claim_job(job_id))
+        status = get_job_status(job_id)
+        assert status["status"] == "queued" and status["error"], f"上游 500 后任务应重新排队，实际: {status}"
+        assert status["lease_expires_at"] and status["lease_expires_at"] > datetime.utcnow(), "重新排队的任务没有设置重试时间"
+        assert claim_job(job_id) is None, "重试时间之前任务不应被领取"
+
+        start = time.monotonic()
+        poll_job(job_id, inline_after=3600)
+        assert time.monotonic() - start < 1, "poll_job 阻塞了调用线程"
+
+        for _ in range(MAX_ATTEMPTS - 1):
+            with get_session() as session:
+                # 跳过重试等待
+                stored = session.get(ExtractionJob, job_id)
+                stored.lease_expires_at = None
+                session.add(stored)
+                session.commit()
+            job = claim_job(job_id)
+            assert job is not None, "到了重试时间任务应可以再次领取"
+            run_job(job)
+        status = get_job_status(job_id)
+        assert status["status"] == "failed" and status["attempts"] == MAX_ATTEMPTS, (
+            f"达到 {MAX_ATTEMPTS} 次后任务应失败，实际: {status['status']}（{status['attempts']} 次）"
+        )
+        assert extraction_jobs.RETRY_DELAY_SECONDS > 0
+    finally:
+        client.close()
+        server.shutdown()
+
+
+def check_lease_renewal(user_id: int) -> None:
+    import extraction_jobs
+    from database import ExtractionJob, get_session
+    from extraction_jobs import claim_job, enqueue_job, get_job_status, run_job
+    from mock_glm4v_server import FaultProfile
+
+    server, client = _use_mock(FaultProfile(latency_median=1.5, latency_sigma=0.01, chunk_interval=0))
+    lease_seconds = extraction_jobs.LEASE_SECONDS
+    extraction_jobs.LEASE_SECONDS = 0.6
+    try:
+        # 识别约 1.5 秒，远超 0.6 秒的租约：执行期间任务不能被再次领取
+        job_id = enqueue_job(user_id, TEST_IMAGE, TEST_IMAGE, uuid.uuid4().hex)
+        job = claim_job(job_id, lease_seconds=0.6)
+        runner = threading.Thread(target=run_job, args=(job,))
+        runner.start()
+        reclaimed = None
+        while runner.is_alive():
+            reclaimed = reclaimed or claim_job(job_id, lease_seconds=0.6)
+            time.sleep(0.1)
+        runner.join()
+        assert reclaimed is None, "执行中的任务在租约到期后被重新领取"
+        assert get_job_status(job_id)["status"] == "done", f"任务应完成，实际: {get_job_status(job_id)}"
+
+        # 租约被他人接管：原执行者的结果不写回
+        job_id = enqueue_job(user_id, TEST_IMAGE, TEST_IMAGE, uuid.uuid4().hex)
+        job = claim_job(job_id)
+        with get_session() as session:
+            stored = session.get(ExtractionJob, job_id)
+            stored.lease_token = "taken-over"
+            session.add(stored)
+            session.commit()
+        assert run_job(job) is False, "租约已被接管时 run_job 应放弃结果"
+        assert get_job_status(job_id)["status"] == "running", "租约已被接管时不应改写任务状态"
+    finally:
+        extraction_jobs.LEASE_SECONDS = lease_seconds
+        client.close()
+        server.shutdown()
+
+
+def main() -> int:
+    with isolated_workdir():
+        os.environ["GLM4V_API_KEY"] = "mock-key"
+        try:
+            user_id = create_student().user_id
+            check_transient_retry(user_id)
+            check_lease_renewal(user_id)
+        finally:
+            os.environ.pop("GLM4V_API_KEY", None)
+    print("✓ 上游临时故障时任务重新排队，次数用尽后记为失败；执行中续租，租约被接管时结果丢弃；poll_job 不阻塞")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
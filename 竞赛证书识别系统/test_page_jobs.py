@@ -0,0 +1,84 @@
+"""
+测试多页 PDF 按页识别：点击按页识别后页面立即返回（渲染和识别在后台任务中进行），
+之后的重跑查询各页任务，全部结束后每页生成一条草稿
+使用 AppTest 运行 app.py，识别请求发往本地替身服务；数据库和上传目录在临时目录中（见 test_env）
+运行: python test_page_jobs.py
+"""
+from __future__ import annotations
+
+import os
+import sys
+import time
+
+from test_env import create_student, isolated_workdir, project_path
+
+PAGES = 3
+FIXTURES = project_path("test_files", "glm4v_fixtures.json")
+
+
+def _multi_page_pdf() -> bytes:
+    import fitz
+
+    doc = fitz.open()
+    for i in range(PAGES):
+        doc.new_page().insert_text((72, 72), f"certificate page {i + 1}")
+    return doc.tobytes()
+
+
+def run() -> None:
+    from sqlmodel import select
+    from streamlit.testing.v1 import AppTest
+
+    import glm4v_api
+    from database import Certificate, get_session
+    from glm4v_api import GLM4VClient
+    from mock_glm4v_server import API_PATH, FaultProfile, start_server
+
+    server = start_server(port=0, profile=FaultProfile(latency_median=0.3, latency_sigma=0.01), fixtures_path=FIXTURES)
+    client = GLM4VClient(api_url=f"http://127.0.0.1:{server.server_port}{API_PATH}")
+    client.breaker = None
+    glm4v_api._default_client = client
+    try:
+        user = create_student()
+        at = AppTest.from_file(project_path("app.py"), default_timeout=120)
+        at.session_state["user"] = user
+        at.run()
+        at.file_uploader[0].set_value(("bundle.pdf", _multi_page_pdf(), "application/pdf"))
+        at.run()
+        button = next(b for b in at.button if "按页批量识别" in b.label)
+        start = time.monotonic()
+        button.click().run()
+        assert time.monotonic() - start < 5, "点击按页识别后页面应立即返回"
+        assert not at.exception, f"页面抛出异常: {[e.value for e in at.exception]}"
+
+        deadline = time.monotonic() + 60
+        while time.monotonic() < deadline:
+            time.sleep(1)
+            at.run()
+            if any("已生成" in s.value for s in at.success):
+                break
+        assert not at.exception, f"页面抛出异常: {[e.value for e in at.exception]}"
+        assert any(f"已生成 {PAGES} 条草稿" in s.value for s in at.success), f"未生成草稿: {[s.value for s in at.success]}"
+        with get_session() as session:
+            drafts = session.exec(
+                select(Certificate).where((Certificate.submitter_id == user.user_id) & (Certificate.page_number.is_not(None)))
+            ).all()
+        assert sorted(d.page_number for d in drafts) == list(range(1, PAGES + 1)), f"草稿页码不对: {drafts}"
+    finally:
+        client.close()
+        server.shutdown()
+
+
+def main() -> int:
+    with isolated_workdir():
+        os.environ["GLM4V_API_KEY"] = "mock-key"
+        try:
+            run()
+        finally:
+            os.environ.pop("GLM4V_API_KEY", None)
+    print(f"✓ {PAGES} 页 PDF 按页识别在后台完成，每页生成一条草稿")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
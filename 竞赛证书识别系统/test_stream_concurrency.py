@@ -0,0 +1,64 @@
+"""
+测试流式识别的并发上限：本地替身服务放慢 SSE 分片，同时发起多个流式识别，
+检查服务端同时在发送的响应数不超过限流器的 max_concurrent（名额要占用到响应体读完为止）
+数据库和限流状态在临时目录中（见 test_env）
+运行: python test_stream_concurrency.py
+"""
+from __future__ import annotations
+
+import json
+import sys
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from test_env import isolated_workdir, project_path
+
+MAX_CONCURRENT = 2
+REQUESTS = 6
+TEST_IMAGE = project_path("test_files", "valid_image.png")
+FIXTURES = project_path("test_files", "glm4v_fixtures.json")
+
+
+def run() -> int:
+    import glm4v_api
+    from api_guard import TokenBucketLimiter
+    from database import init_db
+    from glm4v_api import GLM4VClient, extract_with_glm4v
+    from mock_glm4v_server import API_PATH, FaultProfile, start_server
+
+    init_db()
+    server = start_server(port=0, profile=FaultProfile(latency_median=0, chunk_interval=0.02), fixtures_path=FIXTURES)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    try:
+        client = GLM4VClient(api_url=base_url + API_PATH)
+        client.limiter = TokenBucketLimiter(name="test_stream", rate=100, burst=100, max_concurrent=MAX_CONCURRENT)
+        client.breaker = None
+        glm4v_api._default_client = client
+
+        with ThreadPoolExecutor(max_workers=REQUESTS) as executor:
+            futures = [
+                executor.submit(extract_with_glm4v, TEST_IMAGE, api_key="mock-key", stream=True)
+                for _ in range(REQUESTS)
+            ]
+            results = [f.result() for f in futures]
+        client.close()
+        with urllib.request.urlopen(base_url + "/stats") as response:
+            stats = json.load(response)
+    finally:
+        server.shutdown()
+
+    assert len(results) == REQUESTS and all(r.get("competition_name") for r in results), f"识别结果不完整: {results}"
+    peak = stats.get("stream_peak", 0)
+    assert peak <= MAX_CONCURRENT, f"同时在读的流式响应 {peak} 个，超过上限 {MAX_CONCURRENT}"
+    return peak
+
+
+def main() -> int:
+    with isolated_workdir():
+        peak = run()
+    print(f"✓ {REQUESTS} 个流式识别全部完成，同时在读的响应最多 {peak} 个（上限 {MAX_CONCURRENT}）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,42 @@
+"""
+测试上传页面：以学生身份上传图片证书，检查预览区域（文件大小、Base64 长度）正常渲染
+使用 Streamlit 自带的 AppTest 在进程内运行 app.py，不需要启动浏览器；数据库和上传目录在临时目录中（见 test_env）
+运行: python test_upload_preview.py
+"""
+from __future__ import annotations
+
+import sys
+
+from test_env import create_student, isolated_workdir, project_path
+
+TEST_IMAGE = project_path("test_files", "valid_image.png")
+
+
+def run() -> None:
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(project_path("app.py"), default_timeout=120)
+    at.session_state["user"] = create_student()
+    at.run()
+
+    with open(TEST_IMAGE, "rb") as f:
+        content = f.read()
+    at.file_uploader[0].set_value(("valid_image.png", content, "image/png"))
+    at.run()
+
+    assert not at.exception, f"页面抛出异常: {[e.value for e in at.exception]}"
+    captions = [c.value for c in at.caption]
+    size_caption = f"📏 文件大小: {len(content) / 1024:.1f} KB"
+    assert size_caption in captions, f"未找到文件大小说明 {size_caption!r}，实际: {captions}"
+    assert not any(w.value.startswith("⚠️ 预览失败") for w in at.warning), "预览失败"
+
+
+def main() -> int:
+    with isolated_workdir():
+        run()
+    print("✓ 图片上传后预览区域正常渲染")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())